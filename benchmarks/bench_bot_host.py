@@ -0,0 +1,76 @@
+"""
+Startup time and memory of N bots run as N processes (start_bots.py) versus one bot host process (bot_host.py).
+
+Each child imports bot.py and builds its bots, including their teammates and moderators (which loads the provider
+SDK), without connecting to the hub or calling any provider. Gemini bots are used so no network is needed.
+
+    python benchmarks/bench_bot_host.py --bots 6
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def child(count):
+    # Runs in the child process: import, build `count` bots and report
+    started = time.monotonic()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("GOOGLE_DEV_API_KEY", "unused")
+    import logging
+    from bot import Bot
+    logging.disable(logging.INFO)
+    imported = time.monotonic()
+
+    params = {"temperature": "0.2", "top_p": "1.0"}
+    bots = [Bot(_id=f"bench{i}", name=f"Bench{i}", host="localhost", port=9800 + i, hub_uri="ws://localhost:9999",
+                bot_instructions="You are a teammate.", mod_instructions="You are a moderator.",
+                teammate_extra_params=params, mod_extra_params=params, llm="gemini",
+                history={"retention": "drop"})
+            for i in range(count)]
+    for b in bots:
+        b.create_llms()
+    built = time.monotonic()
+
+    print(json.dumps({
+        "bots": len(bots),
+        "import_s": imported - started,
+        "build_s": built - imported,
+        "rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }))
+
+def spawn(count):
+    started = time.monotonic()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", str(count)],
+                            capture_output=True, text=True, check=True, cwd=ROOT).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["wall_s"] = time.monotonic() - started
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot host startup and memory benchmark")
+    parser.add_argument("--bots", type=int, default=6, help="Number of bots")
+    parser.add_argument("--child", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child)
+        return
+
+    separate = [spawn(1) for _ in range(args.bots)]
+    host = spawn(args.bots)
+
+    rss = sum(r["rss_mib"] for r in separate)
+    wall = sum(r["wall_s"] for r in separate)
+    print(f"bots: {args.bots}")
+    print(f"{'one process per bot':24} total RSS {rss:8.1f} MiB ({rss / args.bots:6.1f} MiB/bot)  "
+          f"startup {wall:6.2f}s summed ({wall / args.bots:5.2f}s/bot)")
+    print(f"{'bot host':24} total RSS {host['rss_mib']:8.1f} MiB ({host['rss_mib'] / args.bots:6.1f} MiB/bot)  "
+          f"startup {host['wall_s']:6.2f}s ({host['wall_s'] / args.bots:5.2f}s/bot, import {host['import_s']:.2f}s)")
+
+if __name__ == "__main__":
+    main()
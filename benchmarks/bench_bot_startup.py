@@ -0,0 +1,72 @@
+"""
+Time from launching `bot.py` to the bot showing up in the hub's `who` list. Needs a hub running (cli_hub.py);
+the bot uses a throwaway id and Gemini with a dummy key, so it never calls a provider.
+
+    python benchmarks/bench_bot_startup.py --runs 5
+
+For where the import time goes, run a bot with `python -X importtime bot.py ...`; the bot also logs
+`[startup]` timings (provider imports, hub registration, ready to respond).
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from start_bots import hub_presence
+
+POLL_INTERVAL = 0.01
+
+def bot_command(bot_id, hub_uri):
+    params = json.dumps({"temperature": "0.2", "top_p": "1.0"})
+    return [sys.executable, "bot.py", "--id", bot_id, "--name", "Startup", "--host", "localhost", "--port", "9899",
+            "--hub_uri", hub_uri, "--instruction-file", "instructions/moderator_instructions.txt",
+            "--moderator-instruction-file", "instructions/moderator_instructions.txt",
+            "--teammate-extra-params", params, "--mod-extra-params", params, "--llm", "gemini",
+            "--history", json.dumps({"retention": "drop"})]
+
+async def time_registration(bot_id, hub_uri, timeout):
+    env = dict(os.environ, GOOGLE_DEV_API_KEY=os.environ.get("GOOGLE_DEV_API_KEY", "unused"))
+    started = time.monotonic()
+    process = subprocess.Popen(bot_command(bot_id, hub_uri), cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.monotonic() - started < timeout:
+            present = await hub_presence(hub_uri)
+            if present is None:
+                raise SystemExit(f"Can't reach the hub at {hub_uri}; start cli_hub.py first")
+            if bot_id in present:
+                return time.monotonic() - started
+            await asyncio.sleep(POLL_INTERVAL)
+        return None
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=10)
+
+async def run(runs, hub_uri, timeout):
+    results = []
+    for i in range(runs):
+        elapsed = await time_registration(f"startup_bench_{os.getpid()}_{i}", hub_uri, timeout)
+        print(f"run {i + 1}: " + (f"registered after {elapsed * 1000:.0f}ms" if elapsed is not None else "never registered"))
+        if elapsed is not None:
+            results.append(elapsed)
+    if results:
+        results.sort()
+        print(f"median {results[len(results) // 2] * 1000:.0f}ms  min {results[0] * 1000:.0f}ms  max {results[-1] * 1000:.0f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot startup (time to hub registration) benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Number of bot launches")
+    parser.add_argument("--hub-uri", type=str, default="ws://localhost:9999", help="WebSocket URI of a running hub")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a bot to register")
+    args = parser.parse_args()
+    asyncio.run(run(args.runs, args.hub_uri, args.timeout))
+
+if __name__ == "__main__":
+    main()
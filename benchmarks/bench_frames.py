@@ -0,0 +1,65 @@
+"""
+Microbenchmark for the hub's per-message hot loop: parse an incoming msg_recvd frame, stamp it,
+encode it and hand it to every recipient's outbound queue.
+
+"before" is the old path (stdlib json.loads + json.dumps); "after" is the frames module, which
+uses orjson when it's installed and encodes each frame exactly once.
+
+    python benchmarks/bench_frames.py --messages 50000 --recipients 30
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import frames
+
+SAMPLE = json.dumps({
+    "type": "msg_recvd",
+    "from": "gabe",
+    "origin": "human",
+    "message": "Hey team, can someone summarize where we landed on the caching design? " * 3
+})
+
+TIMESTAMP = "2024-05-24 12:00:00"
+
+def before(raw, queues):
+    message = json.loads(raw)
+    message["timestamp"] = TIMESTAMP
+    data = json.dumps(message)
+    for queue in queues:
+        queue.append(data)
+
+def after(raw, queues):
+    message = frames.loads(raw)
+    frame = frames.chat_frame(message, TIMESTAMP)
+    for queue in queues:
+        queue.append(frame.data)
+
+def run(fn, messages, recipients):
+    queues = [deque(maxlen=256) for _ in range(recipients)]
+    start = time.process_time()
+    for _ in range(messages):
+        fn(SAMPLE, queues)
+    elapsed = time.process_time() - start
+    return elapsed / messages * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Hub frame encoding microbenchmark")
+    parser.add_argument("--messages", type=int, default=50000, help="Number of messages to push through the loop")
+    parser.add_argument("--recipients", type=int, default=30, help="Number of connected teammates to fan out to")
+    args = parser.parse_args()
+
+    before_us = run(before, args.messages, args.recipients)
+    after_us = run(after, args.messages, args.recipients)
+
+    print(f"codec: {frames.JSON_CODEC}, messages: {args.messages}, recipients: {args.recipients}")
+    print(f"before: {before_us:.2f} us CPU/message")
+    print(f"after:  {after_us:.2f} us CPU/message ({before_us / after_us:.2f}x)")
+
+if __name__ == "__main__":
+    main()
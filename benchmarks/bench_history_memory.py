@@ -0,0 +1,81 @@
+"""
+Memory-per-message benchmark for a bot's ConversationHistory.
+
+"before" is the old representation: one dict per message holding the text twice (in `text` and as a
+formatted `[name] text` part). "after" is the compact ConversationHistory, with and without a Gemini view
+requested (views are built per call and not kept, so asking for one shouldn't add anything), plus a bounded
+history using the default retention limit.
+
+    python benchmarks/bench_history_memory.py --messages 100000
+"""
+import os
+import sys
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from conversation_history import ConversationHistory, DEFAULT_MAX_MESSAGES, RETENTION_DROP
+
+NAMES = ["gabe", "Alex", "Jordan", "Casey", "Jasper", "Agent"]
+WORDS = "the team should look at caching the moderator decisions before we ship the next version of the hub".split()
+
+def make_messages(count):
+    random.seed(0)
+    messages = []
+    for i in range(count):
+        name = random.choice(NAMES)
+        role = "user" if name == "gabe" else "ai"
+        # Copy the name the way json.loads would hand it to us: a fresh str per message
+        messages.append((role, "".join(list(name)), " ".join(random.choices(WORDS, k=random.randint(5, 60)))))
+    return messages
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, kept
+
+def old_history(messages):
+    history = []
+    for role, name, text in messages:
+        history.append({
+            "role": role,
+            "name": name,
+            "text": text,
+            "parts": [{"text": f"[{name}] {text}"}]
+        })
+    return history
+
+def new_history(messages, with_view=False, max_messages=None):
+    history = ConversationHistory(max_messages=max_messages, retention=RETENTION_DROP)
+    for role, name, text in messages:
+        history.add_message(role, name, text)
+    if with_view:
+        history.get_history_gemini()
+    return history
+
+def main():
+    parser = argparse.ArgumentParser(description="ConversationHistory memory benchmark")
+    parser.add_argument("--messages", type=int, default=100000, help="Number of messages to store")
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    # Message texts are owned by the caller in both cases; only count what the history itself adds
+    cases = [
+        ("before (dict + duplicated parts)", lambda: old_history(messages)),
+        ("after (slots, no views)", lambda: new_history(messages)),
+        ("after (slots, gemini view requested)", lambda: new_history(messages, with_view=True)),
+        (f"after (bounded to {DEFAULT_MAX_MESSAGES})", lambda: new_history(messages, with_view=True, max_messages=DEFAULT_MAX_MESSAGES)),
+    ]
+
+    print(f"messages: {args.messages}")
+    for label, build in cases:
+        used, _ = measure(build)
+        print(f"{label:40} {used / 2**20:8.1f} MiB  {used / args.messages:8.1f} bytes/message")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Bytes uploaded per turn by an OpenAI teammate, against the in-memory fake of the Assistants API (no network,
+no API key needed).
+
+"before" is the old behavior: create_and_run with the whole conversation every turn. "after" keeps one thread
+and only syncs what's new. The script also checks that the synced thread holds exactly the conversation.
+
+    python benchmarks/bench_openai_sync.py --turns 200 --messages-per-turn 3
+"""
+import os
+import sys
+import random
+import asyncio
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bot import OpenAIAPIHandler
+from conversation_history import ConversationHistory, RETENTION_DROP
+from fake_assistants import FakeAsyncOpenAI
+from rate_limiter import get_rate_limiter
+
+WORDS = "the team should look at caching the moderator decisions before we ship the next version of the hub".split()
+
+def human_message():
+    return " ".join(random.choices(WORDS, k=random.randint(5, 40)))
+
+async def run(turns, messages_per_turn, incremental):
+    random.seed(0)
+    client = FakeAsyncOpenAI()
+    handler = OpenAIAPIHandler(assistant_id="asst_fake", usage_label="bench", client=client, assistant=client.assistant)
+    history = ConversationHistory(max_messages=None, retention=RETENTION_DROP)
+    per_turn = []
+
+    for _ in range(turns):
+        for _ in range(messages_per_turn):
+            history.add_message("user", "gabe", human_message())
+        before = client.bytes_uploaded
+        if incremental:
+            reply = await handler.reply(history)
+        else:
+            reply = await handler.interact(history.get_history_openai())
+        history.add_message("ai", "bench", reply)
+        per_turn.append(client.bytes_uploaded - before)
+
+    if incremental:
+        # The thread should hold the same conversation, with each turn's messages folded into one
+        expected = []
+        for message in history.get_history_openai():
+            if expected and expected[-1][0] == message["role"]:
+                expected[-1] = (message["role"], expected[-1][1] + "\n\n" + message["content"])
+            else:
+                expected.append((message["role"], message["content"]))
+        assert client.thread_contents(handler.thread_id) == expected, "thread out of sync with the conversation"
+    return per_turn, client
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI thread sync benchmark")
+    parser.add_argument("--turns", type=int, default=200, help="Number of teammate replies")
+    parser.add_argument("--messages-per-turn", type=int, default=3, help="Human messages between replies")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    get_rate_limiter("gpt").configure(10**9, 10**12)
+
+    for label, incremental in [("before (create_and_run, full history)", False), ("after (persistent thread, incremental)", True)]:
+        per_turn, client = asyncio.run(run(args.turns, args.messages_per_turn, incremental))
+        print(f"{label:40} total {sum(per_turn) / 2**10:10.1f} KiB  last turn {per_turn[-1]:8d} bytes  "
+              f"mean {sum(per_turn) / len(per_turn):10.1f} bytes/turn  threads left {len(client.threads)}")
+    print("thread contents match the conversation")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+End-to-end load test of the hub and bots, fully offline. It starts a hub on its own port, a bot host with N Gemini
+bots talking to a local fake LLM server (fake_llm.py), and M synthetic human clients that connect the way
+cli.CLIClient does and chat at a steady rate. Everything runs in a scratch directory that's removed afterwards.
+
+    python benchmarks/loadtest.py --humans 50 --bots 10 --duration 30 --json loadtest.json
+
+Reports human message throughput, fan-out latency (from a human sending a message to each other human
+receiving it), the hub's CPU and RSS, and LLM calls per human message. Hub CPU/RSS are read from /proc, so
+those numbers are Linux only.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import websockets
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+
+from fake_llm import FakeLLMServer, DEFAULT_LATENCY, DEFAULT_TOKENS_PER_SECOND, DEFAULT_REPLY_TOKENS, DEFAULT_YES_RATE
+from start_bots import hub_presence
+
+ROOM = "main"
+MARKER = "[lt "  # Prefix of every synthetic human message: "[lt <sender> <n>] text"
+TEXT = "has anyone looked at the numbers from the last release and can we talk about them".split()
+SAMPLE_INTERVAL = 0.5  # Seconds between hub CPU/RSS samples
+STARTUP_TIMEOUT = 30
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+class ProcessSampler:
+    # CPU time and resident memory of one process, from /proc
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.rss_samples = []
+        self.cpu_start = None
+        self.wall_start = None
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks  # utime + stime
+
+    def rss_mib(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0
+
+    def start(self):
+        self.cpu_start = self.cpu_seconds()
+        self.wall_start = time.monotonic()
+
+    def sample(self):
+        self.rss_samples.append(self.rss_mib())
+
+    def result(self):
+        cpu = self.cpu_seconds() - self.cpu_start
+        wall = time.monotonic() - self.wall_start
+        return {"cpu_s": cpu, "cpu_percent": 100 * cpu / wall if wall else 0,
+                "rss_peak_mib": max(self.rss_samples, default=0), "rss_end_mib": self.rss_samples[-1] if self.rss_samples else 0}
+
+class SyntheticHuman:
+    """
+    A human client: registers like cli.CLIClient, sends a message every 1/rate seconds on average (Poisson) and
+    records when every other human's message reaches it. With mention_rate, that share of its messages @mentions
+    a random bot, and it records how long the bot takes to start answering.
+    """
+    def __init__(self, _id, hub_uri, rate, sent_at, latencies, counters, bots=0, mention_rate=0, mention_latencies=None, turns=None,
+                 record_turns=False):
+        self._id = _id
+        self.hub_uri = hub_uri
+        self.rate = rate
+        self.sent_at = sent_at
+        self.latencies = latencies
+        self.counters = counters
+        self.bots = bots
+        self.mention_rate = mention_rate
+        self.mention_latencies = mention_latencies
+        self.awaiting = {}  # Bot id -> when we @mentioned it, until it starts replying
+        # Shared by every human: when the last human message went out, and the time from it to each bot
+        # reply's first token. Every human gets every reply, so only one of them (record_turns) records those.
+        self.turns = turns
+        self.record_turns = record_turns
+        self.websocket = None
+        self.sent = 0
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.hub_uri, max_size=None)
+        await self.websocket.send(json.dumps({
+            "type": "cli_connect",
+            "name": self._id.title(),
+            "id": self._id,
+            "origin": "human",
+            "host": "localhost",
+            "port": 0,
+            "rooms": [ROOM],
+            "replay": 0
+        }))
+
+    async def receive(self):
+        async for raw in self.websocket:
+            now = time.monotonic()
+            message = json.loads(raw)
+            msg_type = message.get("type")
+            if msg_type in ["msg_recvd", "msg_delta"] and message.get("from") in self.awaiting:
+                self.mention_latencies.append(now - self.awaiting.pop(message["from"]))
+            if msg_type == "msg_recvd":
+                text = message.get("message", "")
+                if text.startswith(MARKER):
+                    key = text[len(MARKER):text.index("]")]
+                    if key in self.sent_at:
+                        self.latencies.append(now - self.sent_at[key])
+                        self.counters["deliveries"] += 1
+                elif message.get("origin") == "ai":
+                    self.counters["bot_replies_seen"] += 1
+            elif msg_type == "msg_delta":
+                self.counters["deltas_seen"] += 1
+                if self.record_turns and self.turns["last_sent"] is not None and message.get("stream_id") not in self.turns["streams"]:
+                    self.turns["streams"].add(message.get("stream_id"))
+                    self.turns["latencies"].append(now - self.turns["last_sent"])
+
+    async def chat(self, rng, until):
+        while True:
+            await asyncio.sleep(rng.expovariate(self.rate))
+            if time.monotonic() >= until:
+                return
+            key = f"{self._id} {self.sent}"
+            self.sent += 1
+            text = f"{MARKER}{key}] " + " ".join(rng.choices(TEXT, k=rng.randint(4, 16)))
+            mentioned = None
+            if self.bots and rng.random() < self.mention_rate:
+                mentioned = rng.randrange(self.bots)
+                text = text.replace("] ", f"] @Bot{mentioned} ", 1)
+            self.sent_at[key] = time.monotonic()
+            if self.turns is not None:
+                self.turns["last_sent"] = self.sent_at[key]
+            if mentioned is not None:
+                self.awaiting.setdefault(f"ltbot{mentioned}", self.sent_at[key])
+            await self.websocket.send(json.dumps({"type": "msg_recvd", "from": self._id, "origin": "human", "room": ROOM, "message": text}))
+
+def bots_child(count, hub_uri, llm_url, debounce, single_call=False):
+    # Runs in the bot host process: N Gemini bots whose provider is the fake LLM server
+    import bot
+    from bot_host import BotHost
+    from fake_llm import FakeGenAI
+
+    # Same ratio between the two windows as in production
+    bot.MAX_COALESCE_WINDOW = bot.MAX_COALESCE_WINDOW * debounce / bot.DEBOUNCE_WINDOW
+    bot.DEBOUNCE_WINDOW = debounce
+    bot.PROVIDERS["gemini"] = FakeGenAI(llm_url)
+    params = {"temperature": "0.2", "top_p": "1.0"}
+    bots = [bot.Bot(_id=f"ltbot{i}", name=f"Bot{i}", host="localhost", port=0, hub_uri=hub_uri,
+                    bot_instructions="You are a teammate.", mod_instructions="You are a moderator.",
+                    teammate_extra_params=params, mod_extra_params=params, llm="gemini", rooms=[ROOM],
+                    rate_limit={"rpm": 10**6, "tpm": 10**9}, history={"retention": "drop"}, single_call=single_call)
+            for i in range(count)]
+    try:
+        asyncio.run(BotHost(bots, hub_uri).run())
+    except KeyboardInterrupt:
+        pass
+
+async def wait_for_ids(hub_uri, ids):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        present = await hub_presence(hub_uri)
+        if present is not None and ids <= present:
+            return
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {len(ids)} clients to register with the hub")
+
+def stop(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+async def run(args, workdir):
+    hub_uri = f"ws://localhost:{args.hub_port}"
+    llm = FakeLLMServer(port=args.llm_port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                        reply_tokens=args.reply_tokens, yes_rate=args.yes_rate, seed=args.seed)
+    await llm.start()
+
+    log = open(os.path.join(workdir, "processes.log"), "w")
+    hub = subprocess.Popen([sys.executable, os.path.join(ROOT, "cli_hub.py"), "--port", str(args.hub_port)],
+                           cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    bots = None
+    try:
+        await wait_for_ids(hub_uri, set())
+        if args.bots:
+            bots = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--bots-child", str(args.bots),
+                                     "--hub-uri", hub_uri, "--llm-url", llm.url(), "--debounce", str(args.debounce)]
+                                    + (["--single-call"] if args.single_call else []),
+                                    cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                                    env=dict(os.environ, GOOGLE_DEV_API_KEY="unused"))
+            await wait_for_ids(hub_uri, {f"ltbot{i}" for i in range(args.bots)})
+
+        sent_at, latencies, mention_latencies = {}, [], []
+        counters = {"deliveries": 0, "bot_replies_seen": 0, "deltas_seen": 0}
+        turns = {"last_sent": None, "streams": set(), "latencies": []}
+        humans = [SyntheticHuman(f"lthuman{i}", hub_uri, args.rate, sent_at, latencies, counters, bots=args.bots,
+                                 mention_rate=args.mention_rate, mention_latencies=mention_latencies, turns=turns,
+                                 record_turns=i == 0)
+                  for i in range(args.humans)]
+        for human in humans:
+            await human.connect()
+        receivers = [asyncio.create_task(human.receive()) for human in humans]
+        await asyncio.sleep(1)  # Let join events and replays settle
+
+        sampler = ProcessSampler(hub.pid)
+        sampler.start()
+        started = time.monotonic()
+        until = started + args.duration
+        rng = random.Random(args.seed)
+        chatters = [asyncio.create_task(human.chat(random.Random(rng.random()), until)) for human in humans]
+        llm_before = llm.stats()
+
+        # Bots keep answering each other after the humans stop, so the drain only gives in-flight replies time to land
+        while time.monotonic() < until + args.drain:
+            sampler.sample()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+        hub_usage = sampler.result()
+        elapsed = time.monotonic() - started
+
+        for task in chatters + receivers:
+            task.cancel()
+        for human in humans:
+            await human.websocket.close()
+    finally:
+        if bots is not None:
+            stop(bots)
+        stop(hub)
+        await llm.stop()
+        log.close()
+
+    sent = sum(human.sent for human in humans)
+    llm_stats = {k: v - llm_before[k] for k, v in llm.stats().items()}
+    llm_calls = llm_stats["moderator_calls"] + llm_stats["teammate_calls"] + llm_stats["turn_calls"]
+    expected = sent * (args.humans - 1)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ["json", "bots_child", "hub_uri", "llm_url", "keep"]},
+        "human_messages": sent,
+        "human_messages_per_s": sent / args.duration,
+        "deliveries": counters["deliveries"],
+        "deliveries_per_s": counters["deliveries"] / elapsed,
+        "lost_deliveries": expected - counters["deliveries"],
+        "fanout_latency_ms": {p: (percentile(latencies, int(p[1:])) or 0) * 1000 for p in ["p50", "p90", "p99"]}
+                             | {"max": max(latencies, default=0) * 1000},
+        "hub": hub_usage | {"cpu_ms_per_message": 1000 * hub_usage["cpu_s"] / sent if sent else 0},
+        "llm": llm_stats | {"calls_per_human_message": llm_calls / sent if sent else 0},
+        # None rather than 0 when no reply came back, so an empty run doesn't look like a fast one
+        "turn_latency_ms": {p: percentile(turns["latencies"], int(p[1:])) * 1000 if turns["latencies"] else None
+                            for p in ["p50", "p90"]}
+                           | {"replies": len(turns["latencies"])},
+        "mention_reply_ms": {p: (percentile(mention_latencies, int(p[1:])) or 0) * 1000 for p in ["p50", "p90"]}
+                            | {"answered": len(mention_latencies)},
+        "bot_replies": counters["bot_replies_seen"] // max(1, args.humans),
+        "deltas_per_human": counters["deltas_seen"] // max(1, args.humans)
+    }
+
+def report(result):
+    latency = result["fanout_latency_ms"]
+    hub = result["hub"]
+    llm = result["llm"]
+    print(f"human messages      {result['human_messages']} ({result['human_messages_per_s']:.1f}/s)")
+    print(f"deliveries          {result['deliveries']} ({result['deliveries_per_s']:.0f}/s, {result['lost_deliveries']} lost)")
+    print(f"fan-out latency     p50 {latency['p50']:.1f}ms  p90 {latency['p90']:.1f}ms  p99 {latency['p99']:.1f}ms  max {latency['max']:.1f}ms")
+    print(f"hub                 CPU {hub['cpu_percent']:.1f}% ({hub['cpu_ms_per_message']:.2f}ms/message)  "
+          f"RSS peak {hub['rss_peak_mib']:.1f} MiB  end {hub['rss_end_mib']:.1f} MiB")
+    print(f"LLM calls           {llm['moderator_calls']} moderator + {llm['teammate_calls']} teammate + {llm['turn_calls']} single-call "
+          f"({llm['calls_per_human_message']:.2f} per human message)")
+    print(f"bot replies         {result['bot_replies']} ({result['deltas_per_human']} msg_delta frames per human)")
+    turn = result["turn_latency_ms"]
+    if turn["replies"]:
+        print(f"turn latency        p50 {turn['p50']:.0f}ms  p90 {turn['p90']:.0f}ms  ({turn['replies']} replies; last human message to a reply's first token)")
+    else:
+        print(f"turn latency        n/a (0 replies)")
+    mention = result["mention_reply_ms"]
+    if mention["answered"]:
+        print(f"@mention to reply   p50 {mention['p50']:.0f}ms  p90 {mention['p90']:.0f}ms  ({mention['answered']} answered)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the hub and bots")
+    parser.add_argument("--humans", type=int, default=50, help="Synthetic human clients")
+    parser.add_argument("--bots", type=int, default=10, help="Bots (Gemini, backed by the fake LLM server)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds the humans chat for")
+    parser.add_argument("--drain", type=float, default=5, help="Seconds to keep measuring after the humans stop, so replies land")
+    parser.add_argument("--rate", type=float, default=0.2, help="Messages per second per human")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Fake LLM seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_TOKENS_PER_SECOND, help="Fake LLM streaming speed")
+    parser.add_argument("--reply-tokens", type=int, default=DEFAULT_REPLY_TOKENS, help="Fake LLM teammate reply length")
+    parser.add_argument("--mention-rate", type=float, default=0, help="Share of human messages that @mention a random bot")
+    parser.add_argument("--yes-rate", type=float, default=DEFAULT_YES_RATE, help="Share of moderator calls answered YES")
+    parser.add_argument("--single-call", action="store_true", help="Bots decide and respond in one LLM call instead of asking a moderator first")
+    parser.add_argument("--debounce", type=float, default=0.5, help="Bots' debounce window in seconds (3 in production)")
+    parser.add_argument("--hub-port", type=int, default=9990, help="Port for the test hub")
+    parser.add_argument("--llm-port", type=int, default=9700, help="Port for the fake LLM server")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for message timing and moderator answers")
+    parser.add_argument("--json", type=str, default=None, help="Also write the results to this file, for tracking regressions")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory (hub and bot logs)")
+    parser.add_argument("--bots-child", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--hub-uri", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--llm-url", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bots_child is not None:
+        bots_child(args.bots_child, args.hub_uri, args.llm_url, args.debounce, single_call=args.single_call)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    try:
+        result = asyncio.run(run(args, workdir))
+    finally:
+        if args.keep:
+            print(f"logs kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,26 @@
+import time
+STARTED = time.perf_counter()  # Startup timings in the log are measured from here
+
 import os
+import re
 import json
+import threading
+import importlib
+import uuid
 import asyncio
 import websockets
 import argparse
 import logging
-import google.generativeai as genai
-from google.generativeai.types import content_types, generation_types
+import functools
+from types import SimpleNamespace
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from openai import OpenAI
+from rate_limiter import configure_rate_limiter, get_rate_limiter, estimate_tokens, TokenUsage
+from tracing import span
+from metrics import Counter, Histogram, REGISTRY, run_with_metrics
+from decision_cache import decision_key, decision_cache_from_config
+from conversation_history import ConversationHistory, DEFAULT_MAX_MESSAGES, RETENTION_SPILL, spill_filename
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename='bot.log', filemode='a')
@@ -16,74 +29,203 @@ console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logging.getLogger().addHandler(console_handler)
 
-genai.configure(api_key=os.environ['GOOGLE_DEV_API_KEY'])
-
 MOD_TEMP = 0.2
 MOD_TOP_P = 1.0
 
 MODEL = "gemini-1.5-flash-latest"
-DELAY = 45
-DELAY_OPENAI = 20
-PROCESSING_INTERVAL = 15  # Time in seconds between processing messages
+DEBOUNCE_WINDOW = 3  # Seconds of quiet after a new message before the bot evaluates the conversation
+MAX_COALESCE_WINDOW = 15  # Longest a continuous burst of messages can hold off an evaluation
+MENTION_WINDOW = 0.5  # Seconds of quiet the bot waits after being @mentioned, for a follow-up line, before answering
 MAX_RETRIES = 5  # Maximum number of retries for WebSocket connection
 KEEPALIVE_INTERVAL = 120  # Increase keepalive interval
 
 RECENT_HISTORY_NUMBER = 25
+MODERATOR_WINDOW = 10  # Most recent messages a teammate hands its moderator
+PASS_MARKER = "PASS"  # What a single-call teammate answers when it has nothing to add
+PASS_LOOKAHEAD = 24  # Characters of a single-call reply held back from the stream until it's clearly not a PASS
+MODERATOR_CONTEXT_TURNS = 0  # Earlier decisions a Gemini moderator remembers; 0 makes every call stateless
+BLOCKING_CALL_WORKERS = 8  # Threads for SDK calls that don't have a native async version
+REPLAY_COUNT = 100  # Messages to ask the hub to replay when the bot first connects
+MESSAGE_QUEUE_SIZE = 200  # New messages a room can buffer between evaluations
+OPENAI_CONTEXT_MESSAGES = 100  # Most recent thread messages an OpenAI run reads (its truncation strategy)
+MAX_SYNC_MESSAGES = 32  # Messages the Assistants API accepts in one request
+DEFAULT_ROOM = "main"
+ASSISTANT_CACHE_FILE = os.path.join(".bot-cache", "assistants.json")
+ASSISTANT_CACHE_TTL = 24 * 60 * 60  # Seconds an assistant's model/instructions are trusted before looking them up again
+
+MODERATOR_CALL_SECONDS = Histogram("bot_moderator_call_seconds", "Time for a moderator's LLM call, including rate limiter waits", ["bot", "provider"])
+TEAMMATE_CALL_SECONDS = Histogram("bot_teammate_call_seconds", "Time to generate a whole teammate reply", ["bot", "provider"])
+TEAMMATE_FIRST_TOKEN_SECONDS = Histogram("bot_teammate_first_token_seconds", "Time to the first streamed token of a teammate reply", ["bot", "provider"])
+MESSAGES_RECEIVED = Counter("bot_messages_received_total", "Chat messages received from the hub", ["bot", "room"])
+REPLIES_SENT = Counter("bot_replies_sent_total", "Replies sent to the hub", ["bot", "room"])
+SCHEDULER_EVENTS = Counter("bot_scheduler_events_total", "Scheduler wakeups, coalesced messages, evaluations, skipped evaluations and mention fast paths", ["bot", "event"])
+DECISION_CACHE_LOOKUPS = Counter("bot_decision_cache_lookups_total", "Moderator decision cache lookups", ["bot", "result"])
+
+# Provider SDK calls can take many seconds. They must never run directly on the event loop, or the
+# websocket reader and keepalive freeze and the hub drops us on a ping timeout.
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_CALL_WORKERS, thread_name_prefix="provider")
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(fn, *args, **kwargs))
+
+def since_start():
+    return f"{(time.perf_counter() - STARTED) * 1000:.0f}ms"
+
+# The provider SDKs take most of a bot's startup time to import (google.generativeai alone is close to a second),
+# so a provider is only loaded when a bot that uses it sets up its teammate, and only once per process.
+# Bots set up off the event loop, and a bot host can set up several at once, hence the lock.
+PROVIDERS = {}
+provider_lock = threading.RLock()
+
+def timed_import(module_name):
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    logging.info(f"[startup] Imported {module_name} in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return module
+
+def load_gemini():
+    with provider_lock:
+        if "gemini" not in PROVIDERS:
+            # Only Gemini bots need a Google key
+            api_key = os.environ.get("GOOGLE_DEV_API_KEY")
+            if not api_key:
+                raise Exception("GOOGLE_DEV_API_KEY must be set to run Gemini bots")
+            genai = timed_import("google.generativeai")
+            genai.configure(api_key=api_key)
+            PROVIDERS["gemini"] = genai
+        return PROVIDERS["gemini"]
+
+def load_openai():
+    with provider_lock:
+        if "gpt" not in PROVIDERS:
+            PROVIDERS["gpt"] = timed_import("openai")
+        return PROVIDERS["gpt"]
+
+async def gemini_send_message(chat, message, stream=False):
+    # Use the SDK's native async call when there is one, otherwise the bounded thread pool
+    send_message_async = getattr(chat, "send_message_async", None)
+    if send_message_async is not None:
+        return await send_message_async(message, stream=stream)
+    return await run_blocking(chat.send_message, message, stream=stream)
+
+async def iterate_chunks(response):
+    # Streamed responses from the async SDK are async iterables; the blocking fallback's are plain
+    # iterators, so each chunk is fetched on the thread pool
+    if hasattr(response, "__aiter__"):
+        async for chunk in response:
+            yield chunk
+        return
+    iterator = iter(response)
+    while (chunk := await run_blocking(next, iterator, None)) is not None:
+        yield chunk
+
+def chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        # Chunks without text (e.g. just a finish reason) raise instead of returning ""
+        return ""
+
+async def gemini_generate(model, contents):
+    # One-off generation with no chat session behind it
+    generate_content_async = getattr(model, "generate_content_async", None)
+    if generate_content_async is not None:
+        return await generate_content_async(contents)
+    return await run_blocking(model.generate_content, contents)
+
+def turn_prompt(name, recent_text):
+    # For single-call teammates: the decision the moderator would make, and the reply, in one request
+    return (f"Here are the latest messages in the chat:\n\n{recent_text}\n\n"
+            f"Your name is {name}. If you should not speak next (nobody needs you, or someone else is better placed "
+            f"to answer), respond with exactly {PASS_MARKER} and nothing else. Otherwise respond with only your "
+            f"message to the chat, without your name or any label in front of it.")
+
+def strip_speaker(text, name):
+    # Models copy the transcript's "[Name] " format or add a label ("Jasper:", "Reply:"); take those off the front
+    label = rf"(?:\[\s*{re.escape(name)}\s*\]\s*:?|{re.escape(name)}\s*:|(?:reply|response|yes)\s*[:|])"
+    return re.sub(rf"^\s*(?:{label}\s*)*", "", text, flags=re.IGNORECASE)
+
+def parse_turn(text, name):
+    """
+    The reply from a single-call teammate, or None if it passed. Accepts format drift: PASS in any case when it's
+    the whole answer, wrapped in quotes, brackets or markdown ("**PASS**", "[PASS]", "Pass."), or an upper case
+    PASS followed by an explanation. "Pass the tests first" and "No." are still replies.
+    """
+    text = strip_speaker(text, name)
+    bare = text.strip(" \t\n*_`\"'[](){}.!:-").upper()
+    if bare in [PASS_MARKER, ""]:
+        return None
+    if re.match(rf"^[\s*_`\"'\[(]*{PASS_MARKER}\b", text):
+        return None
+    return text.strip()
+
+def gemini_history_tokens(history, message=""):
+    return estimate_tokens(message + "".join(part["text"] for entry in history for part in entry["parts"]))
+
+def gemini_usage(response):
+    return response.usage_metadata.total_token_count
+
+def record_gemini_usage(usage, response):
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is not None:
+        usage.record(metadata.prompt_token_count, metadata.candidates_token_count)
+
+class ReplyStream:
+    """
+    Forwards a reply to the hub as msg_delta frames while it's being generated, and times it. The final
+    msg_recvd carries the same stream_id so clients can swap their partial copy for the complete text.
+    """
+    def __init__(self, websocket, bot_id, room_id):
+        self.websocket = websocket
+        self.bot_id = bot_id
+        self.room_id = room_id
+        self.stream_id = f"{bot_id}-{uuid.uuid4().hex[:12]}"
+        self.started = None
+        self.first_token = None
+        self.finished = None
+        self.chunks = 0
+        # Set when a single-call teammate decided not to speak; nothing was streamed
+        self.passed = False
+
+    def start(self):
+        # Called right before the provider call, so the moderator's decision doesn't count toward latency
+        self.started = time.monotonic()
+
+    async def send(self, delta):
+        if not delta:
+            return
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+        self.chunks += 1
+        await self.websocket.send(json.dumps({
+            "type": "msg_delta",
+            "from": self.bot_id,
+            "origin": "ai",
+            "room": self.room_id,
+            "stream_id": self.stream_id,
+            "delta": delta
+        }))
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def wall_time(self, monotonic_time):
+        # Traces use wall clock time so they line up with the hub's
+        if monotonic_time is None:
+            return None
+        return monotonic_time + (time.time() - time.monotonic())
+
+    def ttft(self):
+        if self.started is None or self.first_token is None:
+            return None
+        return self.first_token - self.started
+
+    def total(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
 
-class ConversationHistory:
-    def __init__(self):
-        self.history = []
-
-    def add_message(self, role, name, text):
-        self.history.append({
-            "role": role,
-            "name": name,
-            "text": text,
-            "parts": [{"text": f"[{name}] {text}"}]
-        })
-
-    def get_history_gemini(self, limit=-1):
-        if limit < 0:
-            history = self.history
-        else:
-            history = self.history[:limit]
-
-        modified_history = []
-        for entry in history:
-            role = entry["role"]
-            parts = entry["parts"]
-
-            if role == "ai":
-                role = "model"
-
-            modified_history.append({
-                "role": role,
-                "parts": parts
-            })
-        
-        return modified_history
-    
-    def get_history_openai(self, limit=-1):
-        if limit < 0:
-            history = self.history
-        else:
-            history = self.history[:limit]
-
-        modified_history = []
-        for entry in history:
-            role = entry["role"]
-            content = entry["text"]
-
-            if role == "ai":
-                role = "assistant"
-
-            modified_history.append({
-                "role": role,
-                "content": content
-            })
-        
-        return modified_history
-    
 class GeminiTeammate:
     def __init__(self, name, model_name, system_instructions, conversation_history, extra_params):
         temperature = float(extra_params.get("temperature"))
@@ -91,23 +233,23 @@ class GeminiTeammate:
 
         logging.info(f"[+] Bot got system instruction: {system_instructions[:20]}")
         logging.info(f"[+] Bot is being initialized with temperature {temperature} and top_p {top_p}")
-        config = generation_types.GenerationConfig(temperature=temperature, top_p=top_p)
+        genai = load_gemini()
+        config = genai.GenerationConfig(temperature=temperature, top_p=top_p)
 
         self.name = name
         self.model = genai.GenerativeModel(model_name, generation_config=config, system_instruction=system_instructions)
+        self.rate_limiter = get_rate_limiter("gemini")
+        self.usage = TokenUsage(name, bot=name, role="teammate")
 
         # Pass in a reference to the Bot instance's "official" conversation history so we can update
         # it in self.send_message()
         self.conversation_history = conversation_history
 
-    async def allow_send_message(self, moderator):
+    async def allow_send_message(self, moderator, new_messages=0, stream=None):
         # `moderator` should ALWAYS be a GeminiModerator type
         
-        # Get the current chat history at this moment
-        current_chat_history = self.conversation_history.get_history_gemini()
-
-        # Take the last 10 messages for the moderator
-        recent_history = current_chat_history[:10]
+        # Take the last MODERATOR_WINDOW messages for the moderator (more if more than that are new)
+        recent_history = self.conversation_history.get_history_gemini(limit=max(MODERATOR_WINDOW, new_messages))
 
         # Ask the teammate moderator if this teammate should speak next...
         # It will return a tuple (bool, str)
@@ -115,18 +257,78 @@ class GeminiTeammate:
         # If yes, the moderator should have generated a summary to give the teammate to help them respond with accuracy
         should_speak, summary = await moderator.should_speak_next(recent_history)
         if should_speak:
-            # If the bot should speak next, send it the entire chat history
+            # If the bot should speak next, send it the entire chat history (only built now, so a NO costs nothing)
+            current_chat_history = self.conversation_history.get_history_gemini()
             # The 'summary' is the message we send it. This is how it works for Gemini, but when we
             # create the ChatGPT teammate, I don't think this will be necessary; it will just need the
             # chat history
-            response = await self.send_message(message=summary, history=current_chat_history)
+            response = await self.send_message(message=summary, history=current_chat_history, stream=stream)
 
             return response
         
         return None
 
-    async def send_message(self, message, history):
-        await asyncio.sleep(DELAY)
+    async def respond(self, summary, stream=None):
+        # Floor control already decided this teammate should speak; the summary is what it's being asked
+        return await self.send_message(message=summary, history=self.conversation_history.get_history_gemini(), stream=stream)
+
+    async def decide_and_respond(self, new_messages=0, stream=None):
+        # Single-call mode: no moderator. The recent window goes in the prompt (the rest of the conversation
+        # is the chat history) and the teammate either answers or says PASS, all in one request.
+        history = self.conversation_history.get_history_gemini()
+        window = max(MODERATOR_WINDOW, new_messages)
+        recent_text = "\n".join(entry["parts"][0]["text"] for entry in history[-window:])
+        message = turn_prompt(self.name, recent_text)
+        history = history[:-window]
+        chat = self.model.start_chat(history=history)
+
+        estimated_tokens = gemini_history_tokens(history, message)
+        if stream is not None:
+            stream.start()
+        response = await self.rate_limiter.call(lambda: gemini_send_message(chat, message, stream=True), estimated_tokens)
+
+        # Nothing goes out until the start of the answer shows it isn't a PASS
+        parts = []
+        held = ""
+        decided = False
+        forward = stream
+        async for chunk in iterate_chunks(response):
+            text = chunk_text(chunk)
+            if not text:
+                continue
+            parts.append(text)
+            if decided:
+                if forward is not None:
+                    await forward.send(text)
+                continue
+            held += text
+            if len(held.strip()) >= PASS_LOOKAHEAD:
+                decided = True
+                if parse_turn(held, self.name) is None:
+                    forward = None  # A PASS with an explanation after it; keep reading for the usage, but don't stream it
+                elif forward is not None:
+                    await forward.send(strip_speaker(held, self.name))
+
+        try:
+            self.rate_limiter.record_usage(estimated_tokens, gemini_usage(response))
+            record_gemini_usage(self.usage, response)
+        except Exception as e:
+            logging.debug(f"[gemini] Couldn't read token usage: {e}")
+
+        reply = parse_turn("".join(parts), self.name)
+        if reply is None:
+            logging.info(f"[{self.llm_type()}] {self.name} passed")
+            if stream is not None:
+                stream.passed = True
+            return None
+        if not decided and stream is not None:
+            await stream.send(reply)  # Short enough that it was all held back
+
+        self.conversation_history.add_message("ai", self.name, reply)
+        logging.info(f"[{self.llm_type()}] {self.name} response: {reply}")
+        return reply
+
+    async def send_message(self, message, history, stream=None):
         logging.info(f"{self.name} is processing the most current chat history to respond")
 
         # Initialize a new chat with the current chat history every time we need a response.
@@ -138,8 +340,25 @@ class GeminiTeammate:
         # need to send it a message in order to get a response, so the moderator takes the
         # recent chat history and creates a summary for this teammate to succinctly and 
         # accurately capture the context in which this teammate should respond.
-        response = chat.send_message(message)
-        reply = response.text
+        # The reply is streamed: every chunk goes out to the hub as soon as it arrives
+        estimated_tokens = gemini_history_tokens(history, message)
+        if stream is not None:
+            stream.start()
+        response = await self.rate_limiter.call(lambda: gemini_send_message(chat, message, stream=True), estimated_tokens)
+        parts = []
+        async for chunk in iterate_chunks(response):
+            text = chunk_text(chunk)
+            if text:
+                parts.append(text)
+                if stream is not None:
+                    await stream.send(text)
+        reply = "".join(parts)
+
+        try:
+            self.rate_limiter.record_usage(estimated_tokens, gemini_usage(response))
+            record_gemini_usage(self.usage, response)
+        except Exception as e:
+            logging.debug(f"[gemini] Couldn't read token usage: {e}")
 
         # If they have a response to send in the chat, add it to the conversation history
         self.conversation_history.add_message("ai", self.name, reply)
@@ -152,19 +371,29 @@ class GeminiTeammate:
         return "Gemini"
     
 class GeminiModerator:
-    def __init__(self, model_name, system_instructions, teammate_name, extra_params):
+    def __init__(self, model_name, system_instructions, teammate_name, extra_params, decision_cache=None):
         temperature = float(extra_params.get("temperature"))
         top_p = float(extra_params.get("top_p"))
         
         logging.info(f"[+] Mod got system instruction: {system_instructions[:20]}")
         logging.info(f"[+] Mod is being initialized with temperature {temperature} and top_p {top_p}")
-        config = generation_types.GenerationConfig(temperature=temperature, top_p=top_p)
+        genai = load_gemini()
+        config = genai.GenerationConfig(temperature=temperature, top_p=top_p)
         self.model = genai.GenerativeModel(model_name, generation_config=config, system_instruction=system_instructions)
         self.teammate_name = teammate_name
-        self.chat = self.model.start_chat()
+        self.rate_limiter = get_rate_limiter("gemini")
+        self.usage = TokenUsage(f"{teammate_name}'s moderator", bot=teammate_name, role="moderator")
+        # Decisions are cached on everything that goes into the call, so an unchanged window is answered locally
+        self.decision_cache = decision_cache
+        self.cache_prefix = ("gemini", model_name, system_instructions, temperature, top_p, teammate_name)
+
+        # Every prompt already carries the recent conversation, so the moderator doesn't need a chat session
+        # (which would resend every earlier prompt and answer on each call). At most `context_turns` earlier
+        # decisions are kept, so the cost of a call stays flat no matter how long the session runs.
+        context_turns = int(extra_params.get("context_turns", MODERATOR_CONTEXT_TURNS))
+        self.context = deque(maxlen=2 * context_turns)
 
     async def should_speak_next(self, chat_history):
-        await asyncio.sleep(DELAY)
         recent_history = chat_history[-RECENT_HISTORY_NUMBER:]  # Get the last 10 messages
         history_text = "\n".join([f"{entry['parts'][0]['text']}" for entry in recent_history])
 
@@ -180,12 +409,32 @@ class GeminiModerator:
         # to respond to: `reponse = chat.send_message("something")`. It doesn't work like this with OpenAI; for that,
         # all we need to do is pass in the conversation history and let it run and do its thing.
 
-        response = self.chat.send_message(prompt)
+        contents = list(self.context) + [{"role": "user", "parts": [{"text": prompt}]}]
+        key = None
+        if self.decision_cache is not None:
+            key = decision_key(*self.cache_prefix, contents)
+            cached = self.decision_cache.get(key)
+            if cached is not None:
+                logging.info(f"[cache] Moderator for {self.teammate_name} reused its decision for this window ({self.decision_cache.stats})")
+                return tuple(cached)
+
+        with MODERATOR_CALL_SECONDS.time(bot=self.teammate_name, provider="gemini"):
+            response = await self.rate_limiter.call(lambda: gemini_generate(self.model, contents),
+                                                    gemini_history_tokens(contents), usage=gemini_usage)
+        record_gemini_usage(self.usage, response)
 
         response = response.text.strip()
+        self.context.extend(contents[-1:] + [{"role": "model", "parts": [{"text": response}]}])
 
         logging.info(f"Moderator for {self.teammate_name}'s response: {response}")
 
+        decision = self.parse_decision(response)
+        if key is not None and decision is not None:
+            self.decision_cache.put(key, list(decision))
+        return decision or (False, "")
+
+    def parse_decision(self, response):
+        # (should_speak, summary), or None if the response doesn't follow the format (those aren't cached)
         if '|' in response:
             answer, summary = response.split('|')
             if answer.lower() in ["yes", "y"]:
@@ -197,59 +446,206 @@ class GeminiModerator:
                 return False, ""
 
         logging.warn(f"Moderator for {self.teammate_name} had an invalid response: {response}")
-        return False, ""
+        return None
         
     def llm_type(self):
         return "gemini"
     
+# One client (and so one HTTP connection pool) per process, shared by every OpenAI teammate and moderator
+OPENAI_CLIENTS = {}
+ASSISTANTS = {}
+
+def get_openai_client():
+    with provider_lock:
+        if "async" not in OPENAI_CLIENTS:
+            OPENAI_CLIENTS["async"] = load_openai().AsyncOpenAI()
+        return OPENAI_CLIENTS["async"]
+
+def load_assistant_cache():
+    try:
+        with open(ASSISTANT_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_assistant_cache(cache):
+    os.makedirs(os.path.dirname(ASSISTANT_CACHE_FILE), exist_ok=True)
+    tmp_file = ASSISTANT_CACHE_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_file, ASSISTANT_CACHE_FILE)
+
+def retrieve_assistant(assistant_id):
+    # A teammate and its moderator often use the same assistant; only look it up once per process, and
+    # only once per ASSISTANT_CACHE_TTL across restarts. The lookup is a blocking call, so bots make it off
+    # the event loop (see Bot.prepare).
+    with provider_lock:
+        if assistant_id in ASSISTANTS:
+            return ASSISTANTS[assistant_id]
+
+        cache = load_assistant_cache()
+        cached = cache.get(assistant_id)
+        if cached is not None and time.time() - cached["fetched_at"] < ASSISTANT_CACHE_TTL:
+            logging.info(f"[startup] Using cached metadata for assistant {assistant_id}")
+        else:
+            if "sync" not in OPENAI_CLIENTS:
+                OPENAI_CLIENTS["sync"] = load_openai().OpenAI()
+            started = time.perf_counter()
+            assistant = OPENAI_CLIENTS["sync"].beta.assistants.retrieve(assistant_id)
+            logging.info(f"[startup] Retrieved assistant {assistant_id} in {(time.perf_counter() - started) * 1000:.0f}ms")
+            cached = {
+                "id": assistant.id,
+                "model": assistant.model,
+                "instructions": assistant.instructions,
+                "temperature": assistant.temperature,
+                "top_p": assistant.top_p,
+                "fetched_at": time.time()
+            }
+            cache[assistant_id] = cached
+            try:
+                save_assistant_cache(cache)
+            except OSError as e:
+                logging.warning(f"Couldn't write the assistant cache: {e}")
+
+        ASSISTANTS[assistant_id] = SimpleNamespace(**cached)
+        return ASSISTANTS[assistant_id]
+
+def merge_messages(messages):
+    # Folds runs of messages with the same role into one, so a sync fits in a single request
+    merged = []
+    for message in messages:
+        if not message["content"]:
+            continue  # The API rejects empty messages
+        if merged and merged[-1]["role"] == message["role"]:
+            merged[-1] = {"role": message["role"], "content": merged[-1]["content"] + "\n\n" + message["content"]}
+        else:
+            merged.append(message)
+    return merged
+
 class OpenAIAPIHandler:
-    def __init__(self, assistant_id):
-        self.client = OpenAI()
-        self.assistant = self.client.beta.assistants.retrieve(assistant_id)
+    """
+    Talks to one OpenAI assistant. A teammate keeps a single thread for the whole session: each turn only
+    uploads the messages added to the conversation since the last sync, and the run only reads the last
+    `context_messages` messages of the thread. Moderator checks (interact) use a throwaway thread instead.
+    """
+    def __init__(self, assistant_id, usage_label=None, context_messages=OPENAI_CONTEXT_MESSAGES, client=None, assistant=None, bot=None, role=None):
+        self.client = client or get_openai_client()
+        self.assistant = assistant or retrieve_assistant(assistant_id)
+        self.rate_limiter = get_rate_limiter("gpt")
+        self.usage = TokenUsage(usage_label or assistant_id, bot=bot, role=role)
+        self.context_messages = context_messages
+
+        self.thread_id = None
+        self.synced_cursor = None  # Conversation history cursor the thread is up to date with
+        self.bytes_uploaded = 0
+
+    def truncation_strategy(self):
+        return {"type": "last_messages", "last_messages": self.context_messages}
+
+    async def reply(self, conversation_history, stream=None):
+        # Our own replies were written to the thread by the run that produced them, so only sync everyone else's
+        if self.thread_id is None:
+            new_messages = conversation_history.get_history_openai(limit=self.context_messages)
+        else:
+            new_messages = [m for m in conversation_history.get_history_openai(since=self.synced_cursor) if m["role"] != "assistant"]
+        cursor = conversation_history.cursor()
+
+        new_messages = merge_messages(new_messages)
+        if len(new_messages) > MAX_SYNC_MESSAGES:
+            # Can only happen on a fresh thread; the oldest of these would be truncated away anyway
+            new_messages = new_messages[-MAX_SYNC_MESSAGES:]
+        if not new_messages:
+            return None
+
+        uploaded = sum(len(m["content"].encode()) for m in new_messages)
+        estimated_tokens = estimate_tokens("".join(m["content"] for m in new_messages))
+
+        try:
+            if self.thread_id is None:
+                thread = await self.rate_limiter.call(lambda: self.client.beta.threads.create(messages=new_messages), estimated_tokens)
+                self.thread_id = thread.id
+                # The thread holds these messages now, even if the run below fails; don't send them again
+                self.synced_cursor = cursor
+                logging.info(f"[gpt] Started thread {self.thread_id} with {len(new_messages)} messages")
+                new_messages = []
+            if stream is not None:
+                stream.start()
+            events = await self.rate_limiter.call(lambda: self.client.beta.threads.runs.create(
+                thread_id=self.thread_id,
+                assistant_id=self.assistant.id,
+                additional_messages=new_messages,
+                truncation_strategy=self.truncation_strategy(),
+                stream=True
+            ), estimated_tokens)
+        except Exception as e:
+            if getattr(e, "status_code", None) == 404:
+                # The thread is gone (deleted or expired); start over with a new one next turn
+                logging.warning(f"[gpt] Thread {self.thread_id} not found; starting a new one")
+                self.thread_id = None
+            raise
+
+        self.synced_cursor = cursor
+        self.bytes_uploaded += uploaded
+        logging.info(f"[gpt] Synced {uploaded} bytes to thread {self.thread_id} ({self.bytes_uploaded} total)")
+
+        reply, _ = await self.read_run(events, estimated_tokens, stream)
+        return reply
 
     async def interact(self, history):
-        # TODO: Eventually add truncation strategy
-        run = self.client.beta.threads.create_and_run(
+        estimated_tokens = estimate_tokens("".join(entry["content"] for entry in history))
+        events = await self.rate_limiter.call(lambda: self.client.beta.threads.create_and_run(
             assistant_id=self.assistant.id,
             thread={
                 "messages": history
-            }
-        )
-
-        run_id = run.id
-        thread_id = run.thread_id
-
-        while run.status not in ["cancelled", "failed", "completed", "expired"]:
-            logging.info(f"OpenAI API Run is not done yet ({run.status})...")
-            await asyncio.sleep(1)
-            run = self.client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run_id
-            )
-
-        if run.status == "completed":
-            messages = self.client.beta.threads.messages.list(
-                thread_id=thread_id,
-                run_id=run_id
-            )
-
-            if messages.data:
-                constructed_msg = ""
-                for msg in messages.data:
-                    text = msg.content[0].text.value             
-                    constructed_msg += text
-
-                logging.info(f"[gpt] Assistant Run - response:\n{constructed_msg}")
-
-                return constructed_msg
-            
-            else:
-                logging.warn(f"[gpt] Assistant Run doesn't appear to have generated messages")
+            },
+            truncation_strategy=self.truncation_strategy(),
+            stream=True
+        ), estimated_tokens)
+
+        reply, thread_id = await self.read_run(events, estimated_tokens)
+        if thread_id is not None:
+            # One-off thread; don't leave it behind
+            try:
+                await self.client.beta.threads.delete(thread_id)
+            except Exception as e:
+                logging.debug(f"[gpt] Couldn't delete thread {thread_id}: {e}")
+        return reply
 
-        else:
-            logging.warn(f"[gpt] Assistant Run ended with status {run.status}")
-            
-        return None
+    async def read_run(self, events, estimated_tokens, stream=None):
+        # Reads a streamed run as it happens (no polling): text deltas are forwarded as they arrive, and the
+        # run's final event carries its status and token usage
+        parts = []
+        thread_id = None
+        run = None
+        async for event in events:
+            if event.event == "thread.message.delta":
+                for content in event.data.delta.content or []:
+                    text = getattr(getattr(content, "text", None), "value", None)
+                    if text:
+                        parts.append(text)
+                        if stream is not None:
+                            await stream.send(text)
+            elif event.event.startswith("thread.run."):
+                thread_id = event.data.thread_id
+                if event.event in ["thread.run.completed", "thread.run.failed", "thread.run.cancelled",
+                                   "thread.run.expired", "thread.run.incomplete"]:
+                    run = event.data
+
+        if run is not None and run.usage is not None:
+            self.rate_limiter.record_usage(estimated_tokens, run.usage.total_tokens)
+            self.usage.record(run.usage.prompt_tokens, run.usage.completion_tokens)
+
+        if run is None or run.status != "completed":
+            logging.warn(f"[gpt] Assistant Run ended with status {run.status if run is not None else 'unknown'}")
+            return None, thread_id
+
+        if not parts:
+            logging.warn(f"[gpt] Assistant Run doesn't appear to have generated messages")
+            return None, thread_id
+
+        constructed_msg = "".join(parts)
+        logging.info(f"[gpt] Assistant Run - response:\n{constructed_msg}")
+        return constructed_msg, thread_id
     
 class OpenAITeammate:
     def __init__(self, name, model_name, system_instructions, conversation_history, extra_params):
@@ -260,7 +656,8 @@ class OpenAITeammate:
 
         self.name = name
 
-        self.handler = OpenAIAPIHandler(assistant_id=asst_id)
+        self.handler = OpenAIAPIHandler(assistant_id=asst_id, usage_label=name, bot=name, role="teammate",
+                                        context_messages=int(extra_params.get("context_messages", OPENAI_CONTEXT_MESSAGES)))
         assistant = self.handler.assistant
 
         model_name = assistant.model
@@ -273,29 +670,31 @@ class OpenAITeammate:
         logging.info(f"[+] OpenAI [{model_name}] got system instruction: {system_instructions[:20]}")
         logging.info(f"[+] Bot is being initialized with temperature {temperature} and top_p {top_p}")
 
-    async def allow_send_message(self, moderator):
+    async def allow_send_message(self, moderator, new_messages=0, stream=None):
         # `moderator` should ALWAYS be a OpenAIModerator type
 
-        # Get the current chat history at this moment
-        current_chat_history = self.conversation_history.get_history_openai()
-
-        # Take the last 10 messages for the moderator
-        recent_history = current_chat_history[:10]
+        # Take the last MODERATOR_WINDOW messages for the moderator (more if more than that are new)
+        recent_history = self.conversation_history.get_history_openai(limit=max(MODERATOR_WINDOW, new_messages))
 
         should_speak = await moderator.should_speak_next(recent_history)
         if should_speak:
-            response = await self.send_message(history=current_chat_history)
+            response = await self.send_message(stream=stream)
 
             return response
         
         return None
+
+    async def respond(self, summary, stream=None):
+        # The assistant reads the conversation from its thread, so floor control's summary isn't needed
+        return await self.send_message(stream=stream)
         
-    async def send_message(self, history):
-        await asyncio.sleep(DELAY)
+    async def send_message(self, message=None, history=None, stream=None):
+        # The assistant's thread is synced from self.conversation_history, so `message` and `history` aren't used
         logging.info(f"[{self.llm_type()}] {self.name} is processing chat history")
 
-        response = await self.handler.interact(history)
-        self.conversation_history.add_message("ai", self.name, response)
+        response = await self.handler.reply(self.conversation_history, stream=stream)
+        if response:
+            self.conversation_history.add_message("ai", self.name, response)
 
         return response
     
@@ -303,16 +702,20 @@ class OpenAITeammate:
         return "gpt"
     
 class OpenAIModerator:
-    def __init__(self, model_name, system_instructions, teammate_name, extra_params):
+    def __init__(self, model_name, system_instructions, teammate_name, extra_params, decision_cache=None):
         """
         model_name, system_instructions, conversation_history will all likely be None/empty for OpenAI teammates since we're loading assistants already created in OpenAI interface
         """
         asst_id = extra_params.get("assistant_id")
 
-        self.handler = OpenAIAPIHandler(assistant_id=asst_id)
+        self.handler = OpenAIAPIHandler(assistant_id=asst_id, usage_label=f"{teammate_name}'s moderator",
+                                        bot=teammate_name, role="moderator")
         assistant = self.handler.assistant
 
         self.teammate_name = teammate_name
+        self.usage = self.handler.usage
+        self.decision_cache = decision_cache
+        self.cache_prefix = ("gpt", assistant.id, assistant.model, assistant.instructions, teammate_name)
 
         model_name = assistant.model
         system_instructions = assistant.instructions
@@ -323,8 +726,6 @@ class OpenAIModerator:
         logging.info(f"[+] Mod is being initialized with temperature {temperature} and top_p {top_p}")
 
     async def should_speak_next(self, chat_history):
-        await asyncio.sleep(DELAY_OPENAI)
-
         recent_history = chat_history[-RECENT_HISTORY_NUMBER:] # Get the last 10 messages
         print("MOD")
         print(recent_history)
@@ -335,12 +736,25 @@ class OpenAIModerator:
             "content": prompt,
         })
 
-        response = await self.handler.interact(recent_history)
+        key = None
+        if self.decision_cache is not None:
+            key = decision_key(*self.cache_prefix, recent_history)
+            cached = self.decision_cache.get(key)
+            if cached is not None:
+                logging.info(f"[cache] Moderator for {self.teammate_name} reused its decision for this window ({self.decision_cache.stats})")
+                return cached
+
+        with MODERATOR_CALL_SECONDS.time(bot=self.teammate_name, provider="gpt"):
+            response = await self.handler.interact(recent_history)
 
         if response.lower() in ["yes", "y"]:
+            if key is not None:
+                self.decision_cache.put(key, True)
             return True
         
         elif response.lower() in ["no", "n"]:
+            if key is not None:
+                self.decision_cache.put(key, False)
             return False
         
         logging.warn(f"[{self.llm_type()}] Moderator for {self.teammate_name} doesn't seemd to have generated a proper response: {response}")
@@ -362,71 +776,225 @@ class AI_Teammate:
 
         logging.info(f"[+] Created an a teammate with LLM of type {self.llm.llm_type()}")
 
-    async def allow_send_message(self, moderator):
-        return await self.llm.allow_send_message(moderator=moderator)
+    async def allow_send_message(self, moderator, new_messages=0, stream=None):
+        return await self.llm.allow_send_message(moderator=moderator, new_messages=new_messages, stream=stream)
 
-    async def send_message(self, message, history):
-        return await self.llm.send_message(message=message, history=history)
+    async def respond(self, summary, stream=None):
+        return await self.llm.respond(summary, stream=stream)
+
+    async def decide_and_respond(self, new_messages=0, stream=None):
+        return await self.llm.decide_and_respond(new_messages=new_messages, stream=stream)
+
+    async def send_message(self, message, history, stream=None):
+        return await self.llm.send_message(message=message, history=history, stream=stream)
 
 class AIModerator:
-    def __init__(self, model_name, system_instructions, teammate_name, extra_params, llm=GeminiModerator):
+    def __init__(self, model_name, system_instructions, teammate_name, extra_params, llm=GeminiModerator, decision_cache=None):
         self.llm = llm(
             model_name=model_name,
             system_instructions=system_instructions,
             teammate_name=teammate_name,
-            extra_params=extra_params
+            extra_params=extra_params,
+            decision_cache=decision_cache
         )
 
         logging.info(f"[+] Created a moderator for teammate {teammate_name} with LLM of type {self.llm.llm_type()}")
 
+    @property
+    def usage(self):
+        return self.llm.usage
+
     async def should_speak_next(self, chat_history):
         return await self.llm.should_speak_next(chat_history)
 
+def mention_summary(name, addressed):
+    # Stands in for the moderator's summary when the teammate was @mentioned
+    return (f"Your name is {name} and {addressed['from']} mentioned you directly in this chat, so you should respond. "
+            f"Here is what they wrote: {addressed['text']}")
+
+class SchedulerStats:
+    def __init__(self):
+        self.wakeups = 0  # Times a new message woke the scheduler
+        self.coalesced_messages = 0  # Messages folded into an evaluation that another message triggered
+        self.evaluations = 0  # Times the teammate/moderator actually looked at the conversation
+        self.skipped_evaluations = 0  # Wake-ups that ended without an LLM call because nothing was actionable
+        self.mentions = 0  # Evaluations that went straight to the teammate because someone @mentioned the bot
+
+    def add(self, other):
+        self.wakeups += other.wakeups
+        self.coalesced_messages += other.coalesced_messages
+        self.evaluations += other.evaluations
+        self.skipped_evaluations += other.skipped_evaluations
+        self.mentions += other.mentions
+
+    def __str__(self):
+        return (f"wakeups={self.wakeups} coalesced_messages={self.coalesced_messages} "
+                f"evaluations={self.evaluations} skipped_evaluations={self.skipped_evaluations} mentions={self.mentions}")
+
+class MessageQueue:
+    """
+    Bounded queue of history entries that arrived since the room's last evaluation. The entries are the same
+    objects the ConversationHistory holds, so queueing a message doesn't copy it.
+
+    When it overflows, the oldest entries are dropped. Nothing is lost: the entries are still in the
+    history, and the decision loop reads them from there (see Bot.wait_for_messages).
+    """
+    def __init__(self, maxsize=MESSAGE_QUEUE_SIZE):
+        self.entries = deque(maxlen=maxsize)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, entry):
+        if len(self.entries) == self.entries.maxlen:
+            self.dropped += 1
+        self.entries.append(entry)
+        self.ready.set()
+
+    async def get(self):
+        while not self.entries:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.entries.popleft()
+
+    def drain(self):
+        entries = list(self.entries)
+        self.entries.clear()
+        overflowed = self.dropped > 0
+        self.dropped = 0
+        return entries, overflowed
+
+    def empty(self):
+        return not self.entries
+
+    def qsize(self):
+        return len(self.entries)
+
+class BotRoom:
+    """
+    Everything a bot keeps per room it has joined: its own conversation history, teammate and moderator
+    (no moderator when the room's floor control service decides who speaks).
+    """
+    def __init__(self, room_id, teammate, moderator, conversation_history):
+        self.room_id = room_id
+        self.teammate = teammate
+        self.moderator = moderator
+        self.conversation_history = conversation_history
+        self.message_queue = MessageQueue()
+        # Summaries from floor_grant frames, when floor control is on
+        self.grants = asyncio.Queue()
+        # Sequence number of the last message seen from the hub, so a reconnect only replays what was missed
+        self.last_seq = None
+        # Sequence number of the newest message the last evaluation covered
+        self.evaluated_seq = None
+        # Conversation history cursor as of the last evaluation
+        self.turn_cursor = conversation_history.cursor()
+        self.stats = SchedulerStats()
+        # Hub id of the newest message from someone else; our reply names it as its parent
+        self.latest_msg_id = None
+        # Traced messages (ones the hub stamped with hops) waiting for the next evaluation. Bounded like the
+        # message queue: with floor control a bot that's rarely granted the floor would otherwise keep them all.
+        self.traced = deque(maxlen=MESSAGE_QUEUE_SIZE)
+        # The newest message that @mentioned this bot since the last evaluation ({"from": ..., "text": ...})
+        self.addressed = None
+        # Sequence numbers of messages that @mentioned someone else and not us; they don't need a moderator call
+        self.addressed_elsewhere = set()
+
 class Bot:
-    def __init__(self, _id, name, host, port, hub_uri, bot_instructions, mod_instructions, teammate_extra_params, mod_extra_params, llm):
+    def __init__(self, _id, name, host, port, hub_uri, bot_instructions, mod_instructions, teammate_extra_params, mod_extra_params, llm, rooms=None, rate_limit=None, history=None, floor_control=False, decision_cache=None, single_call=False):
         self._id = _id
         self.name = name
         self.host = host
         self.port = port
         self.hub_uri = hub_uri
+        # With floor control, one shared moderator (floor_control.py) decides who speaks and sends grants
+        self.floor_control = floor_control
 
-        if llm == 'gemini':
+        if llm not in ['gemini', 'gpt']:
+            raise Exception("No LLM provided!")
+        # In single-call mode the teammate decides whether to speak and answers in one request, so there's no
+        # moderator. Only Gemini teammates support it (an assistant's run can't come back empty); floor control wins.
+        self.single_call = single_call and llm == 'gemini' and not floor_control
+        if single_call and not self.single_call:
+            logging.warning(f"{name} can't use single-call mode ({'floor control decides who speaks' if floor_control else 'Gemini only'}); keeping the usual moderator")
+        self.llm = llm
+        self.bot_instructions = bot_instructions
+        self.mod_instructions = mod_instructions
+        self.teammate_extra_params = teammate_extra_params
+        self.mod_extra_params = mod_extra_params
+
+        # Every teammate and moderator for this provider in the process shares one rate limiter
+        configure_rate_limiter(llm, rate_limit)
+
+        # How many messages to keep in memory per room, and what to do with older ones
+        history = history or {}
+        max_messages = history.get("max_messages", DEFAULT_MAX_MESSAGES)
+        retention = history.get("retention", RETENTION_SPILL)
+
+        # Teammates and moderators are created by prepare(), after the bot has registered with the hub
+        self.rooms = {}
+        for room_id in rooms or [DEFAULT_ROOM]:
+            conversation_history = ConversationHistory(max_messages=max_messages, retention=retention,
+                                                       spill_file=spill_filename(_id, room_id))
+            self.rooms[room_id] = BotRoom(room_id, None, None, conversation_history)
+
+        # Shared by the moderators in every room; None when turned off in the bot's JSON file
+        self.decision_cache = decision_cache_from_config(_id, decision_cache)
+
+        REGISTRY.on_collect(self.collect_metrics)
+
+        self.ready = asyncio.Event()
+        self.prepare_task = None
+        self.failed = None
+
+    def create_llms(self):
+        # Imports the provider SDK and builds each room's teammate and moderator. Blocking (imports, and a
+        # possible assistant lookup), so it runs on the thread pool.
+        if self.llm == 'gemini':
             llm_type_teammate = GeminiTeammate
             llm_type_moderator = GeminiModerator
-        elif llm == 'gpt':
+        else:
             llm_type_teammate = OpenAITeammate
             llm_type_moderator = OpenAIModerator
-        else:
-            raise Exception("No LLM provided!")
 
-        self.conversation_history = ConversationHistory()
-        self.teammate = AI_Teammate(name=name, model_name=MODEL, system_instructions=bot_instructions,
-                                    conversation_history=self.conversation_history, extra_params=teammate_extra_params,
-                                    llm=llm_type_teammate)
-        self.moderator = AIModerator(model_name=MODEL, system_instructions=mod_instructions, teammate_name=name, extra_params=mod_extra_params, llm=llm_type_moderator)
-        self.message_queue = asyncio.Queue()
+        for room in self.rooms.values():
+            room.teammate = AI_Teammate(name=self.name, model_name=MODEL, system_instructions=self.bot_instructions,
+                                        conversation_history=room.conversation_history, extra_params=self.teammate_extra_params,
+                                        llm=llm_type_teammate)
+            if not self.floor_control and not self.single_call:
+                room.moderator = AIModerator(model_name=MODEL, system_instructions=self.mod_instructions, teammate_name=self.name,
+                                             extra_params=self.mod_extra_params, llm=llm_type_moderator,
+                                             decision_cache=self.decision_cache)
+
+    async def prepare(self):
+        # Messages that arrive in the meantime are queued as usual; the rooms only start evaluating once this is done
+        try:
+            await run_blocking(self.create_llms)
+        except Exception as e:
+            logging.error(f"{self.name} couldn't set up its {self.llm} teammate: {e}")
+            self.failed = e
+            return
+        self.ready.set()
+        logging.info(f"[startup] {self.name} is ready to respond ({since_start()} since start)")
 
     async def connect(self):
         retries = 0
-        while retries < MAX_RETRIES:
+        while retries < MAX_RETRIES and self.failed is None:
             try:
                 async with websockets.connect(self.hub_uri, ping_interval=KEEPALIVE_INTERVAL) as websocket:
                     # Register bot with the hub
-                    connect_msg = {
-                        "type": "ai_connect",
-                        "name": self.name,
-                        "id": self._id,
-                        "origin": "ai",
-                        "host": self.host,
-                        "port": self.port
-                    }
-                    await websocket.send(json.dumps(connect_msg))
-
-                    # Start the message processing task
-                    asyncio.create_task(self.process_messages(websocket))
-
-                    async for message in websocket:
-                        await self.handle_message(message)
+                    await websocket.send(json.dumps(self.connect_message()))
+                    logging.info(f"[startup] {self.name} registered with the hub ({since_start()} since start)")
+                    tasks = self.start_tasks(websocket)
+                    # A bot that can't set up its teammate is no use; drop the connection and exit so the supervisor sees it
+                    self.prepare_task.add_done_callback(lambda task: self.failed is not None and asyncio.ensure_future(websocket.close()))
+
+                    try:
+                        async for message in websocket:
+                            await self.handle_message(message)
+                    finally:
+                        # Don't leave schedulers from a dead connection competing for the message queues
+                        for task in tasks:
+                            task.cancel()
             except websockets.exceptions.ConnectionClosedError as e:
                 logging.error(f"{self.name} WebSocket connection error: {e}")
                 retries += 1
@@ -436,45 +1004,230 @@ class Bot:
                 logging.error(f"Unexpected error: {e}")
                 break
 
+    def connect_message(self):
+        connect_msg = {
+            "type": "ai_connect",
+            "name": self.name,
+            "id": self._id,
+            "origin": "ai",
+            "host": self.host,
+            "port": self.port,
+            "rooms": list(self.rooms.keys()),
+            "replay": REPLAY_COUNT
+        }
+        since_seq = {room.room_id: room.last_seq for room in self.rooms.values() if room.last_seq is not None}
+        if since_seq:
+            connect_msg["since_seq"] = since_seq
+        return connect_msg
+
+    def start_tasks(self, websocket):
+        # Teammates are set up once, in the background, and survive reconnects
+        if self.prepare_task is None:
+            self.prepare_task = asyncio.create_task(self.prepare())
+
+        # A message processing task for each room
+        process = self.process_grants if self.floor_control else self.process_messages
+        return [asyncio.create_task(process(websocket, room)) for room in self.rooms.values()]
+
     async def handle_message(self, message_obj_str):
         # Some kind of message has been received via websocket
         try:
-            message = json.loads(message_obj_str)
+            self.dispatch(json.loads(message_obj_str))
+        except Exception as e:
+            logging.error(f"Error handling message: {e}")
+
+    def dispatch(self, message):
+        # Takes an already parsed message, so a bot host can parse once for all of its bots
+        try:
             # Get the message type so we know what to do with it
             msg_type = message.get("type")
 
-            if msg_type == "msg_recvd":
+            room = self.rooms.get(message.get("room", DEFAULT_ROOM))
+            if room is None and msg_type in ["history_replay", "msg_recvd", "floor_grant"]:
+                logging.warning(f"{self.name} got a {msg_type} for room {message.get('room')} it didn't join")
+                return
+
+            if msg_type == "history_replay":
+                # The hub is catching us up on what was said before we (re)connected
+                self.load_replay(room, message)
+
+            elif msg_type == "msg_recvd":
                 # If it's a message saying that a new message has been sent to the chat...
                 sender = message.get("from")
                 msg = message.get("message")
+                if not isinstance(msg, str):
+                    # The scheduler and the LLM prompts expect text
+                    logging.warning(f"{self.name} got a non-text message from {sender} in {room.room_id}: {msg!r}")
+                    msg = ""
+                room.last_seq = message.get("seq", room.last_seq)
 
-                # Add it to the chat history (even if it's an event)...
-                self.conversation_history.add_message("user", sender, msg)
+                MESSAGES_RECEIVED.inc(bot=self.name, room=room.room_id)
 
-                # And as long as it's not an event notification, add it to the message queue for the next time this bot is able to process messages
-                if not msg.startswith("[EVENT]"):
-                    await self.message_queue.put(message)
+                # Add it to the chat history (even if it's an event)...
+                entry = room.conversation_history.add_message("user", sender, msg, seq=message.get("seq"))
+
+                # The hub lists who the message @mentions by id. Only people's mentions skip the moderator: a bot
+                # mentioning another bot goes through the usual decision, or replies could set each other off forever.
+                mentions = message.get("mentions")
+                if mentions and sender != self._id and message.get("origin") == "human":
+                    if self._id in mentions:
+                        room.addressed = {"from": sender, "text": msg}
+                    elif entry.seq is not None:
+                        room.addressed_elsewhere.add(entry.seq)
+
+                if message.get("msg_id") is not None:
+                    room.latest_msg_id = message["msg_id"]
+                    if "hops" in message:
+                        room.traced.append({"msg_id": message["msg_id"], "received_at": time.time(), "hops": message["hops"]})
+
+                # And wake up the room's scheduler
+                room.message_queue.put(entry)
+
+            elif msg_type == "floor_grant":
+                # Floor control picked us to speak next
+                summary = message.get("grants", {}).get(self._id)
+                if summary is not None:
+                    room.grants.put_nowait(summary)
         except Exception as e:
             logging.error(f"Error handling message: {e}")
 
-    async def process_messages(self, websocket):
-        # This runs every PROCESSING_INTERVAL seconds
-
+    def load_replay(self, room, replay):
+        reconnecting = room.last_seq is not None
+        if reconnecting and replay.get("last_seq", room.last_seq) < room.last_seq:
+            # The hub's numbering is behind ours (its history was cleared), so our sequence numbers don't line up
+            # with its anymore; forget them, or every new message would look like one we'd already evaluated
+            logging.warning(f"{self.name}: the hub's sequence numbers for {room.room_id} restarted; resetting ours")
+            room.last_seq = None
+            room.evaluated_seq = None
+        for message in replay.get("messages", []):
+            sender = message.get("from")
+            if sender == self._id:
+                # Our own replies are already in the history unless this is a fresh start
+                if not reconnecting:
+                    room.conversation_history.add_message("ai", self.name, message.get("message"))
+            else:
+                room.conversation_history.add_message("user", sender, message.get("message"))
+            room.last_seq = message.get("seq", room.last_seq)
+
+        if replay.get("truncated"):
+            logging.warning(f"{self.name} missed some messages in {room.room_id} while disconnected; they're older than the hub's replay buffer")
+        logging.info(f"{self.name} loaded {len(replay.get('messages', []))} messages for {room.room_id} from the hub's replay")
+
+    def moderator_usage(self):
+        # Per-room token counts for this bot's moderator calls, e.g. {"main": {"calls": 12, "prompt_tokens": ...}}
+        return {room.room_id: room.moderator.usage.to_dict() for room in self.rooms.values() if room.moderator is not None}
+
+    def shutdown(self):
+        # Runs after the event loop has stopped: writes out cached decisions the background save hadn't yet
+        if self.decision_cache is not None:
+            self.decision_cache.flush()
+
+    def decision_cache_stats(self):
+        # Hits and misses of the moderators' decision cache, e.g. {"hits": 3, "misses": 10, ..., "hit_rate": 0.23}
+        if self.decision_cache is None:
+            return None
+        return self.decision_cache.stats.to_dict()
+
+    def collect_metrics(self):
+        # Copies the scheduler and decision cache totals into the metrics before each scrape
+        stats = self.scheduler_stats()
+        for event in ["wakeups", "coalesced_messages", "evaluations", "skipped_evaluations", "mentions"]:
+            SCHEDULER_EVENTS.set(getattr(stats, event), bot=self.name, event=event)
+        if self.decision_cache is not None:
+            DECISION_CACHE_LOOKUPS.set(self.decision_cache.stats.hits, bot=self.name, result="hit")
+            DECISION_CACHE_LOOKUPS.set(self.decision_cache.stats.misses, bot=self.name, result="miss")
+
+    def scheduler_stats(self):
+        # Per-bot totals across every room
+        stats = SchedulerStats()
+        for room in self.rooms.values():
+            stats.add(room.stats)
+        return stats
+
+    async def wait_for_messages(self, room):
+        # Sleeps until something arrives (an idle room costs nothing), then keeps collecting until the
+        # room has been quiet for DEBOUNCE_WINDOW or the burst has gone on for MAX_COALESCE_WINDOW. Once someone
+        # @mentions the bot, the quiet window drops to MENTION_WINDOW so the answer isn't held up.
+        loop = asyncio.get_running_loop()
+        batch = [await room.message_queue.get()]
+        room.stats.wakeups += 1
+
+        deadline = loop.time() + MAX_COALESCE_WINDOW
         while True:
-            await asyncio.sleep(PROCESSING_INTERVAL)
+            window = MENTION_WINDOW if room.addressed is not None else DEBOUNCE_WINDOW
+            timeout = min(window, deadline - loop.time())
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(room.message_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
 
+        # Anything that queued up while we were waiting goes in the same evaluation
+        rest, overflowed = room.message_queue.drain()
+        batch.extend(rest)
+        if overflowed:
+            # Some entries fell out of the queue; the history still has everything since our last turn
+            batch = room.conversation_history.messages_since(room.turn_cursor)
+            logging.warning(f"{self.name}'s message queue for {room.room_id} overflowed; read {len(batch)} new messages from the history")
+
+        room.stats.coalesced_messages += len(batch) - 1
+        return batch
+
+    def is_actionable(self, room, entry):
+        # Join/leave notifications, our own messages, messages the last evaluation already saw and messages
+        # addressed to someone else don't need a new look. (If the addressee is a bot, its reply will.)
+        if entry.text.startswith("[EVENT]") or entry.role == "ai":
+            return False
+        if entry.seq in room.addressed_elsewhere:
+            return False
+        if entry.seq is not None and room.evaluated_seq is not None and entry.seq <= room.evaluated_seq:
+            return False
+        return True
+
+    async def process_messages(self, websocket, room):
+        # Event driven: this only runs the teammate/moderator when new messages have arrived
+        await self.ready.wait()
+
+        while True:
             try:
-                # Give the teammate a chance to see if it should respond
-                response = await self.teammate.allow_send_message(self.moderator)
-
-                if response:
-                    response_msg = {
-                        "type": "msg_recvd",
-                        "from": self._id,
-                        "origin": "ai",
-                        "message": response
-                    }
-                    await websocket.send(json.dumps(response_msg))
+                batch = await self.wait_for_messages(room)
+                evaluated_at = time.time()
+                traced = list(room.traced)
+                room.traced.clear()
+                # The newest message this evaluation saw; what arrives while it runs isn't what the reply answers
+                parent = room.latest_msg_id
+                addressed, room.addressed = room.addressed, None
+                actionable = addressed is not None or any(self.is_actionable(room, message) for message in batch)
+                room.addressed_elsewhere.clear()
+
+                if not actionable:
+                    room.stats.skipped_evaluations += 1
+                    logging.debug(f"[scheduler] {self.name} skipped evaluating {room.room_id}: nothing actionable in {len(batch)} messages")
+                    await self.send_trace(websocket, room, traced, evaluated_at, skipped=True)
+                    continue
+
+                room.stats.evaluations += 1
+                room.evaluated_seq = room.last_seq
+                room.turn_cursor = room.conversation_history.cursor()
+
+                stream = ReplyStream(websocket, self._id, room.room_id)
+                if addressed is not None:
+                    # Someone asked this bot directly; there's nothing for the moderator to decide
+                    room.stats.mentions += 1
+                    logging.info(f"[scheduler] {self.name} was mentioned by {addressed['from']} in {room.room_id}; answering without the moderator")
+                    response = await room.teammate.respond(mention_summary(self.name, addressed), stream=stream)
+                elif self.single_call:
+                    logging.info(f"[scheduler] {self.name} deciding and responding in {room.room_id} after {len(batch)} new messages ({self.scheduler_stats()})")
+                    response = await room.teammate.decide_and_respond(new_messages=len(batch), stream=stream)
+                else:
+                    # Give the teammate a chance to see if it should respond. The moderator sees at least
+                    # everything that's new since the last evaluation.
+                    logging.info(f"[scheduler] {self.name} evaluating {room.room_id} after {len(batch)} new messages ({self.scheduler_stats()})")
+                    response = await room.teammate.allow_send_message(room.moderator, new_messages=len(batch), stream=stream)
+                await self.send_response(websocket, room, response, stream, parent=parent)
+                await self.send_trace(websocket, room, traced, evaluated_at, stream=stream, parent=parent,
+                                      moderated=addressed is None and not self.single_call)
             except websockets.exceptions.ConnectionClosedError as e:
                 logging.error(f"{self.name} WebSocket connection error: {e}")
                 await websocket.close()
@@ -482,6 +1235,110 @@ class Bot:
             except Exception as e:
                 logging.error(f"Error processing messages: {e}")
 
+    async def process_grants(self, websocket, room):
+        # With floor control the bot makes no moderator calls of its own; it only speaks when granted the floor
+        await self.ready.wait()
+
+        while True:
+            try:
+                summary = await room.grants.get()
+                evaluated_at = time.time()
+                traced = list(room.traced)
+                room.traced.clear()
+                # The newest message this evaluation saw; what arrives while it runs isn't what the reply answers
+                parent = room.latest_msg_id
+
+                # The grant covers everything that arrived before it (floor control grants @mentioned bots itself)
+                room.message_queue.drain()
+                room.addressed = None
+                room.addressed_elsewhere.clear()
+                room.stats.evaluations += 1
+                room.evaluated_seq = room.last_seq
+                room.turn_cursor = room.conversation_history.cursor()
+                logging.info(f"[floor] {self.name} was granted the floor in {room.room_id}")
+
+                stream = ReplyStream(websocket, self._id, room.room_id)
+                response = await room.teammate.respond(summary, stream=stream)
+                await self.send_response(websocket, room, response, stream, parent=parent)
+                await self.send_trace(websocket, room, traced, evaluated_at, stream=stream, parent=parent)
+            except websockets.exceptions.ConnectionClosedError as e:
+                logging.error(f"{self.name} WebSocket connection error: {e}")
+                await websocket.close()
+                break
+            except Exception as e:
+                logging.error(f"Error responding to floor grant: {e}")
+
+    async def send_response(self, websocket, room, response, stream=None, parent=None):
+        if response:
+            response_msg = {
+                "type": "msg_recvd",
+                "from": self._id,
+                "origin": "ai",
+                "room": room.room_id,
+                "message": response
+            }
+            if stream is not None:
+                response_msg["stream_id"] = stream.stream_id
+            if parent is not None:
+                # The message this reply answers, so a trace can follow it from question to answer
+                response_msg["parent"] = parent
+            await websocket.send(json.dumps(response_msg))
+            REPLIES_SENT.inc(bot=self.name, room=room.room_id)
+
+        if stream is not None and stream.started is not None and not stream.passed:
+            stream.finish()
+            TEAMMATE_CALL_SECONDS.observe(stream.total(), bot=self.name, provider=self.llm)
+            if stream.ttft() is not None:
+                TEAMMATE_FIRST_TOKEN_SECONDS.observe(stream.ttft(), bot=self.name, provider=self.llm)
+            ttft = stream.ttft()
+            ttft = f"{ttft:.2f}s" if ttft is not None else "n/a"
+            logging.info(f"[latency] {self.name} reply in {room.room_id}: time to first token {ttft}, "
+                         f"total {stream.total():.2f}s, {stream.chunks} chunks")
+
+    async def send_trace(self, websocket, room, traced, evaluated_at, stream=None, parent=None, moderated=False, skipped=False):
+        # Hands the spans for this evaluation to the hub, which writes them to its trace file. Every traced message
+        # gets its hops to the bot and its time in the queue; the decision and the reply are filed under the
+        # reply's parent, the newest message when the evaluation started.
+        if not traced:
+            return
+        process = f"bot:{self._id}"
+        spans = []
+        for message in traced:
+            spans.append(span(message["msg_id"], "hub->bot", process, message["hops"].get("hub_out", message["received_at"]),
+                              message["received_at"], room=room.room_id))
+            spans.append(span(message["msg_id"], "bot.queue", process, message["received_at"], evaluated_at,
+                              room=room.room_id, skipped=skipped))
+
+        trace_id = parent or traced[-1]["msg_id"]
+        started = stream.wall_time(stream.started) if stream is not None else None
+        if moderated:
+            # Until the teammate started generating, or until the moderator said no
+            spans.append(span(trace_id, "bot.moderator", process, evaluated_at, started or time.time(),
+                              room=room.room_id, spoke=started is not None))
+        if started is not None:
+            spans.append(span(trace_id, "bot.generate", process, started, stream.wall_time(stream.finished) or time.time(),
+                              room=room.room_id, ttft=stream.ttft(), chunks=stream.chunks, stream_id=stream.stream_id,
+                              passed=stream.passed))
+
+        try:
+            await websocket.send(json.dumps({"type": "trace_spans", "from": self._id, "room": room.room_id, "spans": spans}))
+        except websockets.exceptions.ConnectionClosed:
+            pass  # Losing a trace isn't worth dropping the evaluation over
+
+def bot_from_config(config):
+    # Builds a Bot from one of the JSON files in bots/ (what start_bots.py passes on the command line)
+    with open(config["instruction_file"], "r") as f:
+        inst = f.read()
+    with open(config["moderator_instruction_file"], "r") as f:
+        m_inst = f.read()
+
+    return Bot(_id=config["id"], name=config["name"], host=config["host"], port=config["port"], hub_uri=config["hub_uri"],
+               bot_instructions=inst, mod_instructions=m_inst,
+               teammate_extra_params=config["teammate_extra_params"], mod_extra_params=config["mod_extra_params"],
+               llm=config["llm"], rooms=config.get("rooms", [DEFAULT_ROOM]), rate_limit=config.get("rate_limit"),
+               history=config.get("history"), floor_control=config.get("floor_control", False),
+               decision_cache=config.get("decision_cache"), single_call=config.get("single_call", False))
+
 def main():
     parser = argparse.ArgumentParser(description="AI Bot")
     parser.add_argument("--id", type=str, required=True, help="Unique identifier for the bot")
@@ -494,6 +1351,13 @@ def main():
     parser.add_argument("--mod-extra-params", type=str, required=True, help="A stringified JSON object containing extra params for a moderator")
     parser.add_argument("--teammate-extra-params", type=str, required=True, help="A stringified JSON object containing extra params for a teammate")
     parser.add_argument("--llm", type=str, required=True, help="The LLM type. Right now, options are 'gemini' or 'gpt'")
+    parser.add_argument("--rooms", type=str, default=DEFAULT_ROOM, help="Comma-delimited list of rooms to join on the hub")
+    parser.add_argument("--history", type=str, default="{}", help="A stringified JSON object with the history's 'max_messages' and 'retention' policy (drop, spill or summarize)")
+    parser.add_argument("--rate-limit", type=str, default="{}", help="A stringified JSON object with the provider's requests per minute ('rpm') and tokens per minute ('tpm')")
+    parser.add_argument("--decision-cache", type=str, default="{}", help="A stringified JSON object with the moderator decision cache's 'max_entries', 'ttl' (seconds), 'persist' and 'enabled' settings")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port (off by default)")
+    parser.add_argument("--floor-control", action="store_true", help="Let the floor control service decide when this bot speaks instead of its own moderator")
+    parser.add_argument("--single-call", action="store_true", help="Decide whether to speak and generate the reply in one LLM call, without a moderator (Gemini only)")
 
     args = parser.parse_args()
 
@@ -518,12 +1382,17 @@ def main():
     bot = Bot(_id=args.id, name=args.name, host=args.host, port=args.port, hub_uri=args.hub_uri,
               bot_instructions=inst, mod_instructions=m_inst,
               teammate_extra_params=tep, mod_extra_params=mep,
-              llm=args.llm)
+              llm=args.llm, rooms=args.rooms.split(","), rate_limit=json.loads(args.rate_limit), history=json.loads(args.history),
+              floor_control=args.floor_control, decision_cache=json.loads(args.decision_cache), single_call=args.single_call)
 
     try:
-        asyncio.run(bot.connect())
+        asyncio.run(run_with_metrics(bot.connect(), args.metrics_port))
     except KeyboardInterrupt:
         logging.info("Bot process interrupted and stopped.")
+    bot.shutdown()
+
+    if bot.failed is not None:
+        exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,109 @@
+import json
+import time
+import asyncio
+import websockets
+import argparse
+import logging
+
+# Provider SDKs are imported (and their clients created) on first use, once for every bot in the process
+from bot import bot_from_config, MAX_RETRIES, KEEPALIVE_INTERVAL, DEFAULT_ROOM
+from start_bots import load_bot_configs
+from metrics import run_with_metrics
+
+class BotHost:
+    """
+    Runs many bots as tasks on one event loop. They share the provider SDKs, clients and connection pools, and
+    the per-provider rate limiters (so the limits in the bots' JSON files apply to all of them together).
+
+    By default every bot still has its own hub connection. With multiplex=True they share one: the hub sends each
+    frame to the connection once, and the host hands it to every bot in that frame's room.
+    """
+    def __init__(self, bots, hub_uri, multiplex=False):
+        self.bots = bots
+        self.hub_uri = hub_uri
+        self.multiplex = multiplex
+
+    async def run(self):
+        if self.multiplex:
+            await self.connect_multiplexed()
+        else:
+            await asyncio.gather(*(b.connect() for b in self.bots))
+
+    async def connect_multiplexed(self):
+        retries = 0
+        while retries < MAX_RETRIES and not self.failed():
+            tasks = []
+            try:
+                async with websockets.connect(self.hub_uri, ping_interval=KEEPALIVE_INTERVAL) as websocket:
+                    for b in self.bots:
+                        await websocket.send(json.dumps(b.connect_message()))
+                        tasks += b.start_tasks(websocket)
+                        # Same as a bot with its own connection: one that can't set up its teammate drops the (shared)
+                        # connection, so it doesn't sit on the hub unable to reply, and the host exits for the supervisor
+                        b.prepare_task.add_done_callback(lambda task, b=b: b.failed is not None and asyncio.ensure_future(websocket.close()))
+                    logging.info(f"Bot host connected {len(self.bots)} bots over one connection")
+
+                    try:
+                        async for message in websocket:
+                            self.route(json.loads(message))
+                    finally:
+                        for task in tasks:
+                            task.cancel()
+            except websockets.exceptions.ConnectionClosedError as e:
+                logging.error(f"Bot host WebSocket connection error: {e}")
+                retries += 1
+                logging.info(f"Bot host retrying connection ({retries}/{MAX_RETRIES})...")
+                await asyncio.sleep(5)
+            except Exception as e:
+                logging.error(f"Unexpected error: {e}")
+                break
+
+    def failed(self):
+        # Bots that couldn't set up their teammate
+        return [b for b in self.bots if b.failed is not None]
+
+    def route(self, message):
+        # Frames tagged "for" (replays, rosters) belong to one bot; everything else goes to every bot in the room.
+        # A bot never gets its own messages back, the same as with a connection of its own.
+        recipient = message.get("for")
+        room_id = message.get("room", DEFAULT_ROOM)
+        joined = message.get("teammate") or {}
+        for b in self.bots:
+            if recipient is not None and b._id != recipient:
+                continue
+            if room_id not in b.rooms or message.get("from") == b._id or joined.get("id") == b._id:
+                continue
+            b.dispatch(message)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many AI bots in one process")
+    parser.add_argument("--bots", type=str, default="*", help="Comma-delimited list of bot names to load (default: all bots)")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics for all the bots on this port (off by default)")
+    parser.add_argument("--multiplex", action="store_true", help="Share one hub connection between all the bots")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    bot_names = args.bots.split(",") if args.bots != "*" else "*"
+    configs = [config for config in load_bot_configs("bots", bot_names) if "id" in config]
+    if not configs:
+        logging.error("[!] No bots to run")
+        exit(-1)
+
+    bots = [bot_from_config(config) for config in configs]
+    logging.info(f"Bot host created {len(bots)} bots in {time.monotonic() - started:.2f}s")
+
+    host = BotHost(bots, hub_uri=configs[0]["hub_uri"], multiplex=args.multiplex)
+    try:
+        asyncio.run(run_with_metrics(host.run(), args.metrics_port))
+    except KeyboardInterrupt:
+        logging.info("Bot host interrupted and stopped.")
+    for b in bots:
+        b.shutdown()
+
+    failed = host.failed()
+    if failed:
+        logging.error(f"[!] {', '.join(b.name for b in failed)} couldn't start; exiting so the supervisor restarts the host")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
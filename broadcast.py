@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from collections import deque
+
+import frames
+from metrics import Counter
+
+# What to do when a connection's outbound queue is full
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = [DROP_OLDEST, COALESCE, DISCONNECT]
+
+DEFAULT_QUEUE_SIZE = 256
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try again later"
+
+FRAMES_OUT = Counter("hub_frames_out_total", "Frames written to client connections")
+FRAMES_DROPPED = Counter("hub_frames_dropped_total", "Frames thrown away because a connection's outbound queue was full")
+FRAMES_COALESCED = Counter("hub_frames_coalesced_total", "Frames merged into or superseding a queued frame with the same coalesce key")
+
+def coalesce_stream(queued, frame):
+    # Frames of one streamed reply share its stream_id as their coalesce key. A delta is appended to the delta
+    # still waiting in the queue; the final msg_recvd has the whole text, so it makes the queued delta redundant.
+    # Returns the merged frame, or None if `frame` supersedes the queued one.
+    new = frames.loads(frame)
+    if new.get("type") != "msg_delta":
+        return None
+    old = frames.loads(queued)
+    old["delta"] = old.get("delta", "") + new.get("delta", "")
+    return frames.dumps(old)
+
+class OutboundQueue:
+    """
+    A bounded queue of frames waiting to be sent to a single connection, drained by its own writer task.
+
+    Putting a frame on the queue never blocks, so one slow client can't hold up delivery to everyone else.
+    When the queue is full the slow consumer policy decides what happens:
+      - drop_oldest: throw away the oldest queued frame to make room
+      - coalesce: merge a frame into the queued one with the same coalesce key, using `merge` (falls back to
+        drop_oldest). The hub keys a streamed reply's frames by stream_id, so a slow client gets one delta with
+        everything it missed instead of dozens, or just the finished reply.
+      - disconnect: close the connection; the client can reconnect and catch up
+    """
+    def __init__(self, name, websocket, maxsize=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST, merge=coalesce_stream):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+
+        self.name = name
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.merge = merge
+
+        # Each entry is a [key, frame] pair so coalescing can swap the frame in place
+        self.frames = deque()
+        self.keyed = {}  # Coalesce key -> its queued entry (only with the coalesce policy)
+        self.ready = asyncio.Event()
+        self.closed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # Teammates sharing this connection (a bot host multiplexes several bots over one websocket)
+        self.users = 1
+
+        self.writer_task = asyncio.create_task(self.writer())
+
+    @property
+    def depth(self):
+        return len(self.frames)
+
+    def put(self, frame, key=None):
+        if self.closed:
+            return False
+
+        # Frames with a coalesce key merge into (or supersede) the queued frame with the same key
+        if key is not None and self.policy == COALESCE and key in self.keyed:
+            entry = self.keyed.pop(key)
+            merged = self.merge(entry[1], frame)
+            self.coalesced += 1
+            FRAMES_COALESCED.inc()
+            if merged is not None:
+                entry[1] = merged
+                self.keyed[key] = entry
+                return True
+            # Superseded; the new frame goes at the back so it keeps its place relative to other frames
+            self.frames.remove(entry)
+
+        if len(self.frames) >= self.maxsize:
+            if self.policy == DISCONNECT:
+                logging.warning(f"Outbound queue for {self.name} is full ({self.depth}); disconnecting slow consumer")
+                self.close()
+                asyncio.create_task(self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="slow consumer"))
+                return False
+
+            self.forget(self.frames.popleft())
+            self.dropped += 1
+            FRAMES_DROPPED.inc()
+            logging.warning(f"Outbound queue for {self.name} is full; dropped oldest frame ({self.dropped} dropped so far)")
+
+        entry = [key, frame]
+        self.frames.append(entry)
+        if key is not None and self.policy == COALESCE:
+            self.keyed[key] = entry
+        self.ready.set()
+        return True
+
+    def forget(self, entry):
+        # An entry left the queue, so later frames with its key can't merge into it anymore
+        if entry[0] is not None and self.keyed.get(entry[0]) is entry:
+            del self.keyed[entry[0]]
+
+    async def writer(self):
+        while not self.closed:
+            await self.ready.wait()
+            while self.frames and not self.closed:
+                entry = self.frames.popleft()
+                self.forget(entry)
+                frame = entry[1]
+                try:
+                    await self.websocket.send(frame)
+                    self.sent += 1
+                    FRAMES_OUT.inc()
+                    logging.debug(f"Forwarded message to {self.name}")
+                except Exception as e:
+                    logging.error(f"Error forwarding message to {self.name}: {e}")
+                    self.close()
+                    return
+            self.ready.clear()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.frames.clear()
+        self.keyed.clear()
+        self.ready.set()
+        if self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+
+class Broadcaster:
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE, policy=DROP_OLDEST):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+
+        self.maxsize = maxsize
+        self.policy = policy
+
+    def open_queue(self, name, websocket):
+        return OutboundQueue(name, websocket, maxsize=self.maxsize, policy=self.policy)
+
+    def share_queue(self, queue):
+        # Another teammate registered on the same connection; frames go out once per connection
+        queue.users += 1
+        return queue
+
+    def release_queue(self, queue):
+        queue.users -= 1
+        if queue.users <= 0:
+            queue.close()
+
+    def broadcast(self, teammates, frame, exclude=None, key=None):
+        # Enqueueing is synchronous and cheap; the per-connection writer tasks do the actual sends concurrently.
+        # `exclude` is the sending teammate.
+        delivered = 0
+        shared = None
+        for teammate in teammates:
+            queue = teammate.outbound
+            if teammate is exclude or queue is None:
+                continue
+            if queue.users > 1:
+                # Several teammates on one connection only need one copy between them
+                if shared is None:
+                    shared = set()
+                if id(queue) in shared:
+                    continue
+                shared.add(id(queue))
+            if queue.put(frame, key=key):
+                delivered += 1
+        return delivered
+
+    def queue_depths(self, teammates):
+        return {teammate._id: teammate.outbound.depth for teammate in teammates if teammate.outbound is not None}
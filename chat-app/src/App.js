@@ -13,7 +13,10 @@ function App() {
   const [isConnected, setIsConnected] = useState(false);
   const [id, setId] = useState('');
   const [name, setName] = useState('');
+  const [room, setRoom] = useState('main');
   const messageEndRef = useRef(null);
+  // Sequence number of the last message from the hub, so a reconnect only replays what we missed
+  const lastSeqRef = useRef(null);
 
   const connectWebSocket = () => {
     client = new W3CWebSocket('ws://localhost:9999');
@@ -28,8 +31,12 @@ function App() {
         id: id,
         being: 'human',
         host: 'localhost',
-        port: 3000
+        port: 3000,
+        rooms: [room]
       };
+      if (lastSeqRef.current !== null) {
+        connectMsg.since_seq = lastSeqRef.current;
+      }
       client.send(JSON.stringify(connectMsg));
       console.log('Connected as:', connectMsg);
     };
@@ -38,7 +45,49 @@ function App() {
       const dataFromServer = JSON.parse(message.data);
       console.log('Received:', dataFromServer);
       if (dataFromServer.type === 'msg_recvd') {
-        setMessages((prevMessages) => [...prevMessages, dataFromServer]);
+        if (dataFromServer.seq !== undefined) {
+          lastSeqRef.current = dataFromServer.seq;
+        }
+        // A streamed reply is already on screen; swap the partial copy for the final message
+        setMessages((prevMessages) => {
+          const index = dataFromServer.stream_id
+            ? prevMessages.findIndex((msg) => msg.streaming && msg.stream_id === dataFromServer.stream_id)
+            : -1;
+          if (index === -1) {
+            return [...prevMessages, dataFromServer];
+          }
+          const updated = [...prevMessages];
+          updated[index] = dataFromServer;
+          return updated;
+        });
+      } else if (dataFromServer.type === 'msg_delta') {
+        // Part of a bot reply that's still being generated
+        setMessages((prevMessages) => {
+          const index = prevMessages.findIndex((msg) => msg.streaming && msg.stream_id === dataFromServer.stream_id);
+          if (index === -1) {
+            return [...prevMessages, {
+              type: 'msg_recvd',
+              from: dataFromServer.from,
+              origin: dataFromServer.origin,
+              room: dataFromServer.room,
+              message: dataFromServer.delta,
+              timestamp: new Date().toISOString(),
+              stream_id: dataFromServer.stream_id,
+              streaming: true
+            }];
+          }
+          const updated = [...prevMessages];
+          updated[index] = { ...updated[index], message: updated[index].message + dataFromServer.delta };
+          return updated;
+        });
+      } else if (dataFromServer.type === 'history_replay') {
+        // On a reconnect our own messages are already on screen
+        const reconnecting = lastSeqRef.current !== null;
+        const replayed = dataFromServer.messages.filter((msg) => !(reconnecting && msg.from === id));
+        if (dataFromServer.messages.length > 0) {
+          lastSeqRef.current = dataFromServer.messages[dataFromServer.messages.length - 1].seq;
+        }
+        setMessages((prevMessages) => [...prevMessages, ...replayed]);
       }
     };
 
@@ -60,6 +109,7 @@ function App() {
         type: 'msg_recvd',
         from: id,
         origin: 'human',
+        room: room,
         message: input,
         timestamp: new Date().toISOString()
       };
@@ -137,7 +187,13 @@ function App() {
             value={name}
             onChange={(e) => setName(e.target.value)}
           />
-          <button onClick={connectWebSocket} disabled={!id || !name}>
+          <input
+            type="text"
+            placeholder="Room"
+            value={room}
+            onChange={(e) => setRoom(e.target.value)}
+          />
+          <button onClick={connectWebSocket} disabled={!id || !name || !room}>
             Connect
           </button>
         </div>
@@ -0,0 +1,332 @@
+import os
+import re
+import time
+import struct
+import logging
+import argparse
+from datetime import datetime
+
+import frames
+
+# Chat history is stored as an append-only JSONL file (one record per line; JSON escapes newlines, so
+# multi-line messages can't break the framing) plus a sidecar index of fixed-size entries:
+#
+#   <name>.jsonl   {"seq": 1, "ts": 1716570000.0, "time": "...", "from": "...", "name": "...", "origin": "...", "message": "...", "event": false}
+#   <name>.idx     struct "<QQd" per record: sequence number, byte offset into the .jsonl file, timestamp
+#
+# Sequence numbers are contiguous, so a seq lookup is a single index read, and timestamps never go backwards,
+# so a time lookup is a binary search over the index file. Neither needs the whole history in memory.
+
+LOG_EXT = ".jsonl"
+INDEX_EXT = ".idx"
+INDEX_ENTRY = struct.Struct("<QQd")
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def log_paths(path):
+    base = path
+    for ext in [LOG_EXT, INDEX_EXT]:
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base + LOG_EXT, base + INDEX_EXT
+
+class ChatLog:
+    """
+    Append side of the chat log. Records are built (and given a sequence number) on the event loop with
+    make_record(), then written in batches by append_batch(), which is meant to be called from the
+    history writer's worker thread.
+    """
+    def __init__(self, path):
+        self.log_path, self.index_path = log_paths(path)
+        self.log_file = None
+        self.index_file = None
+        self.next_seq = 1
+        self.last_ts = 0.0
+        self.offset = 0
+
+    def open(self):
+        self.log_file = open(self.log_path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+        self.recover()
+
+    def recover(self):
+        # The data file is always written before the index, so after a crash the index can only be behind.
+        # Re-index any complete records past the last index entry and cut off a torn final line.
+        index_size = os.path.getsize(self.index_path)
+        if index_size % INDEX_ENTRY.size:
+            index_size -= index_size % INDEX_ENTRY.size
+            self.index_file.truncate(index_size)
+
+        scan_from = 0
+        if index_size:
+            with open(self.index_path, 'rb') as f:
+                f.seek(index_size - INDEX_ENTRY.size)
+                seq, offset, ts = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+            self.next_seq = seq + 1
+            self.last_ts = ts
+            scan_from = offset
+
+        recovered = []
+        with open(self.log_path, 'rb') as f:
+            f.seek(scan_from)
+            if index_size:
+                f.readline()  # Already indexed
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    end = offset
+                    break
+                record = frames.loads(line)
+                recovered.append(INDEX_ENTRY.pack(record["seq"], offset, record["ts"]))
+                self.next_seq = record["seq"] + 1
+                self.last_ts = record["ts"]
+
+        if end < os.path.getsize(self.log_path):
+            logging.warning(f"Truncating torn record at the end of {self.log_path}")
+            self.log_file.truncate(end)
+        if recovered:
+            logging.warning(f"Re-indexed {len(recovered)} records in {self.log_path}")
+            self.index_file.write(b"".join(recovered))
+            self.index_file.flush()
+        self.offset = end
+
+    def continue_from(self, path, count=0):
+        """
+        Carries sequence numbers (and timestamps) on from an earlier log of the same room, so a new hub session
+        doesn't start again at 1 and reconnecting clients' since_seq still means something. Returns the last
+        `count` records of that log, for the replay buffer.
+        """
+        reader = ChatLogReader(path)
+        try:
+            last_seq = reader.last_seq()
+            if last_seq is None:
+                return []
+            if last_seq >= self.next_seq:
+                self.next_seq = last_seq + 1
+                self.last_ts = max(self.last_ts, reader.entry(len(reader) - 1)[2])
+            if last_seq + 1 != self.next_seq:
+                return []  # Older than what this log already holds
+            return reader.tail(count) if count else []
+        finally:
+            reader.close()
+
+    def make_record(self, sender_id, sender_name, message, origin, is_system_event=False, ts=None):
+        # Timestamps are clamped so they never go backwards; the index's binary search depends on it
+        ts = max(ts if ts is not None else time.time(), self.last_ts)
+        record = {
+            "seq": self.next_seq,
+            "ts": ts,
+            "time": datetime.fromtimestamp(ts).strftime(TIME_FORMAT),
+            "from": sender_id,
+            "name": sender_name,
+            "origin": origin,
+            "message": message,
+            "event": is_system_event
+        }
+        self.next_seq += 1
+        self.last_ts = ts
+        return record
+
+    def append_batch(self, records, flush=True, fsync=False):
+        lines = []
+        entries = []
+        offset = self.offset
+        for record in records:
+            line = (frames.dumps(record) + "\n").encode("utf-8")
+            lines.append(line)
+            entries.append(INDEX_ENTRY.pack(record["seq"], offset, record["ts"]))
+            offset += len(line)
+
+        self.log_file.write(b"".join(lines))
+        if flush or fsync:
+            self.log_file.flush()
+        if fsync:
+            os.fsync(self.log_file.fileno())
+
+        self.index_file.write(b"".join(entries))
+        if flush or fsync:
+            self.index_file.flush()
+        if fsync:
+            os.fsync(self.index_file.fileno())
+        self.offset = offset
+
+    def close(self):
+        for f in [self.log_file, self.index_file]:
+            if f is not None:
+                f.close()
+
+class ChatLogReader:
+    def __init__(self, path):
+        self.log_path, self.index_path = log_paths(path)
+        self.log_file = open(self.log_path, 'rb')
+        self.index_file = open(self.index_path, 'rb')
+
+    def __len__(self):
+        return os.path.getsize(self.index_path) // INDEX_ENTRY.size
+
+    def entry(self, position):
+        self.index_file.seek(position * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(self.index_file.read(INDEX_ENTRY.size))
+
+    def read_at(self, offset):
+        self.log_file.seek(offset)
+        return frames.loads(self.log_file.readline())
+
+    def first_seq(self):
+        return self.entry(0)[0] if len(self) else None
+
+    def last_seq(self):
+        return self.entry(len(self) - 1)[0] if len(self) else None
+
+    def position_of_seq(self, seq):
+        # Sequence numbers are contiguous, so this is just arithmetic
+        count = len(self)
+        if not count:
+            return 0
+        return min(max(seq - self.first_seq(), 0), count)
+
+    def position_of_time(self, ts):
+        # Binary search for the first record at or after `ts`
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[2] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, seq):
+        position = self.position_of_seq(seq)
+        if position >= len(self):
+            return None
+        entry_seq, offset, _ = self.entry(position)
+        if entry_seq != seq:
+            return None
+        return self.read_at(offset)
+
+    def scan(self, start=0, stop=None):
+        # Yields records by index position; reads sequentially from the first record's offset
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        self.log_file.seek(self.entry(start)[1])
+        for _ in range(stop - start):
+            yield frames.loads(self.log_file.readline())
+
+    def range_seq(self, start_seq, end_seq=None):
+        # Records with start_seq <= seq < end_seq
+        stop = None if end_seq is None else self.position_of_seq(end_seq)
+        return self.scan(self.position_of_seq(start_seq), stop)
+
+    def range_time(self, start_ts, end_ts=None):
+        # Records with start_ts <= ts < end_ts
+        stop = None if end_ts is None else self.position_of_time(end_ts)
+        return self.scan(self.position_of_time(start_ts), stop)
+
+    def tail(self, n):
+        return list(self.scan(max(len(self) - n, 0)))
+
+    def close(self):
+        self.log_file.close()
+        self.index_file.close()
+
+def latest_log(directory):
+    # The most recently written indexed log in `directory`, or None
+    logs = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(LOG_EXT)]
+    logs = [path for path in logs if os.path.exists(log_paths(path)[1])]
+    return max(logs, key=os.path.getmtime, default=None)
+
+# Old .chat format:
+#   2024-05-24 12:00:00 | Gabe (ID: gabe) [human]: message
+#   2024-05-24 12:00:00 | SYSTEM [system]: Gabe has joined the chat.
+# Any line that doesn't start with a timestamp belongs to the previous (multi-line) message.
+CHAT_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \| (?:SYSTEM \[(?P<sys_origin>[^\]]*)\]|(?P<name>.*?) \(ID: (?P<id>.*?)\) \[(?P<origin>[^\]]*)\]): ?(?P<message>.*)$")
+
+def parse_chat_file(filename):
+    current = None
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            match = CHAT_LINE.match(line)
+            if match is None:
+                if current is not None:
+                    current["message"] += "\n" + line
+                continue
+            if current is not None:
+                yield current
+            ts = datetime.strptime(match.group(1), TIME_FORMAT).timestamp()
+            if match.group("sys_origin") is not None:
+                current = {"ts": ts, "from": "system", "name": "system", "origin": match.group("sys_origin"), "message": match.group("message"), "event": True}
+            else:
+                current = {"ts": ts, "from": match.group("id"), "name": match.group("name"), "origin": match.group("origin"), "message": match.group("message"), "event": False}
+    if current is not None:
+        yield current
+
+def convert_chat_file(filename, output=None, batch_size=1024):
+    if output is None:
+        output = os.path.splitext(filename)[0]
+    log = ChatLog(output)
+    log.open()
+    batch = []
+    count = 0
+    for entry in parse_chat_file(filename):
+        batch.append(log.make_record(entry["from"], entry["name"], entry["message"], entry["origin"], is_system_event=entry["event"], ts=entry["ts"]))
+        if len(batch) >= batch_size:
+            log.append_batch(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        log.append_batch(batch)
+        count += len(batch)
+    log.close()
+    return log.log_path, count
+
+def format_record(record):
+    if record["event"]:
+        return f"[{record['seq']}] {record['time']} | SYSTEM [{record['origin']}]: {record['message']}"
+    return f"[{record['seq']}] {record['time']} | {record['name']} (ID: {record['from']}) [{record['origin']}]: {record['message']}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat log tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Convert old .chat files to the indexed .jsonl format")
+    convert_parser.add_argument("files", nargs="+", help=".chat files to convert")
+
+    tail_parser = subparsers.add_parser("tail", help="Print the last N records of a log")
+    tail_parser.add_argument("log", help="Path to a .jsonl log")
+    tail_parser.add_argument("-n", type=int, default=20, help="Number of records to print")
+
+    range_parser = subparsers.add_parser("range", help="Print records by sequence number or time")
+    range_parser.add_argument("log", help="Path to a .jsonl log")
+    range_parser.add_argument("--from-seq", type=int, help="First sequence number to print")
+    range_parser.add_argument("--to-seq", type=int, help="Stop before this sequence number")
+    range_parser.add_argument("--since", type=str, help=f"First time to print ({TIME_FORMAT})")
+    range_parser.add_argument("--until", type=str, help=f"Stop before this time ({TIME_FORMAT})")
+
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        for filename in args.files:
+            path, count = convert_chat_file(filename)
+            print(f"{filename} -> {path} ({count} records)")
+        return
+
+    reader = ChatLogReader(args.log)
+    if args.command == "tail":
+        records = reader.tail(args.n)
+    elif args.since or args.until:
+        start_ts = datetime.strptime(args.since, TIME_FORMAT).timestamp() if args.since else 0
+        end_ts = datetime.strptime(args.until, TIME_FORMAT).timestamp() if args.until else None
+        records = reader.range_time(start_ts, end_ts)
+    else:
+        records = reader.range_seq(args.from_seq or 0, args.to_seq)
+
+    for record in records:
+        print(format_record(record))
+    reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -31,13 +31,17 @@ def configure_logging(console_output=False):
         logging.getLogger().addHandler(console_handler)
 
 class CLIClient:
-    def __init__(self, _id, name, host, port, hub_uri):
+    def __init__(self, _id, name, host, port, hub_uri, room="main"):
         self._id = _id
         self.name = name
         self.host = host
         self.port = port
         self.hub_uri = hub_uri
+        self.room = room
         self.websocket = None
+        self.last_seq = None  # So a reconnect only replays what we missed
+        self.active_stream = None  # stream_id of the bot reply currently being printed as it's generated
+        self.interrupted_streams = set()  # Replies cut off by another message; they print in full when done
 
     async def connect(self):
         retries = 0
@@ -55,8 +59,11 @@ class CLIClient:
                     "id": self._id,
                     "origin": "human",
                     "host": self.host,
-                    "port": self.port
+                    "port": self.port,
+                    "rooms": [self.room]
                 }
+                if self.last_seq is not None:
+                    connect_msg["since_seq"] = self.last_seq
                 await self.websocket.send(json.dumps(connect_msg))
                 logging.info(f"Connected to {self.hub_uri} as {self.name}")
 
@@ -83,12 +90,47 @@ class CLIClient:
         try:
             async for message in self.websocket:
                 msg = json.loads(message)
+                if msg.get("type") == "history_replay":
+                    for replayed in msg.get("messages", []):
+                        self.print_message(replayed)
+                    continue
+                if msg.get("type") == "msg_delta":
+                    self.print_delta(msg)
+                    continue
                 logging.info(f"Received message from {msg.get('from')}: {msg.get('message')}")
-                print(f"{msg.get('from')}: {msg.get('message')}")
+                self.print_message(msg)
         except websockets.exceptions.ConnectionClosed:
             logging.error("Receive connection closed unexpectedly.")
             # Optionally: attempt to reconnect here
 
+    def print_delta(self, msg):
+        # Prints a bot's reply as it's generated. Only one reply streams at a time; the others print in
+        # full when their final message arrives.
+        stream_id = msg.get("stream_id")
+        if stream_id in self.interrupted_streams:
+            return
+        if self.active_stream is None:
+            self.active_stream = stream_id
+            print(f"{msg.get('from')}: ", end="", flush=True)
+        if stream_id == self.active_stream:
+            print(msg.get("delta", ""), end="", flush=True)
+
+    def print_message(self, msg):
+        self.last_seq = msg.get("seq", self.last_seq)
+        stream_id = msg.get("stream_id")
+        if stream_id is not None and stream_id == self.active_stream:
+            # Already on screen from its deltas
+            print()
+            self.active_stream = None
+            return
+        if self.active_stream is not None:
+            # Something else arrived mid-reply; finish that reply when its final message comes in
+            print(" ...")
+            self.interrupted_streams.add(self.active_stream)
+            self.active_stream = None
+        self.interrupted_streams.discard(stream_id)
+        print(f"{msg.get('from')}: {msg.get('message')}")
+
     async def send_messages(self):
         try:
             while True:
@@ -97,6 +139,7 @@ class CLIClient:
                     "type": "msg_recvd",
                     "from": self._id,
                     "origin": "human",
+                    "room": self.room,
                     "message": msg
                 }
                 await self.websocket.send(json.dumps(message_obj))
@@ -122,13 +165,14 @@ def main():
     parser.add_argument("--host", type=str, required=True, help="Host IP address")
     parser.add_argument("--port", type=int, required=True, help="Port number")
     parser.add_argument("--hub_uri", type=str, required=True, help="WebSocket URI of the hub")
+    parser.add_argument("--room", type=str, default="main", help="Room to join on the hub")
     parser.add_argument("--console", action="store_true", help="Enable console logging")  # Add console argument
 
     args = parser.parse_args()
 
     configure_logging(console_output=args.console)  # Configure logging based on argument
 
-    client = CLIClient(_id=args.id, name=args.name, host=args.host, port=args.port, hub_uri=args.hub_uri)
+    client = CLIClient(_id=args.id, name=args.name, host=args.host, port=args.port, hub_uri=args.hub_uri, room=args.room)
     asyncio.run(client.connect())
 
 if __name__ == "__main__":
@@ -1,10 +1,20 @@
+import os
+import time
 import asyncio
-import json
 import logging
 import argparse
 from datetime import datetime
 from websockets.server import serve
 
+from broadcast import Broadcaster, DEFAULT_QUEUE_SIZE, DROP_OLDEST, SLOW_CONSUMER_POLICIES
+import frames
+from chat_log import ChatLog, latest_log
+from history_writer import HistoryWriter, DEFAULT_FLUSH_INTERVAL, DURABILITY_FLUSH, DURABILITY_MODES
+from replay_buffer import ReplayBuffer, DEFAULT_REPLAY_SIZE, DEFAULT_REPLAY_COUNT
+from tracing import TraceWriter, new_message_id, span
+from metrics import Counter, Gauge, REGISTRY, start_metrics_server
+from rooms import Room, DEFAULT_ROOM, is_valid_room_id, requested_rooms, since_seq_for_room
+
 # Configure logging
 def configure_logging(console_output):
     handlers = [logging.FileHandler("cli_hub.log")]
@@ -22,6 +32,14 @@ YELLOW = "\033[93m"
 RESET = "\033[0m"
 
 SYSTEM_ID = "system"
+DEFAULT_PORT = 9999
+DEFAULT_MAX_ROOMS = 100  # Each open room holds two files and a writer task
+
+MESSAGES_IN = Counter("hub_messages_in_total", "Messages received from clients", ["type"])
+TEAMMATES_CONNECTED = Gauge("hub_teammates_connected", "Connected teammates", ["origin"])
+OUTBOUND_QUEUE_DEPTH = Gauge("hub_outbound_queue_depth", "Frames waiting to be sent to a connection", ["connection"])
+HISTORY_QUEUE_DEPTH = Gauge("hub_history_queue_depth", "Chat history records waiting to be written", ["room"])
+PONG = frames.dumps({"type": "pong"})
 
 # Types documentation ...
 
@@ -33,6 +51,8 @@ class Teammate:
         self.host = host
         self.port = port
         self.websocket = websocket
+        self.outbound = None
+        self.rooms = set()
 
     def is_human(self):
         return self.origin == "human"
@@ -40,29 +60,51 @@ class Teammate:
     def is_ai(self):
         return self.origin == "ai"
 
+    def to_dict(self):
+        return {"id": self._id, "name": self.name, "origin": self.origin}
+
 TEAMMATES = {}
-chat_history_file = None
+ROOMS = {}
+CLOSING_ROOMS = {}  # room id -> task closing the history writer of a room that emptied
+broadcaster = Broadcaster()
+history_flush_interval = DEFAULT_FLUSH_INTERVAL
+history_durability = DURABILITY_FLUSH
+replay_size = DEFAULT_REPLAY_SIZE
+max_rooms = DEFAULT_MAX_ROOMS
+tracer = None  # TraceWriter when the hub was started with --trace-file
 
-def get_timestamp():
-    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def get_chat_filename(room_id):
+    # The chat log adds the .jsonl data file and .idx index extensions
+    return os.path.join(".chat-history", room_id, datetime.now().strftime('%b-%d-%Y_%I-%M-%p'))
 
-def get_chat_filename():
-    return datetime.now().strftime('.chat-history/%b-%d-%Y_%I-%M-%p.chat')
+def frame_from_record(record, room_id):
+    # Rebuilds a chat log record's frame for the replay buffer (without what the log doesn't keep, like msg_id)
+    if record["event"]:
+        return frames.event_frame(SYSTEM_ID, record["message"], record["time"], seq=record["seq"], room_id=room_id)
+    return frames.chat_frame({"type": "msg_recvd", "from": record["from"], "origin": record["origin"], "message": record["message"]},
+                             record["time"], seq=record["seq"], room_id=room_id)
 
-def initialize_chat_history():
-    global chat_history_file
-    filename = get_chat_filename()
-    chat_history_file = open(filename, 'a')
+def get_room(room_id):
+    # Rooms are created the first time someone joins them
+    room = ROOMS.get(room_id)
+    if room is None:
+        room_dir = os.path.join(".chat-history", room_id)
+        os.makedirs(room_dir, exist_ok=True)
+        previous = latest_log(room_dir)
+        chat_log = ChatLog(get_chat_filename(room_id))
+        history_writer = HistoryWriter(chat_log, flush_interval=history_flush_interval, durability=history_durability)
+        history_writer.start()
+        replay_buffer = ReplayBuffer(maxlen=replay_size)
 
-def save_message_to_history(sender_id, sender_name, message, origin, is_system_event=False):
-    global chat_history_file
-    timestamp = get_timestamp()
-    if is_system_event:
-        log_entry = f"{timestamp} | SYSTEM [{origin}]: {message}\n"
-    else:
-        log_entry = f"{timestamp} | {sender_name} (ID: {sender_id}) [{origin}]: {message}\n"
-    chat_history_file.write(log_entry)
-    chat_history_file.flush()
+        # Every session writes a new log file, but sequence numbers carry on from the room's last one (and its
+        # tail goes back in the replay buffer), so clients reconnecting after a restart get what they missed
+        if previous is not None:
+            for record in chat_log.continue_from(previous, count=replay_size):
+                replay_buffer.append(record["seq"], frame_from_record(record, room_id).data)
+        room = Room(room_id, history_writer, replay_buffer)
+        ROOMS[room_id] = room
+        logging.info(f"Created room {room_id}")
+    return room
 
 async def register_teammate(message, websocket):
     name = message.get("name")
@@ -78,52 +120,124 @@ async def register_teammate(message, websocket):
         port=port,
         websocket=websocket
     )
+    if _id in TEAMMATES:
+        # Same ID registering again (e.g. a reconnect); drop the old registration first
+        await unregister_teammate(_id)
+    # A bot host can register several bots over one connection; they share its outbound queue
+    connection_peer = next((other for other in TEAMMATES.values() if other.websocket is websocket and other.outbound is not None), None)
+    if connection_peer is not None:
+        tm.outbound = broadcaster.share_queue(connection_peer.outbound)
+    else:
+        tm.outbound = broadcaster.open_queue(name, websocket)
     TEAMMATES[_id] = tm
     logging.info(f"Registered {_id}: {name} ({origin})")
 
-    # Notify everyone that a new teammate has joined
-    event_message = {
-        "type": "msg_recvd",
-        "from": SYSTEM_ID,
-        "origin": SYSTEM_ID,
-        "message": f"[EVENT] {name} has joined the chat.",
-        "timestamp": get_timestamp()
-    }
-    save_message_to_history(SYSTEM_ID, SYSTEM_ID, f"{name} has joined the chat.", SYSTEM_ID, is_system_event=True)
-    await forward_message(websocket, json.dumps(event_message))  # Pass websocket to forward_message
+    for room_id in requested_rooms(message):
+        await join_room(tm, room_id, since_seq=since_seq_for_room(message, room_id), count=message.get("replay", DEFAULT_REPLAY_COUNT),
+                        roster=message.get("roster", False))
 
 async def unregister_teammate(_id):
     if _id in TEAMMATES:
-        name = TEAMMATES[_id].name
+        tm = TEAMMATES[_id]
+        if tm.outbound is not None:
+            broadcaster.release_queue(tm.outbound)
         del TEAMMATES[_id]
         logging.info(f"Unregistered {_id}")
 
         # Notify everyone that a teammate has left
-        event_message = {
-            "type": "msg_recvd",
-            "from": SYSTEM_ID,
-            "origin": SYSTEM_ID,
-            "message": f"[EVENT] {name} has left the chat.",
-            "timestamp": get_timestamp()
-        }
-        save_message_to_history(SYSTEM_ID, SYSTEM_ID, f"{name} has left the chat.", SYSTEM_ID, is_system_event=True)
-        await forward_message(None, json.dumps(event_message)) # No specific websocket needed for broadcast
-
-async def forward_message(websocket, message):
-    for teammate in TEAMMATES.values():
-        if teammate.websocket != websocket:  # Compare websockets instead of IDs
-            try:
-                await teammate.websocket.send(message)
-                logging.debug(f"Forwarded message to {teammate.name}")
-            except Exception as e:
-                logging.error(f"Error forwarding message to {teammate.name}: {e}")
+        for room_id in list(tm.rooms):
+            await leave_room(tm, room_id)
+
+async def join_room(tm, room_id, since_seq=None, count=DEFAULT_REPLAY_COUNT, roster=False):
+    if not is_valid_room_id(room_id):
+        logging.warning(f"{tm._id} tried to join invalid room {room_id!r}")
+        return
+    # A room that just emptied may still be flushing its log; the new session reopens that same file
+    closing = CLOSING_ROOMS.get(room_id)
+    if closing is not None:
+        await closing
+        if TEAMMATES.get(tm._id) is not tm:
+            return  # Disconnected while we waited
+    if room_id not in ROOMS and len(ROOMS) >= max_rooms:
+        logging.warning(f"{tm._id} tried to join room {room_id!r}, but the hub already has {len(ROOMS)} rooms open")
+        return
+    room = get_room(room_id)
+    room.members[tm._id] = tm
+    tm.rooms.add(room_id)
+    logging.info(f"{tm._id} joined room {room_id} ({len(room.members)} members)")
+
+    # Catch the new (or reconnecting) teammate up before anything else goes out to it. A client can ask
+    # for everything after the last sequence number it saw, or for the last N messages (0 to skip).
+    if since_seq is not None or count:
+        tm.outbound.put(room.replay_buffer.replay_frame(count=count, since_seq=since_seq, room_id=room_id, recipient=tm._id))
+
+    # Clients that track who's in the room (like the floor control service) ask for the current members.
+    # It goes after the replay so replayed join/leave events don't override it.
+    if roster:
+        tm.outbound.put(frames.dumps({
+            "type": "room_roster",
+            "room": room_id,
+            "for": tm._id,
+            "members": [member.to_dict() for member in room.members.values()]
+        }))
+
+    # Notify everyone that a new teammate has joined
+    await broadcast_event(room, tm, f"{tm.name} has joined the chat.", event="joined", teammate=tm)  # Everyone but the new teammate
+
+async def leave_room(tm, room_id):
+    room = ROOMS.get(room_id)
+    tm.rooms.discard(room_id)
+    if room is None or room.members.get(tm._id) is not tm:
+        return
+    del room.members[tm._id]
+    logging.info(f"{tm._id} left room {room_id} ({len(room.members)} members)")
+    await broadcast_event(room, None, f"{tm.name} has left the chat.", event="left", teammate=tm) # No specific sender to skip
+    if not room.members and room_id != DEFAULT_ROOM:
+        await close_room(room)
+
+async def close_room(room):
+    # Empty rooms give back their files and writer task. Rejoining creates the room again, and it
+    # carries on from this log (sequence numbers and replay), so nothing is lost.
+    del ROOMS[room.room_id]
+    task = asyncio.create_task(room.history_writer.close())
+    CLOSING_ROOMS[room.room_id] = task
+    try:
+        await task
+    finally:
+        del CLOSING_ROOMS[room.room_id]
+    logging.info(f"Closed empty room {room.room_id}")
+
+async def broadcast_event(room, sender, text, event=None, teammate=None):
+    record = room.save_message_to_history(SYSTEM_ID, SYSTEM_ID, text, SYSTEM_ID, is_system_event=True)
+    frame = frames.event_frame(SYSTEM_ID, text, record["time"], seq=record["seq"], room_id=room.room_id,
+                               event=event, teammate=teammate.to_dict() if teammate is not None else None)
+    room.replay_buffer.append(record["seq"], frame.data)
+    await forward_message(room, sender, frame)
+
+async def forward_message(room, sender, frame, key=None):
+    # Only the room's members get the frame, so routing cost scales with the room, not the hub.
+    # Every connection has its own bounded outbound queue and writer task, so this only enqueues
+    # and a slow client can't delay delivery to the others. The frame was encoded once; every
+    # recipient's queue shares the same str.
+    delivered = broadcaster.broadcast(room.members.values(), frame.data, exclude=sender, key=key)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Queued message for {delivered} teammates in {room.room_id}; queue depths: {broadcaster.queue_depths(room.members.values())}")
+    return delivered
+
+def connected_teammate(_id, websocket):
+    # Room membership changes have to come from the connection that registered the ID
+    tm = TEAMMATES.get(_id)
+    if tm is None or tm.websocket is not websocket:
+        return None
+    return tm
 
 async def echo(websocket, path):
     try:
         logging.info("New connection")
         async for message_obj_str in websocket:
-            message = json.loads(message_obj_str)
+            message = frames.loads(message_obj_str)
             msg_type = message.get("type")
+            MESSAGES_IN.inc(type=msg_type)
             
             if msg_type in ["cli_connect", "ai_connect"]:
                 await register_teammate(message, websocket)
@@ -131,22 +245,99 @@ async def echo(websocket, path):
             elif msg_type in ["cli_disconnect", "ai_disconnect"]:
                 _id = message.get("id")
                 await unregister_teammate(_id)
+
+            elif msg_type == "join_room":
+                tm = connected_teammate(message.get("id"), websocket)
+                room_id = message.get("room")
+                if tm is not None and room_id not in tm.rooms:
+                    await join_room(tm, room_id, since_seq=message.get("since_seq"), count=message.get("replay", DEFAULT_REPLAY_COUNT),
+                                    roster=message.get("roster", False))
+
+            elif msg_type == "leave_room":
+                tm = connected_teammate(message.get("id"), websocket)
+                if tm is not None:
+                    await leave_room(tm, message.get("room"))
             
             elif msg_type == "msg_recvd":
+                received_at = time.time()
                 sender_id = message.get("from")
                 msg = message.get("message")
                 origin = message.get("origin")
-                sender_name = TEAMMATES[sender_id].name if sender_id in TEAMMATES else "Unknown"
-                timestamp = get_timestamp()
-                print(f"{YELLOW}{sender_name}|[{origin}]{RESET} > {msg}")
-                save_message_to_history(sender_id, sender_name, msg, origin)
-                
-                # Add timestamp to the message before forwarding
-                message["timestamp"] = timestamp
-                await forward_message(websocket, json.dumps(message))  # Pass websocket to forward_message
+                room_id = message.get("room", DEFAULT_ROOM)
+                room = ROOMS.get(room_id)
+                if room is None or sender_id not in room.members:
+                    logging.warning(f"Dropping message from {sender_id} to room {room_id!r} it hasn't joined")
+                    continue
+                sender_name = room.members[sender_id].name
+                print(f"{YELLOW}#{room_id} {sender_name}|[{origin}]{RESET} > {msg}")
+                record = room.save_message_to_history(sender_id, sender_name, msg, origin)
+
+                # Every message gets an id that replies can name as their parent ("parent"). With tracing on,
+                # it also carries when the hub got it and when it went out, so bots can time the next hops.
+                msg_id = message["msg_id"] = new_message_id()
+
+                # Who the message @mentions, so bots that were addressed can skip asking their moderator. Only the
+                # hub says who's mentioned and stamps hops; whatever the client put in those fields is dropped.
+                mentions = room.resolve_mentions(msg, sender_id)
+                if mentions:
+                    message["mentions"] = mentions
+                else:
+                    message.pop("mentions", None)
+                if tracer is not None:
+                    message["hops"] = {"hub_in": received_at, "hub_out": time.time()}
+                else:
+                    message.pop("hops", None)
+
+                # Add timestamp, sequence number and room to the message and encode it once before forwarding
+                frame = frames.chat_frame(message, record["time"], seq=record["seq"], room_id=room_id)
+                room.replay_buffer.append(record["seq"], frame.data)
+                # Everyone but the sender. A finished streamed reply replaces its deltas still queued for slow clients.
+                delivered = await forward_message(room, room.members[sender_id], frame, key=message.get("stream_id"))
+
+                if tracer is not None:
+                    tracer.record(span(msg_id, "hub.fanout", "hub", received_at, time.time(), room=room_id, seq=record["seq"],
+                                       sender=sender_id, origin=origin, parent=message.get("parent"), recipients=delivered,
+                                       text=(msg or "")[:80]))
+
+            elif msg_type == "trace_spans":
+                # Spans a bot recorded while handling traced messages; the hub is the trace collector
+                if tracer is not None:
+                    for record in message.get("spans", []):
+                        tracer.record(record)
             
+            elif msg_type == "msg_delta":
+                # Part of a reply a bot is still generating. Deltas aren't stamped, stored or replayed; the bot
+                # finishes with a normal msg_recvd (same stream_id) carrying the whole text. Only people render
+                # them, so other bots don't get them.
+                room = ROOMS.get(message.get("room", DEFAULT_ROOM))
+                if room is None or message.get("from") not in room.members:
+                    continue
+                recipients = [tm for tm in room.members.values() if tm.origin not in ["ai", "moderator"]]
+                # Keyed by stream, so a slow client's queued deltas merge under --slow-consumer-policy coalesce
+                broadcaster.broadcast(recipients, message_obj_str, exclude=room.members[message.get("from")],
+                                      key=message.get("stream_id"))
+
+            elif msg_type == "floor_grant":
+                # Speaking grants from the floor control service only go to the teammates they name,
+                # and they aren't part of the chat history
+                room = ROOMS.get(message.get("room", DEFAULT_ROOM))
+                if room is None or message.get("from") not in room.members:
+                    logging.warning(f"Dropping floor grant from {message.get('from')} for a room it hasn't joined")
+                    continue
+                recipients = [room.members[_id] for _id in message.get("to", []) if _id in room.members]
+                broadcaster.broadcast(recipients, message_obj_str)
+                logging.info(f"Floor grant in {room.room_id} for {[tm._id for tm in recipients]}")
+
+            elif msg_type == "who":
+                # Presence check (start_bots.py's supervisor probes bot liveness this way). Doesn't register
+                # the connection, so probes don't show up in the chat.
+                await websocket.send(frames.dumps({
+                    "type": "presence",
+                    "teammates": [dict(tm.to_dict(), rooms=sorted(tm.rooms)) for tm in TEAMMATES.values()]
+                }))
+
             elif msg_type == "ping":
-                await websocket.send(json.dumps({"type": "pong"}))
+                await websocket.send(PONG)
             
             elif msg_type == "cmd_recvd":
                 # Handle commands if necessary
@@ -164,16 +355,72 @@ async def echo(websocket, path):
                 await unregister_teammate(_id)
         logging.info("Connection closed")
 
-async def main(console_output):
+def collect_metrics():
+    # Runs before every metrics scrape
+    TEAMMATES_CONNECTED.clear()
+    for origin in ["human", "ai", "moderator"]:
+        TEAMMATES_CONNECTED.set(0, origin=origin)
+    for tm in TEAMMATES.values():
+        TEAMMATES_CONNECTED.inc(origin=tm.origin)
+
+    # Teammates multiplexed over one connection share a queue; report it once
+    OUTBOUND_QUEUE_DEPTH.clear()
+    for tm in TEAMMATES.values():
+        if tm.outbound is not None:
+            OUTBOUND_QUEUE_DEPTH.set(tm.outbound.depth, connection=tm.outbound.name)
+
+    HISTORY_QUEUE_DEPTH.clear()
+    for room_id, room in ROOMS.items():
+        HISTORY_QUEUE_DEPTH.set(room.history_writer.depth, room=room_id)
+
+async def main(console_output, queue_size=DEFAULT_QUEUE_SIZE, slow_consumer_policy=DROP_OLDEST,
+               flush_interval=DEFAULT_FLUSH_INTERVAL, durability=DURABILITY_FLUSH,
+               replay_buffer_size=DEFAULT_REPLAY_SIZE, room_limit=DEFAULT_MAX_ROOMS, port=DEFAULT_PORT, metrics_port=None, trace_file=None):
+    global broadcaster, history_flush_interval, history_durability, replay_size, max_rooms, tracer
     configure_logging(console_output)
-    initialize_chat_history()
-    async with serve(echo, "localhost", 9999):
-        logging.info("Server started")
-        await asyncio.Future()  # run forever
+    broadcaster = Broadcaster(maxsize=queue_size, policy=slow_consumer_policy)
+    history_flush_interval = flush_interval
+    history_durability = durability
+    replay_size = replay_buffer_size
+    max_rooms = room_limit
+    get_room(DEFAULT_ROOM)
+    if trace_file:
+        tracer = TraceWriter(trace_file)
+        tracer.start()
+    if metrics_port:
+        REGISTRY.on_collect(collect_metrics)
+        await start_metrics_server(metrics_port)
+    try:
+        async with serve(echo, "localhost", port):
+            logging.info("Server started")
+            await asyncio.Future()  # run forever
+    finally:
+        # Make sure everything queued for the history files makes it to disk
+        for room in ROOMS.values():
+            await room.history_writer.close()
+        for task in list(CLOSING_ROOMS.values()):
+            await task
+        if tracer is not None:
+            await tracer.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="CLI Hub")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port (off by default)")
+    parser.add_argument("--trace-file", type=str, default=None, help="Trace every chat message and write the spans to this JSONL file (see trace_view.py)")
     parser.add_argument("--console", action="store_true", help="Show logging output to console")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="Max frames queued per connection before the slow consumer policy kicks in")
+    parser.add_argument("--slow-consumer-policy", type=str, default=DROP_OLDEST, choices=SLOW_CONSUMER_POLICIES, help="What to do when a connection's outbound queue is full")
+    parser.add_argument("--history-flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL, help="Seconds to batch chat history records before writing them to disk")
+    parser.add_argument("--history-durability", type=str, default=DURABILITY_FLUSH, choices=DURABILITY_MODES, help="How hard to push each history batch to disk")
+    parser.add_argument("--replay-size", type=int, default=DEFAULT_REPLAY_SIZE, help="Recent messages kept in memory to replay to new and reconnecting clients")
+    parser.add_argument("--max-rooms", type=int, default=DEFAULT_MAX_ROOMS, help="Most rooms open at once; joins that would open another are refused")
     args = parser.parse_args()
 
-    asyncio.run(main(console_output=args.console))
+    try:
+        asyncio.run(main(console_output=args.console, queue_size=args.queue_size, slow_consumer_policy=args.slow_consumer_policy,
+                         flush_interval=args.history_flush_interval, durability=args.history_durability,
+                         replay_buffer_size=args.replay_size, room_limit=args.max_rooms, port=args.port,
+                         metrics_port=args.metrics_port, trace_file=args.trace_file))
+    except KeyboardInterrupt:
+        pass
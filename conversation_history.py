@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import logging
+from collections import Counter
+
+# What happens to the oldest turns once a history holds more than max_messages:
+#   drop:      forget them
+#   spill:     append them to a JSONL file on disk, then forget them
+#   summarize: replace them with a single summary turn
+RETENTION_DROP = "drop"
+RETENTION_SPILL = "spill"
+RETENTION_SUMMARIZE = "summarize"
+HISTORY_RETENTION_POLICIES = [RETENTION_DROP, RETENTION_SPILL, RETENTION_SUMMARIZE]
+
+DEFAULT_MAX_MESSAGES = 5000
+TRIM_FRACTION = 0.25  # Trim this much of max_messages at a time so trimming stays cheap on average
+
+SUMMARY_NAME = "summary"
+SUMMARY_EXCERPTS = 5
+EXCERPT_LENGTH = 200
+
+def intern(value):
+    # Sender names and roles repeat on every message; share one copy of each
+    return sys.intern(value) if isinstance(value, str) else value
+
+class HistoryEntry:
+    __slots__ = ("role", "name", "text", "seq")
+
+    def __init__(self, role, name, text, seq=None):
+        self.role = intern(role)
+        self.name = intern(name)
+        self.text = text
+        self.seq = seq  # The hub's sequence number, when the message came from the hub
+
+    @property
+    def parts(self):
+        # Built on demand so the text isn't stored twice
+        return [{"text": f"[{self.name}] {self.text}"}]
+
+    def to_dict(self):
+        return {"role": self.role, "name": self.name, "text": self.text}
+
+def summarize_entries(entries):
+    # Cheap local summary (no LLM call): who said how much, plus the last few things said
+    speakers = Counter(entry.name for entry in entries)
+    who = ", ".join(f"{name} ({count})" for name, count in speakers.most_common())
+    excerpts = "\n".join(f"[{entry.name}] {entry.text[:EXCERPT_LENGTH]}" for entry in entries[-SUMMARY_EXCERPTS:])
+    return f"Summary of {len(entries)} earlier messages from {who}. The last of them were:\n{excerpts}"
+
+class ConversationHistory:
+    """
+    The bot's record of the conversation in one room.
+
+    Entries are compact __slots__ records with interned names and roles. The provider-specific views
+    (Gemini and OpenAI message formats) aren't kept: each call builds them for just the window it asks
+    for, so the formatted "[name] text" copies only exist while a request is being made.
+
+    Memory is bounded by max_messages; the retention policy decides what happens to older turns.
+    """
+    def __init__(self, max_messages=DEFAULT_MAX_MESSAGES, retention=RETENTION_SPILL, spill_file=None, summarizer=summarize_entries):
+        if retention not in HISTORY_RETENTION_POLICIES:
+            raise ValueError(f"Unknown history retention policy: {retention}")
+        if retention == RETENTION_SPILL and spill_file is None:
+            retention = RETENTION_DROP
+
+        self.max_messages = max_messages
+        self.retention = retention
+        self.spill_file = spill_file
+        self.summarizer = summarizer
+
+        self.history = []
+        # Number of entries trimmed off the front, so cursors stay valid after a trim
+        self.trimmed = 0
+
+    def add_message(self, role, name, text, seq=None):
+        entry = HistoryEntry(role, name, text, seq=seq)
+        self.history.append(entry)
+        if self.max_messages is not None and len(self.history) > self.max_messages:
+            self.trim(max(1, int(self.max_messages * TRIM_FRACTION)))
+        return entry
+
+    def trim(self, count):
+        old = self.history[:count]
+        del self.history[:count]
+        self.trimmed += count
+
+        if self.retention == RETENTION_SPILL:
+            try:
+                with open(self.spill_file, 'a') as f:
+                    f.writelines(json.dumps(entry.to_dict()) + "\n" for entry in old)
+            except OSError as e:
+                logging.error(f"Couldn't spill {count} history entries to {self.spill_file}: {e}")
+        elif self.retention == RETENTION_SUMMARIZE:
+            # The summary stands in for the trimmed turns (including any earlier summary)
+            self.history.insert(0, HistoryEntry("user", SUMMARY_NAME, self.summarizer(old)))
+            self.trimmed -= 1
+
+        logging.debug(f"Trimmed {count} history entries ({self.retention})")
+
+    def __len__(self):
+        return len(self.history)
+
+    def cursor(self):
+        # Pass this to messages_since() or the `since` argument of the views later to get just what was added in between
+        return self.trimmed + len(self.history)
+
+    def index(self, cursor):
+        return max(cursor - self.trimmed, 0)
+
+    def messages_since(self, cursor):
+        return self.history[self.index(cursor):]
+
+    def window(self, limit, since):
+        # The last `limit` entries (all of them if limit < 0), or everything after the `since` cursor
+        if since is not None:
+            return self.history[self.index(since):]
+        if limit < 0:
+            return self.history
+        if limit == 0:
+            return []
+        return self.history[-limit:]
+
+    def get_history_gemini(self, limit=-1, since=None):
+        return [{"role": "model" if entry.role == "ai" else entry.role, "parts": entry.parts}
+                for entry in self.window(limit, since)]
+
+    def get_history_openai(self, limit=-1, since=None):
+        return [{"role": "assistant" if entry.role == "ai" else entry.role, "content": entry.text}
+                for entry in self.window(limit, since)]
+
+def spill_filename(bot_id, room_id):
+    os.makedirs(".bot-history", exist_ok=True)
+    return os.path.join(".bot-history", f"{bot_id}-{room_id}.jsonl")
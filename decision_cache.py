@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Override these with "decision_cache": {"max_entries": ..., "ttl": ..., "persist": true} in a bot's JSON file
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 15 * 60  # Seconds a decision stays valid
+CACHE_DIR = ".bot-cache"
+SAVE_DELAY = 5  # Seconds a persisted cache waits after a change before writing, so a burst of decisions is one write
+
+def decision_key(*parts):
+    # Content address for a moderator call: the same instructions, teammate and window always hash the same
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+def cache_filename(bot_id):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, f"decisions-{bot_id}.json")
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0  # Lookups that found an entry older than the TTL (also counted as misses)
+        self.evictions = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def to_dict(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate()
+        }
+
+    def __str__(self):
+        return (f"hits={self.hits} misses={self.misses} expired={self.expired} evictions={self.evictions} "
+                f"hit_rate={self.hit_rate():.0%}")
+
+class DecisionCache:
+    """
+    LRU cache of moderator decisions keyed on decision_key(...), so a moderator asked about a window it has
+    already judged answers locally instead of calling the LLM again. Entries expire after `ttl` seconds.
+
+    With a `path`, the cache is loaded from and written back to a JSON file, so it survives restarts. Values
+    must be JSON serializable. put() only marks the cache dirty; the file is written SAVE_DELAY seconds later
+    from a worker thread, so the event loop never waits on the disk. Call flush() at shutdown for the rest.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None, save_delay=SAVE_DELAY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_delay = save_delay
+        self.entries = OrderedDict()  # key -> (value, stored_at); stored_at is wall clock time so it can be persisted
+        self.stats = CacheStats()
+        self.dirty = False
+        self.save_task = None
+        self.save_lock = threading.Lock()  # The background write and flush() use the same temp file
+        if path is not None:
+            self.load()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        value, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            del self.entries[key]
+            self.stats.expired += 1
+            self.stats.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (value, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
+        if self.path is not None:
+            self.dirty = True
+            self.schedule_save()
+
+    def schedule_save(self):
+        if self.save_task is not None and not self.save_task.done():
+            return  # The pending save will pick this change up too
+        try:
+            self.save_task = asyncio.get_running_loop().create_task(self.save_later())
+        except RuntimeError:
+            self.flush()  # No event loop (a script using the cache directly)
+
+    async def save_later(self):
+        await asyncio.sleep(self.save_delay)
+        # Copied on the loop, so the worker thread doesn't read the entries while they change
+        snapshot = self.snapshot()
+        self.dirty = False
+        await asyncio.to_thread(self.save, snapshot)
+
+    def flush(self):
+        # Writes any change the background save hasn't yet
+        if self.path is not None and self.dirty:
+            self.dirty = False
+            self.save(self.snapshot())
+
+    def snapshot(self):
+        # Oldest first, so the LRU order survives the round trip
+        return [[key, value, stored_at] for key, (value, stored_at) in self.entries.items()]
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        # Saved oldest first, so the LRU order survives the round trip
+        for key, value, stored_at in stored:
+            if now - stored_at <= self.ttl:
+                self.entries[key] = (value, stored_at)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        logging.info(f"[cache] Loaded {len(self.entries)} moderator decisions from {self.path}")
+
+    def save(self, snapshot):
+        tmp_file = self.path + ".tmp"
+        with self.save_lock:
+            try:
+                with open(tmp_file, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_file, self.path)
+            except OSError as e:
+                logging.warning(f"[cache] Couldn't save moderator decisions to {self.path}: {e}")
+
+    def __len__(self):
+        return len(self.entries)
+
+def decision_cache_from_config(bot_id, settings=None):
+    # Builds a bot's cache from the "decision_cache" section of its JSON file; None turns caching off
+    settings = settings or {}
+    if not settings.get("enabled", True):
+        return None
+    path = cache_filename(bot_id) if settings.get("persist") else None
+    return DecisionCache(max_entries=int(settings.get("max_entries", DEFAULT_MAX_ENTRIES)),
+                         ttl=float(settings.get("ttl", DEFAULT_TTL)), path=path)
@@ -0,0 +1,157 @@
+"""
+In-memory stand-in for the parts of the OpenAI Assistants API the bots use (assistants, threads, messages and
+runs), for running OpenAI teammates offline. It keeps every thread's messages so you can check what a bot has
+synced, and counts the bytes of message content it was sent.
+
+    from fake_assistants import FakeAsyncOpenAI
+    client = FakeAsyncOpenAI()
+    handler = OpenAIAPIHandler(assistant_id="asst_fake", client=client, assistant=client.assistant)
+"""
+import json
+import itertools
+from types import SimpleNamespace
+
+_ids = itertools.count(1)
+
+def _new_id(prefix):
+    return f"{prefix}_{next(_ids)}"
+
+def _text_message(thread_id, role, content, run_id=None):
+    return SimpleNamespace(
+        id=_new_id("msg"),
+        thread_id=thread_id,
+        run_id=run_id,
+        role=role,
+        content=[SimpleNamespace(type="text", text=SimpleNamespace(value=content))]
+    )
+
+def _message_text(message):
+    return message.content[0].text.value
+
+async def _run_events(run, reply):
+    # The event sequence of a streamed run: created, the text in a few deltas, then completed
+    yield SimpleNamespace(event="thread.run.created", data=SimpleNamespace(id=run.id, thread_id=run.thread_id, status="queued", usage=None))
+    words = reply.split(" ")
+    for i in range(0, len(words), 3):
+        text = " ".join(words[i:i + 3]) + (" " if i + 3 < len(words) else "")
+        delta = SimpleNamespace(content=[SimpleNamespace(type="text", text=SimpleNamespace(value=text))])
+        yield SimpleNamespace(event="thread.message.delta", data=SimpleNamespace(delta=delta))
+    yield SimpleNamespace(event="thread.run.completed", data=run)
+
+def default_reply(messages):
+    # Stand-in for the model: say how much context the run saw and what it's answering
+    last = _message_text(messages[-1])[:40] if messages else ""
+    return f"Reply to {len(messages)} messages (last: {last})"
+
+class FakeAssistants:
+    def __init__(self, client):
+        self.client = client
+
+    async def retrieve(self, assistant_id):
+        return self.client.assistant
+
+class FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, thread_id, role, content):
+        return self.client.add_message(thread_id, role, content)
+
+    async def list(self, thread_id, run_id=None, order="desc", limit=20):
+        messages = [m for m in self.client.threads[thread_id] if run_id is None or m.run_id == run_id]
+        if order == "desc":
+            messages = messages[::-1]
+        return SimpleNamespace(data=messages[:limit])
+
+class FakeRuns:
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, thread_id, assistant_id, additional_messages=None, truncation_strategy=None, stream=False):
+        for message in additional_messages or []:
+            self.client.add_message(thread_id, message["role"], message["content"])
+        return self.client.run(thread_id, truncation_strategy, stream)
+
+    async def retrieve(self, thread_id, run_id):
+        return self.client.runs[run_id]
+
+class FakeThreads:
+    def __init__(self, client):
+        self.client = client
+        self.messages = FakeMessages(client)
+        self.runs = FakeRuns(client)
+
+    async def create(self, messages=None):
+        thread_id = self.client.new_thread(messages)
+        return SimpleNamespace(id=thread_id)
+
+    async def create_and_run(self, assistant_id, thread=None, truncation_strategy=None, stream=False):
+        thread_id = self.client.new_thread((thread or {}).get("messages"))
+        return self.client.run(thread_id, truncation_strategy, stream)
+
+    async def delete(self, thread_id):
+        self.client.threads.pop(thread_id, None)
+        return SimpleNamespace(id=thread_id, deleted=True)
+
+class FakeAsyncOpenAI:
+    """
+    Drop-in for AsyncOpenAI as far as OpenAIAPIHandler is concerned. Runs complete immediately (streamed runs
+    yield their events straight away); `reply` builds the assistant's answer from the messages the run can see
+    (after truncation).
+    """
+    def __init__(self, reply=default_reply, model="gpt-fake", instructions="You are a helpful teammate."):
+        self.reply = reply
+        self.assistant = SimpleNamespace(id="asst_fake", model=model, instructions=instructions, temperature=1.0, top_p=1.0)
+        self.threads = {}
+        self.runs = {}
+        self.bytes_uploaded = 0
+        self.messages_uploaded = 0
+        self.requests = 0
+        self.beta = SimpleNamespace(assistants=FakeAssistants(self), threads=FakeThreads(self))
+
+    def new_thread(self, messages=None):
+        thread_id = _new_id("thread")
+        self.threads[thread_id] = []
+        for message in messages or []:
+            self.add_message(thread_id, message["role"], message["content"])
+        return thread_id
+
+    def add_message(self, thread_id, role, content):
+        if not content:
+            raise ValueError("Message content must be non-empty")
+        message = _text_message(thread_id, role, content)
+        self.threads[thread_id].append(message)
+        self.bytes_uploaded += len(content.encode())
+        self.messages_uploaded += 1
+        return message
+
+    def run(self, thread_id, truncation_strategy=None, stream=False):
+        self.requests += 1
+        visible = self.threads[thread_id]
+        if truncation_strategy and truncation_strategy.get("type") == "last_messages":
+            visible = visible[-truncation_strategy["last_messages"]:]
+
+        run_id = _new_id("run")
+        reply = self.reply(visible)
+        message = _text_message(thread_id, "assistant", reply, run_id=run_id)
+        self.threads[thread_id].append(message)
+
+        prompt_tokens = sum(len(_message_text(m)) for m in visible) // 4
+        run = SimpleNamespace(
+            id=run_id,
+            thread_id=thread_id,
+            status="completed",
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(reply) // 4,
+                                  total_tokens=prompt_tokens + len(reply) // 4)
+        )
+        self.runs[run_id] = run
+        if stream:
+            return _run_events(run, reply)
+        return run
+
+    def thread_contents(self, thread_id):
+        # [(role, text), ...] in the order they were added
+        return [(m.role, _message_text(m)) for m in self.threads[thread_id]]
+
+    def stats(self):
+        return json.dumps({"requests": self.requests, "messages_uploaded": self.messages_uploaded, "bytes_uploaded": self.bytes_uploaded})
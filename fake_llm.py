@@ -0,0 +1,234 @@
+"""
+Stand-in LLM provider for load tests. FakeLLMServer is a small local HTTP server that answers moderator and
+teammate calls after a configurable latency, streams replies at a fixed token rate and counts every call.
+FakeGenAI is a drop-in for the parts of google.generativeai the bots use; it sends every call to the server, so
+Gemini bots run fully offline:
+
+    python fake_llm.py --port 9700 --latency 0.5 --tokens-per-second 50
+
+    import bot
+    from fake_llm import FakeGenAI
+    bot.PROVIDERS["gemini"] = FakeGenAI("http://localhost:9700")
+"""
+import json
+import random
+import asyncio
+import logging
+import argparse
+from types import SimpleNamespace
+
+import httpx
+
+DEFAULT_PORT = 9700
+DEFAULT_LATENCY = 0.5  # Seconds before the first token
+DEFAULT_TOKENS_PER_SECOND = 50
+DEFAULT_REPLY_TOKENS = 40
+DEFAULT_YES_RATE = 0.2  # Share of moderator calls (and single-call turns) that let the teammate speak
+CHUNK_TOKENS = 4  # Tokens per streamed chunk
+
+WORDS = "sure I can take a look at that and get back to the team with a summary of what we found today".split()
+
+class FakeLLMServer:
+    """
+    POST /generate with {"kind": "moderator" | "teammate" | "turn", "prompt": "...", "stream": bool} answers with
+    newline-delimited JSON: {"text": ...} chunks, then {"usage": {...}}. GET /stats returns the call counts.
+    """
+    def __init__(self, host="localhost", port=DEFAULT_PORT, latency=DEFAULT_LATENCY, tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+                 reply_tokens=DEFAULT_REPLY_TOKENS, yes_rate=DEFAULT_YES_RATE, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.yes_rate = yes_rate
+        self.random = random.Random(seed)
+        self.server = None
+        self.calls = {"moderator": 0, "teammate": 0, "turn": 0}
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logging.info(f"Fake LLM server listening on {self.url()}")
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def stats(self):
+        return {
+            "moderator_calls": self.calls["moderator"],
+            "teammate_calls": self.calls["teammate"],
+            "turn_calls": self.calls["turn"],
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens
+        }
+
+    def answer(self, kind):
+        if kind == "moderator":
+            if self.random.random() < self.yes_rate:
+                return "YES|You should respond to the latest question from the team."
+            return "NO"
+        if kind == "turn" and self.random.random() >= self.yes_rate:
+            # A single-call teammate that decided not to speak
+            return "PASS"
+        return " ".join(self.random.choice(WORDS) for _ in range(self.reply_tokens))
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode().split()
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            method, path = request_line[0], request_line[1]
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+            if method == "GET" and path == "/stats":
+                writer.write(json.dumps(self.stats()).encode() + b"\n")
+            elif method == "POST" and path == "/generate":
+                await self.generate(json.loads(body), writer)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Calls still in flight when the load test shuts the server down are cancelled; end them quietly
+            pass
+        finally:
+            writer.close()
+
+    async def generate(self, request, writer):
+        kind = request.get("kind", "teammate")
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        prompt_tokens = max(1, len(request.get("prompt", "")) // 4)
+        self.prompt_tokens += prompt_tokens
+
+        await asyncio.sleep(self.latency)
+        words = self.answer(kind).split(" ")
+        chunks = [words[i:i + CHUNK_TOKENS] for i in range(0, len(words), CHUNK_TOKENS)]
+        if not request.get("stream"):
+            chunks = [words]
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                await asyncio.sleep(len(chunk) / self.tokens_per_second)
+            text = " ".join(chunk) + (" " if i + 1 < len(chunks) else "")
+            writer.write(json.dumps({"text": text}).encode() + b"\n")
+            await writer.drain()
+
+        self.output_tokens += len(words)
+        writer.write(json.dumps({"usage": {"prompt_tokens": prompt_tokens, "output_tokens": len(words)}}).encode() + b"\n")
+
+def contents_text(contents):
+    # Flattens Gemini-style contents (a string, or [{"role": ..., "parts": [{"text": ...}]}]) for the request
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(part.get("text", "") for entry in contents for part in entry.get("parts", []))
+
+def usage_metadata(usage):
+    return SimpleNamespace(prompt_token_count=usage["prompt_tokens"], candidates_token_count=usage["output_tokens"],
+                           total_token_count=usage["prompt_tokens"] + usage["output_tokens"])
+
+class FakeStream:
+    # What send_message_async(stream=True) returns: an async iterable of chunks with usage once it's done
+    def __init__(self, response):
+        self.response = response
+        self.usage_metadata = None
+
+    async def __aiter__(self):
+        try:
+            async for line in self.response.aiter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if "usage" in message:
+                    self.usage_metadata = usage_metadata(message["usage"])
+                else:
+                    yield SimpleNamespace(text=message["text"])
+        finally:
+            await self.response.aclose()
+
+class FakeChat:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = history or []
+
+    async def send_message_async(self, message, stream=False):
+        prompt = contents_text(self.history) + "\n" + message
+        # Single-call teammates (bot.turn_prompt) decide and reply at once, and may PASS
+        kind = "turn" if "respond with exactly PASS" in message else "teammate"
+        if stream:
+            return FakeStream(await self.model.genai.open(kind, prompt, stream=True))
+        return await self.model.genai.generate(kind, prompt)
+
+class FakeModel:
+    def __init__(self, genai, model_name, generation_config=None, system_instruction=None):
+        self.genai = genai
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    async def generate_content_async(self, contents):
+        # Only moderators make one-off calls; teammates go through a chat
+        return await self.genai.generate("moderator", contents_text(contents))
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+class FakeGenAI:
+    """
+    Takes the place of the google.generativeai module in bot.PROVIDERS["gemini"]. The attribute names follow
+    the SDK's, so the bots don't know the difference.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.client = None
+
+    def configure(self, **kwargs):
+        pass
+
+    def GenerationConfig(self, **kwargs):
+        return kwargs
+
+    def GenerativeModel(self, model_name, generation_config=None, system_instruction=None):
+        return FakeModel(self, model_name, generation_config, system_instruction)
+
+    def get_client(self):
+        # Created on first use so it belongs to the event loop making the calls
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=None))
+        return self.client
+
+    async def open(self, kind, prompt, stream=False):
+        client = self.get_client()
+        request = client.build_request("POST", f"{self.url}/generate", json={"kind": kind, "prompt": prompt, "stream": stream})
+        return await client.send(request, stream=True)
+
+    async def generate(self, kind, prompt):
+        response = FakeStream(await self.open(kind, prompt))
+        text = "".join([chunk.text async for chunk in response])
+        return SimpleNamespace(text=text, usage_metadata=response.usage_metadata)
+
+async def serve_forever(server):
+    await server.start()
+    await asyncio.Future()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake LLM provider for offline load tests")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_TOKENS_PER_SECOND, help="Streaming speed")
+    parser.add_argument("--reply-tokens", type=int, default=DEFAULT_REPLY_TOKENS, help="Length of a teammate reply")
+    parser.add_argument("--yes-rate", type=float, default=DEFAULT_YES_RATE, help="Share of moderator calls answered YES")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = FakeLLMServer(port=args.port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                           reply_tokens=args.reply_tokens, yes_rate=args.yes_rate)
+    try:
+        asyncio.run(serve_forever(server))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
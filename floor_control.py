@@ -0,0 +1,283 @@
+import os
+import json
+import asyncio
+import websockets
+import argparse
+import logging
+import google.generativeai as genai
+from google.generativeai.types import generation_types
+
+from rate_limiter import configure_rate_limiter, estimate_tokens, TokenUsage
+from conversation_history import ConversationHistory, RETENTION_DROP
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename='floor_control.log', filemode='a')
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+logging.getLogger().addHandler(console_handler)
+
+MODEL = "gemini-1.5-flash-latest"
+FLOOR_CONTROL_ID = "floor_control"
+FLOOR_CONTROL_NAME = "Floor Control"
+DEBOUNCE_WINDOW = 3  # Seconds of quiet after a new message before picking who speaks
+MAX_COALESCE_WINDOW = 15  # Longest a continuous burst of messages can hold off a decision
+MENTION_WINDOW = 0.5  # Seconds of quiet after someone @mentions a teammate before granting it the floor
+MAX_RETRIES = 5  # Maximum number of retries for WebSocket connection
+KEEPALIVE_INTERVAL = 120
+RECENT_HISTORY_NUMBER = 25  # Messages the moderator sees per decision
+MAX_HISTORY = 500  # Messages kept per room; the moderator only ever looks at the recent ones
+MAX_SPEAKERS = 2  # Most AI teammates granted the floor per window, so one message doesn't set off every bot at once
+REPLAY_COUNT = 50
+DEFAULT_ROOM = "main"
+
+def parse_grants(response, roster, max_speakers=MAX_SPEAKERS):
+    """
+    Turns the moderator's answer into {teammate_id: summary}. The answer is one 'NAME|summary' line per
+    teammate who should speak, or NONE. Names are matched case-insensitively against the room's AI teammates;
+    anything else is ignored.
+    """
+    ids_by_name = {name.lower(): _id for _id, name in roster.items()}
+    grants = {}
+    for line in response.splitlines():
+        if '|' not in line:
+            continue
+        name, summary = line.split('|', 1)
+        _id = ids_by_name.get(name.strip(" *-[]'\"").lower())
+        if _id is None or _id in grants or not summary.strip():
+            continue
+        grants[_id] = summary.strip()
+        if len(grants) >= max_speakers:
+            break
+    return grants
+
+def mention_summary(name, message):
+    # The grant's summary for a teammate someone @mentioned, in the same form as the moderator's
+    return (f"Your name is {name} and you should respond in this chat. {message.get('from')} mentioned you directly; "
+            f"here is what they wrote: {message.get('message', '')}")
+
+class FloorRoom:
+    """
+    What floor control keeps per room: the AI teammates in it and a short rolling history.
+    """
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.roster = {}  # id -> name of the AI teammates currently in the room
+        self.conversation_history = ConversationHistory(max_messages=MAX_HISTORY, retention=RETENTION_DROP)
+        self.pending = 0  # Actionable messages since the last decision
+        self.ready = asyncio.Event()
+        self.decisions = 0
+        self.grants = 0
+        # Teammates @mentioned since the last decision, with the summary their grant will carry
+        self.mentioned = {}
+        self.mention_grants = 0  # Grants handed out for a mention, without a moderator call
+
+class FloorControl:
+    """
+    One moderator for every AI teammate on the hub. Instead of each bot asking its own moderator "should I
+    speak?" after every burst of messages (one LLM call per bot), floor control waits for the burst to settle,
+    asks a single moderator which teammates should speak, and sends each of them a floor_grant with the summary
+    of what they're being asked.
+    """
+    def __init__(self, hub_uri, system_instructions, extra_params, rooms=None, max_speakers=MAX_SPEAKERS, rate_limit=None):
+        self.hub_uri = hub_uri
+        self.max_speakers = max_speakers
+
+        temperature = float(extra_params.get("temperature"))
+        top_p = float(extra_params.get("top_p"))
+        config = generation_types.GenerationConfig(temperature=temperature, top_p=top_p)
+        self.model = genai.GenerativeModel(MODEL, generation_config=config, system_instruction=system_instructions)
+        self.rate_limiter = configure_rate_limiter("gemini", rate_limit)
+        self.usage = TokenUsage("floor control")
+
+        self.rooms = {room_id: FloorRoom(room_id) for room_id in rooms or [DEFAULT_ROOM]}
+
+    async def connect(self):
+        retries = 0
+        while retries < MAX_RETRIES:
+            try:
+                async with websockets.connect(self.hub_uri, ping_interval=KEEPALIVE_INTERVAL) as websocket:
+                    connect_msg = {
+                        "type": "ai_connect",
+                        "name": FLOOR_CONTROL_NAME,
+                        "id": FLOOR_CONTROL_ID,
+                        "origin": "moderator",
+                        "rooms": list(self.rooms.keys()),
+                        "replay": REPLAY_COUNT,
+                        "roster": True
+                    }
+                    await websocket.send(json.dumps(connect_msg))
+
+                    tasks = [asyncio.create_task(self.process_room(websocket, room)) for room in self.rooms.values()]
+                    try:
+                        async for message in websocket:
+                            self.handle_message(message)
+                    finally:
+                        for task in tasks:
+                            task.cancel()
+            except websockets.exceptions.ConnectionClosedError as e:
+                logging.error(f"Floor control WebSocket connection error: {e}")
+                retries += 1
+                logging.info(f"Floor control retrying connection ({retries}/{MAX_RETRIES})...")
+                await asyncio.sleep(5)
+            except Exception as e:
+                logging.error(f"Unexpected error: {e}")
+                break
+
+    def handle_message(self, message_obj_str):
+        try:
+            message = json.loads(message_obj_str)
+            msg_type = message.get("type")
+            room = self.rooms.get(message.get("room", DEFAULT_ROOM))
+            if room is None:
+                return
+
+            if msg_type == "room_roster":
+                # Sent when we join; every join/leave after that comes in as an event
+                room.roster = {m["id"]: m["name"] for m in message.get("members", []) if m.get("origin") == "ai"}
+                logging.info(f"Floor control roster for {room.room_id}: {list(room.roster.values())}")
+
+            elif msg_type == "history_replay":
+                # Context only; the conversation before we connected doesn't need a decision
+                for replayed in message.get("messages", []):
+                    self.add_message(room, replayed)
+
+            elif msg_type == "msg_recvd":
+                if self.add_message(room, message):
+                    # The hub resolves @mentions to ids. Mentioned teammates get the floor without asking the
+                    # moderator; a message addressed only to people doesn't need a decision at all.
+                    mentions = message.get("mentions", [])
+                    mentioned = {_id: mention_summary(room.roster[_id], message) for _id in mentions if _id in room.roster}
+                    if mentions and not mentioned:
+                        return
+                    room.mentioned.update(mentioned)
+                    room.pending += 1
+                    room.ready.set()
+        except Exception as e:
+            logging.error(f"Error handling message: {e}")
+
+    def add_message(self, room, message):
+        # Returns whether the message is something a teammate might need to respond to
+        teammate = message.get("teammate")
+        if message.get("event") == "joined" and teammate and teammate.get("origin") == "ai":
+            room.roster[teammate["id"]] = teammate["name"]
+        elif message.get("event") == "left" and teammate:
+            room.roster.pop(teammate["id"], None)
+
+        text = message.get("message", "")
+        if message.get("event") is not None or text.startswith("[EVENT]"):
+            return False
+
+        sender = message.get("from")
+        room.conversation_history.add_message("user", room.roster.get(sender, sender), text, seq=message.get("seq"))
+        # Teammates' replies are context for the next decision but don't trigger one, otherwise every
+        # grant would set off another round of replies
+        return message.get("origin") != "ai" and sender not in room.roster
+
+    async def wait_for_messages(self, room):
+        # Same debounce as the bots' own schedulers: wake on the first message, then wait for a quiet window
+        loop = asyncio.get_running_loop()
+        while room.pending == 0:
+            room.ready.clear()
+            await room.ready.wait()
+
+        deadline = loop.time() + MAX_COALESCE_WINDOW
+        while True:
+            seen = room.pending
+            room.ready.clear()
+            window = MENTION_WINDOW if room.mentioned else DEBOUNCE_WINDOW
+            timeout = min(window, deadline - loop.time())
+            if timeout <= 0:
+                break
+            try:
+                await asyncio.wait_for(room.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if room.pending == seen:
+                break
+
+        count = room.pending
+        room.pending = 0
+        return count
+
+    async def decide(self, room):
+        if not room.roster:
+            return {}
+
+        recent_history = room.conversation_history.get_history_gemini(limit=RECENT_HISTORY_NUMBER)
+        history_text = "\n".join(entry["parts"][0]["text"] for entry in recent_history)
+        names = ", ".join(room.roster.values())
+
+        prompt = (f"The AI teammates in this chat are: {names}.\n\n"
+                  f"Based on the following conversation, which of them (if any) should speak next?\n\n{history_text}\n\n"
+                  f"Pick at most {self.max_speakers}. For each teammate who should speak, write one line in the form "
+                  f"'NAME|Your name is NAME and you should respond in this chat. Here is what is being asked of you: <summary>'. "
+                  f"If nobody should speak, respond with 'NONE'.")
+
+        # Stateless call: the prompt already carries the recent history, so there's no chat session to grow
+        response = await self.rate_limiter.call(lambda: self.model.generate_content_async(prompt), estimate_tokens(prompt),
+                                                usage=lambda r: r.usage_metadata.total_token_count)
+        metadata = response.usage_metadata
+        self.usage.record(metadata.prompt_token_count, metadata.candidates_token_count)
+        answer = response.text.strip()
+        logging.info(f"Floor control decision for {room.room_id}: {answer}")
+        return parse_grants(answer, room.roster, self.max_speakers)
+
+    async def process_room(self, websocket, room):
+        while True:
+            count = await self.wait_for_messages(room)
+            try:
+                mentioned, room.mentioned = room.mentioned, {}
+                if mentioned:
+                    # Everyone who was asked directly speaks, even past max_speakers; they were named
+                    grants = {_id: summary for _id, summary in mentioned.items() if _id in room.roster}
+                    room.mention_grants += 1
+                else:
+                    grants = await self.decide(room)
+                    room.decisions += 1
+                if not grants:
+                    continue
+
+                room.grants += len(grants)
+                await websocket.send(json.dumps({
+                    "type": "floor_grant",
+                    "from": FLOOR_CONTROL_ID,
+                    "room": room.room_id,
+                    "to": list(grants.keys()),
+                    "grants": grants
+                }))
+                logging.info(f"Floor control granted {room.room_id} to {[room.roster.get(_id) for _id in grants]} "
+                             f"after {count} messages (decisions={room.decisions} mention_grants={room.mention_grants} grants={room.grants})")
+            except websockets.exceptions.ConnectionClosedError as e:
+                logging.error(f"Floor control WebSocket connection error: {e}")
+                break
+            except Exception as e:
+                logging.error(f"Error deciding who speaks in {room.room_id}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Floor control: one moderator that decides which AI teammates speak")
+    parser.add_argument("--hub_uri", type=str, default="ws://localhost:9999", help="WebSocket URI of the hub")
+    parser.add_argument("--instruction-file", type=str, default="instructions/floor_control_instructions.txt", help="The moderator instruction file")
+    parser.add_argument("--extra-params", type=str, default='{"temperature": "0.2", "top_p": "1.0"}', help="A stringified JSON object with the moderator's temperature and top_p")
+    parser.add_argument("--rooms", type=str, default=DEFAULT_ROOM, help="Comma-delimited list of rooms to moderate")
+    parser.add_argument("--max-speakers", type=int, default=MAX_SPEAKERS, help="Most teammates granted the floor per message window")
+    parser.add_argument("--rate-limit", type=str, default="{}", help="A stringified JSON object with Gemini's requests per minute ('rpm') and tokens per minute ('tpm')")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.instruction_file):
+        logging.error(f"[!] Instruction file {args.instruction_file} does not exist!")
+        exit(-1)
+    with open(args.instruction_file, "r") as f:
+        inst = f.read()
+
+    genai.configure(api_key=os.environ['GOOGLE_DEV_API_KEY'])
+
+    floor_control = FloorControl(hub_uri=args.hub_uri, system_instructions=inst, extra_params=json.loads(args.extra_params),
+                                 rooms=args.rooms.split(","), max_speakers=args.max_speakers, rate_limit=json.loads(args.rate_limit))
+    try:
+        asyncio.run(floor_control.connect())
+    except KeyboardInterrupt:
+        logging.info("Floor control interrupted and stopped.")
+
+if __name__ == "__main__":
+    main()
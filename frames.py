@@ -0,0 +1,57 @@
+import json
+
+# orjson is a lot faster than the stdlib for the small dicts we pass around, but it's optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_CODEC = "orjson" if orjson is not None else "json"
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj):
+    # Always return a str so frames go out as websocket text frames (the React app expects text, not a Blob)
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj)
+
+class Frame:
+    """
+    An outgoing message that is encoded once and then shared, as the same str object, by every recipient's send.
+    """
+    __slots__ = ("message", "data")
+
+    def __init__(self, message):
+        self.message = message
+        self.data = dumps(message)
+
+def chat_frame(message, timestamp, seq=None, room_id=None):
+    # Takes a parsed msg_recvd message from a client and stamps it for forwarding
+    message["timestamp"] = timestamp
+    if room_id is not None:
+        message["room"] = room_id
+    if seq is not None:
+        message["seq"] = seq
+    return Frame(message)
+
+def event_frame(system_id, text, timestamp, seq=None, room_id=None, event=None, teammate=None):
+    message = {
+        "type": "msg_recvd",
+        "from": system_id,
+        "origin": system_id,
+        "message": f"[EVENT] {text}",
+        "timestamp": timestamp
+    }
+    if event is not None:
+        # Machine-readable version of the event (e.g. "joined" with the teammate's id, name and origin)
+        message["event"] = event
+        message["teammate"] = teammate
+    if room_id is not None:
+        message["room"] = room_id
+    if seq is not None:
+        message["seq"] = seq
+    return Frame(message)
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import logging
+
+from metrics import Counter, Histogram
+
+# Durability modes, from fastest to safest:
+#   none:  hand each batch to the OS and let it decide when to hit the disk
+#   flush: flush Python's buffer after every batch (same guarantee the hub had before)
+#   fsync: flush and fsync after every batch, so a committed batch survives a power loss
+DURABILITY_NONE = "none"
+DURABILITY_FLUSH = "flush"
+DURABILITY_FSYNC = "fsync"
+DURABILITY_MODES = [DURABILITY_NONE, DURABILITY_FLUSH, DURABILITY_FSYNC]
+
+DEFAULT_FLUSH_INTERVAL = 0.25  # Seconds to gather records into one batch (group commit window)
+DEFAULT_MAX_BATCH = 1024
+
+_STOP = object()
+
+HISTORY_WRITE_SECONDS = Histogram("hub_history_write_seconds", "Time to commit one batch of chat history records to disk")
+HISTORY_RECORDS_WRITTEN = Counter("hub_history_records_written_total", "Chat history records committed to disk")
+
+class HistoryWriter:
+    """
+    Background persistence stage for the chat history.
+
+    The hub calls write() from the event loop, which only puts the record on an in-memory queue. A
+    single writer task owns the chat log: it gathers whatever arrives within flush_interval into a batch
+    and commits the batch from a worker thread, so the hub loop never blocks on disk.
+    """
+    def __init__(self, log, flush_interval=DEFAULT_FLUSH_INTERVAL, durability=DURABILITY_FLUSH, max_batch=DEFAULT_MAX_BATCH):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+
+        self.log = log
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.max_batch = max_batch
+
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.closing = False
+
+        self.records_written = 0
+        self.batches_written = 0
+
+    def start(self):
+        self.log.open()
+        self.task = asyncio.create_task(self.run())
+        logging.info(f"History writer started for {self.log.log_path} (flush interval {self.flush_interval}s, durability {self.durability})")
+
+    def write(self, record):
+        if self.closing:
+            logging.warning(f"History writer is shutting down; dropping record: {record!r}")
+            return
+        self.queue.put_nowait(record)
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    async def run(self):
+        stopping = False
+        while not stopping:
+            record = await self.queue.get()
+            batch = []
+            if record is _STOP:
+                stopping = True
+            else:
+                batch.append(record)
+                # Group commit: give other records a chance to arrive before paying for the write
+                if self.flush_interval > 0:
+                    await asyncio.sleep(self.flush_interval)
+
+            while len(batch) < self.max_batch and not self.queue.empty():
+                record = self.queue.get_nowait()
+                if record is _STOP:
+                    stopping = True
+                    continue
+                batch.append(record)
+
+            if batch:
+                try:
+                    started = time.monotonic()
+                    await asyncio.to_thread(self.commit, batch)
+                    HISTORY_WRITE_SECONDS.observe(time.monotonic() - started)
+                    HISTORY_RECORDS_WRITTEN.inc(len(batch))
+                except Exception as e:
+                    logging.error(f"Error writing {len(batch)} records to {self.log.log_path}: {e}")
+
+    def commit(self, batch):
+        # Runs in a worker thread
+        self.log.append_batch(batch,
+                              flush=self.durability in [DURABILITY_FLUSH, DURABILITY_FSYNC],
+                              fsync=self.durability == DURABILITY_FSYNC)
+        self.records_written += len(batch)
+        self.batches_written += 1
+
+    async def close(self):
+        # Drain everything that's been queued, then close the log
+        if self.task is None or self.closing:
+            return
+        self.closing = True
+        self.queue.put_nowait(_STOP)
+        await self.task
+        self.log.close()
+        logging.info(f"History writer closed {self.log.log_path} ({self.records_written} records in {self.batches_written} batches)")
@@ -0,0 +1,179 @@
+"""
+Just enough of Prometheus for the hub and bots: counters, gauges and histograms with labels, rendered in the
+text exposition format and served over HTTP by start_metrics_server (GET /metrics). Metrics register themselves
+with the process-wide REGISTRY when they're created; values that already live elsewhere (connection counts,
+queue depths, scheduler stats) are copied in by collectors right before each scrape.
+
+    MESSAGES_IN = Counter("hub_messages_in_total", "Messages received from clients", ["type"])
+    MESSAGES_IN.inc(type="msg_recvd")
+"""
+import math
+import time
+import asyncio
+import logging
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def on_collect(self, collector):
+        # `collector()` runs before every scrape, to copy current values into gauges and counters
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logging.error(f"[metrics] Collector failed: {e}")
+        return "".join(metric.render() for metric in self.metrics)
+
+REGISTRY = Registry()
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}  # Label values (in self.labels order) -> value
+        registry.register(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def clear(self):
+        # Forget every label set, e.g. before a collector re-adds the connections that still exist
+        self.values.clear()
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield "", key, None, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labels, key, extra)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # Only for collectors mirroring a total that's counted somewhere else
+        self.values[self.key(labels)] = value
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class HistogramTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        if key not in self.values:
+            self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+        entry = self.values[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry["buckets"][i] += 1
+                break
+        entry["sum"] += value
+        entry["count"] += 1
+
+    def time(self, **labels):
+        # with HISTOGRAM.time(bot="alex"): ...
+        return HistogramTimer(self, labels)
+
+    def samples(self):
+        for key, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                cumulative += count
+                yield "_bucket", key, {"le": format_value(bound)}, cumulative
+            yield "_sum", key, None, entry["sum"]
+            yield "_count", key, None, entry["count"]
+
+async def handle_scrape(reader, writer, registry):
+    try:
+        request_line = (await reader.readline()).decode().split()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # Headers aren't needed
+
+        if len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split("?")[0] == "/metrics":
+            body = registry.render().encode()
+            status = "200 OK"
+        else:
+            body = b"Not found; metrics are at /metrics\n"
+            status = "404 Not Found"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(port, host="localhost", registry=REGISTRY):
+    server = await asyncio.start_server(lambda r, w: handle_scrape(r, w, registry), host, port)
+    logging.info(f"[metrics] Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
+
+async def run_with_metrics(coro, port=None):
+    # Serves metrics for as long as `coro` runs; no server when port is None
+    server = await start_metrics_server(port) if port else None
+    try:
+        return await coro
+    finally:
+        if server is not None:
+            server.close()
@@ -0,0 +1,218 @@
+import time
+import random
+import asyncio
+import inspect
+import logging
+
+from metrics import Counter
+
+# Defaults per provider; override them with "rate_limit": {"rpm": ..., "tpm": ...} in a bot's JSON file.
+# The Gemini numbers are the free plan's limits for Flash.
+DEFAULT_LIMITS = {
+    "gemini": {"rpm": 15, "tpm": 1000000},
+    "gpt": {"rpm": 60, "tpm": 150000},
+}
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 2  # Seconds
+BACKOFF_CAP = 60  # Seconds
+
+TOKENS = Counter("bot_tokens_total", "Tokens sent to (in) and generated by (out) the LLM", ["bot", "role", "direction"])
+
+def estimate_tokens(text):
+    # Rough rule of thumb: ~4 characters per token
+    return max(1, len(text) // 4)
+
+class TokenUsage:
+    """
+    Running token counts for one caller (e.g. a teammate's moderator), taken from each response's usage data.
+    """
+    def __init__(self, label, bot=None, role=None):
+        self.label = label
+        # Labels for the bot_tokens_total metric
+        self.bot = bot or label
+        self.role = role or "other"
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.last_prompt_tokens = 0
+        self.last_output_tokens = 0
+
+    def record(self, prompt_tokens, output_tokens):
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens or 0
+        self.output_tokens += output_tokens or 0
+        self.last_prompt_tokens = prompt_tokens or 0
+        self.last_output_tokens = output_tokens or 0
+        TOKENS.inc(self.last_prompt_tokens, bot=self.bot, role=self.role, direction="in")
+        TOKENS.inc(self.last_output_tokens, bot=self.bot, role=self.role, direction="out")
+        logging.info(f"[usage] {self.label}: {self.last_prompt_tokens} prompt + {self.last_output_tokens} output tokens ({self})")
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "last_output_tokens": self.last_output_tokens
+        }
+
+    def __str__(self):
+        average = (self.prompt_tokens + self.output_tokens) / self.calls if self.calls else 0
+        return f"calls={self.calls} prompt_tokens={self.prompt_tokens} output_tokens={self.output_tokens} avg_per_call={average:.0f}"
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def resize(self, per_minute):
+        # New limit, same bucket: what's already been spent stays spent
+        self.refill()
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = min(self.tokens, self.capacity)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Seconds until `amount` is available. Requests bigger than the whole bucket only wait for a full bucket.
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.refill()
+        self.tokens -= amount
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets for one provider, shared by every teammate and
+    moderator in the process (see get_rate_limiter). Calls go out as soon as both buckets have room, and a
+    429 from the provider pauses everyone sharing the limiter until the retry-after time has passed.
+    """
+    def __init__(self, provider, rpm, tpm):
+        self.provider = provider
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0
+        self.lock = asyncio.Lock()
+        # Limits bots explicitly asked for (see configure_rate_limiter); anything missing is the provider default
+        self.configured = {}
+
+    def configure(self, rpm, tpm):
+        self.requests.resize(rpm)
+        self.tokens.resize(tpm)
+
+    async def acquire(self, estimated_tokens):
+        # One caller waits at a time so requests go out in order and no one gets starved
+        async with self.lock:
+            while True:
+                wait = max(self.blocked_until - time.monotonic(),
+                           self.requests.wait_time(1),
+                           self.tokens.wait_time(estimated_tokens))
+                if wait <= 0:
+                    break
+                logging.debug(f"[{self.provider}] Rate limiter waiting {wait:.1f}s")
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        # Settle up once the provider tells us how many tokens the call really used
+        if actual_tokens:
+            self.tokens.take(actual_tokens - estimated_tokens)
+
+    def back_off(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def call(self, fn, estimated_tokens, usage=None):
+        """
+        Calls `fn` (sync or async, no arguments) once the budget allows, retrying rate limit errors with
+        jittered exponential backoff. `usage` pulls the actual token count out of the result.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(estimated_tokens)
+            try:
+                result = fn()
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                retry_after = get_retry_after(e)
+                if retry_after is not None:
+                    delay = max(delay, retry_after) + random.uniform(0, 1)
+                self.back_off(delay)
+                attempt += 1
+                logging.warning(f"[{self.provider}] Rate limited; retrying in {delay:.1f}s ({attempt}/{MAX_RETRIES})")
+                continue
+
+            if usage is not None:
+                try:
+                    self.record_usage(estimated_tokens, usage(result))
+                except Exception as e:
+                    logging.debug(f"[{self.provider}] Couldn't read token usage: {e}")
+            return result
+
+def is_rate_limit_error(e):
+    # openai.RateLimitError has status_code 429; google.api_core's ResourceExhausted has code 429
+    if getattr(e, "status_code", None) == 429:
+        return True
+    code = getattr(e, "code", None)
+    if code == 429 or getattr(code, "value", None) == 429:
+        return True
+    return type(e).__name__ in ["RateLimitError", "ResourceExhausted", "TooManyRequests"]
+
+def get_retry_after(e):
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+RATE_LIMITERS = {}
+
+def get_rate_limiter(provider):
+    if provider not in RATE_LIMITERS:
+        limits = DEFAULT_LIMITS.get(provider, DEFAULT_LIMITS["gpt"])
+        RATE_LIMITERS[provider] = RateLimiter(provider, limits["rpm"], limits["tpm"])
+    return RATE_LIMITERS[provider]
+
+def configure_rate_limiter(provider, limits=None):
+    """
+    Applies a bot's "rate_limit" to the provider's limiter, which every bot in the process shares (bot_host.py
+    runs several). The strictest value any of them asks for wins, so the order bots load in doesn't matter, and
+    a bot without its own limits leaves the current ones alone. The buckets are resized rather than rebuilt, so
+    configuring never hands out a fresh budget.
+    """
+    limiter = get_rate_limiter(provider)
+    requested = {key: limits[key] for key in ["rpm", "tpm"] if key in (limits or {})}
+    configured = dict(limiter.configured)
+    for key, value in requested.items():
+        configured[key] = min(value, configured.get(key, value))
+    if configured == limiter.configured:
+        return limiter
+
+    if any(configured[key] != value for key, value in requested.items()):
+        logging.warning(f"[{provider}] Another bot in this process asked for a stricter rate limit than {requested}; keeping the stricter one")
+    limiter.configured = configured
+    effective = dict(DEFAULT_LIMITS.get(provider, DEFAULT_LIMITS["gpt"]), **configured)
+    limiter.configure(effective["rpm"], effective["tpm"])
+    logging.info(f"[{provider}] Rate limit set to {effective['rpm']} requests/min and {effective['tpm']} tokens/min")
+    return limiter
@@ -0,0 +1,62 @@
+from collections import deque
+from itertools import islice
+
+from frames import dumps
+
+DEFAULT_REPLAY_SIZE = 500  # Frames kept in memory for replay
+DEFAULT_REPLAY_COUNT = 50  # Frames sent to a new client that doesn't say how many it wants
+
+class ReplayBuffer:
+    """
+    Bounded ring buffer of recently broadcast frames, kept as the already-encoded strings.
+
+    Frames are appended in sequence order and sequence numbers are contiguous, so finding the frames
+    after a given seq is arithmetic rather than a search. A replay is built by splicing the stored
+    strings into one history_replay frame, so nothing gets encoded twice.
+    """
+    def __init__(self, maxlen=DEFAULT_REPLAY_SIZE):
+        self.maxlen = maxlen
+        self.frames = deque(maxlen=maxlen)
+        self.first_seq = None
+        self.last_seq = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def append(self, seq, data):
+        if self.frames and seq != self.last_seq + 1:
+            # Sequence numbers jumped (shouldn't happen); start over so the arithmetic stays valid
+            self.frames.clear()
+        self.frames.append(data)
+        self.last_seq = seq
+        self.first_seq = seq - len(self.frames) + 1
+
+    def last(self, count):
+        if count <= 0:
+            return []
+        return list(islice(self.frames, max(len(self.frames) - count, 0), None))
+
+    def since(self, seq):
+        # Frames with a sequence number greater than `seq`. Also reports whether some of them had
+        # already fallen out of the buffer.
+        if not self.frames or seq >= self.last_seq:
+            return [], False
+        start = seq + 1 - self.first_seq
+        if start < 0:
+            return list(self.frames), True
+        return list(islice(self.frames, start, None)), False
+
+    def replay_frame(self, count=DEFAULT_REPLAY_COUNT, since_seq=None, room_id=None, recipient=None):
+        # `recipient` tags the frame with the teammate it's for, for connections shared by several teammates
+        truncated = False
+        if since_seq is not None:
+            frames, truncated = self.since(since_seq)
+        else:
+            frames = self.last(count)
+        room = ',"room":' + dumps(room_id) if room_id is not None else ''
+        room += ',"for":' + dumps(recipient) if recipient is not None else ''
+        return (
+            '{"type":"history_replay"' + room + ',"last_seq":' + str(self.last_seq) +
+            ',"truncated":' + ("true" if truncated else "false") +
+            ',"messages":[' + ",".join(frames) + ']}'
+        )
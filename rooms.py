@@ -0,0 +1,56 @@
+import re
+
+DEFAULT_ROOM = "main"
+
+# Room IDs end up in file paths for the room's history, so keep them boring
+ROOM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# "@Jasper", "@jasper," or "@alex's"; matched against members' names and ids, ignoring case
+MENTION_PATTERN = re.compile(r"@([A-Za-z0-9_-]+)")
+
+def is_valid_room_id(room_id):
+    return isinstance(room_id, str) and ROOM_ID_PATTERN.match(room_id) is not None
+
+def requested_rooms(message):
+    # Connect messages can carry "rooms": [...] or a single "room"; older clients send neither
+    rooms = message.get("rooms")
+    if not rooms:
+        rooms = [message.get("room", DEFAULT_ROOM)]
+    return rooms
+
+def since_seq_for_room(message, room_id):
+    # "since_seq" is either a single sequence number (single-room clients) or a {room_id: seq} dict
+    since_seq = message.get("since_seq")
+    if isinstance(since_seq, dict):
+        return since_seq.get(room_id)
+    return since_seq
+
+class Room:
+    """
+    An independent chat on the hub: its own members (the fan-out set), history log and replay buffer.
+    """
+    def __init__(self, room_id, history_writer, replay_buffer):
+        self.room_id = room_id
+        self.members = {}
+        self.history_writer = history_writer
+        self.replay_buffer = replay_buffer
+
+    def save_message_to_history(self, sender_id, sender_name, message, origin, is_system_event=False):
+        # Only builds the record (and assigns its sequence number); the history writer task batches it to disk in the background
+        record = self.history_writer.log.make_record(sender_id, sender_name, message, origin, is_system_event=is_system_event)
+        self.history_writer.write(record)
+        return record
+
+    def resolve_mentions(self, text, sender_id=None):
+        # Ids of the members a message @mentions, in the order they're mentioned. Names that aren't in the
+        # room (and the sender mentioning themselves) are left out.
+        if not isinstance(text, str) or "@" not in text:
+            return []
+        mentioned = []
+        for token in MENTION_PATTERN.findall(text):
+            token = token.lower()
+            for _id, member in self.members.items():
+                if token in (member.name.lower(), _id.lower()) and _id != sender_id and _id not in mentioned:
+                    mentioned.append(_id)
+                    break
+        return mentioned
@@ -3,7 +3,24 @@ import json
 import subprocess
 import signal
 import time
+import asyncio
 import argparse
+from collections import deque
+
+import websockets
+
+RESTART_BACKOFF_BASE = 1  # Seconds before restarting a crashed process; doubles with each crash in a row
+RESTART_BACKOFF_MAX = 60
+STABLE_UPTIME = 60  # A process that ran this long before exiting counts as healthy again (backoff resets)
+MAX_RESTARTS = 5  # Restarts allowed within RESTART_WINDOW seconds before the supervisor waits STORM_COOLDOWN
+RESTART_WINDOW = 300
+STORM_COOLDOWN = 600
+PROBE_INTERVAL = 30  # Seconds between liveness probes through the hub
+PROBE_GRACE = 30  # Time a new process gets to connect to the hub before probes count against it
+PROBE_FAILURES = 3  # Failed probes in a row before a process whose bots aren't on the hub is restarted
+PROBE_TIMEOUT = 5
+STATUS_INTERVAL = 300  # Seconds between status reports
+STOP_TIMEOUT = 10  # Seconds a process gets to exit after SIGINT before it's killed
 
 def load_bot_configs(directory, bot_names):
     bot_configs = []
@@ -27,33 +44,221 @@ def start_bot(config):
         "--moderator-instruction-file", config["moderator_instruction_file"],
         "--teammate-extra-params", json.dumps(config["teammate_extra_params"]),
         "--mod-extra-params", json.dumps(config["mod_extra_params"]),
-        "--llm", config["llm"]
+        "--llm", config["llm"],
+        "--rooms", ",".join(config.get("rooms", ["main"])),
+        "--rate-limit", json.dumps(config.get("rate_limit", {})),
+        "--history", json.dumps(config.get("history", {})),
+        "--decision-cache", json.dumps(config.get("decision_cache", {}))
+    ]
+    if config.get("floor_control"):
+        cmd.append("--floor-control")
+    if config.get("single_call"):
+        cmd.append("--single-call")
+    if config.get("metrics_port"):
+        cmd += ["--metrics-port", str(config["metrics_port"])]
+    return subprocess.Popen(cmd)
+
+def start_bot_host(bot_names, multiplex):
+    # Every selected bot in one process (see bot_host.py)
+    cmd = ["python", "bot_host.py", "--bots", bot_names]
+    if multiplex:
+        cmd.append("--multiplex")
+    return subprocess.Popen(cmd)
+
+def start_floor_control(config, rooms):
+    # One shared moderator for every bot that has "floor_control": true
+    cmd = [
+        "python", "floor_control.py",
+        "--hub_uri", config.get("hub_uri", "ws://localhost:9999"),
+        "--instruction-file", config["instruction_file"],
+        "--extra-params", json.dumps(config["extra_params"]),
+        "--rooms", ",".join(sorted(rooms)),
+        "--rate-limit", json.dumps(config.get("rate_limit", {}))
     ]
+    if "max_speakers" in config:
+        cmd += ["--max-speakers", str(config["max_speakers"])]
     return subprocess.Popen(cmd)
 
+async def hub_presence(hub_uri):
+    # IDs of everyone connected to the hub, or None if the hub can't be reached
+    try:
+        async with websockets.connect(hub_uri, open_timeout=PROBE_TIMEOUT) as websocket:
+            await websocket.send(json.dumps({"type": "who"}))
+            reply = json.loads(await asyncio.wait_for(websocket.recv(), PROBE_TIMEOUT))
+            return {teammate["id"] for teammate in reply.get("teammates", [])}
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+        return None
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+class SupervisedProcess:
+    """
+    One child process (a bot, the bot host or floor control) and its restart history. `ids` are the hub IDs
+    the process should have connected, so probes can tell a live process from one that's lost the hub.
+    """
+    def __init__(self, name, ids, start):
+        self.name = name
+        self.ids = ids
+        self.start_process = start
+        self.process = None
+        self.started_at = None
+        self.next_start = 0
+        self.restarts = 0
+        self.crashes_in_a_row = 0
+        self.recent_restarts = deque()
+        self.missing_probes = 0
+        self.last_exit_code = None
+
+    def start(self):
+        self.process = self.start_process()
+        self.started_at = time.monotonic()
+        self.missing_probes = 0
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def uptime(self):
+        return time.monotonic() - self.started_at if self.running() else 0
+
+    def stop(self):
+        if not self.running():
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+class Supervisor:
+    """
+    Starts the child processes and keeps them running: a process that exits is restarted with exponential
+    backoff, a process that keeps crashing is left alone for STORM_COOLDOWN, and a process whose bots have
+    disappeared from the hub is restarted too. Uptime and restart counts are reported every STATUS_INTERVAL.
+    """
+    def __init__(self, hub_uri, probe_interval=PROBE_INTERVAL, status_interval=STATUS_INTERVAL):
+        self.hub_uri = hub_uri
+        self.probe_interval = probe_interval
+        self.status_interval = status_interval
+        self.children = []
+
+    def add(self, name, ids, start):
+        self.children.append(SupervisedProcess(name, ids, start))
+
+    def run(self):
+        next_probe = time.monotonic() + self.probe_interval
+        next_status = time.monotonic() + self.status_interval
+        while True:
+            now = time.monotonic()
+            self.check(now)
+            if self.probe_interval and now >= next_probe:
+                self.probe()
+                next_probe = now + self.probe_interval
+            if now >= next_status:
+                self.report()
+                next_status = now + self.status_interval
+            time.sleep(1)
+
+    def check(self, now):
+        for child in self.children:
+            if child.process is None:
+                if now >= child.next_start:
+                    child.start()
+                continue
+            exit_code = child.process.poll()
+            if exit_code is not None:
+                self.schedule_restart(child, exit_code, now)
+
+    def schedule_restart(self, child, exit_code, now):
+        uptime = now - child.started_at
+        child.process = None
+        child.last_exit_code = exit_code
+        if uptime >= STABLE_UPTIME:
+            child.crashes_in_a_row = 0
+
+        delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** child.crashes_in_a_row)
+        child.crashes_in_a_row += 1
+
+        while child.recent_restarts and now - child.recent_restarts[0] > RESTART_WINDOW:
+            child.recent_restarts.popleft()
+        if len(child.recent_restarts) >= MAX_RESTARTS:
+            # Restart storm: something is persistently wrong (bad config, the hub is down, no API quota)
+            delay = STORM_COOLDOWN
+            child.recent_restarts.clear()
+            print(f"[supervisor] {child.name} restarted {MAX_RESTARTS} times in {RESTART_WINDOW}s; waiting {STORM_COOLDOWN}s before trying again")
+        child.recent_restarts.append(now)
+
+        child.restarts += 1
+        child.next_start = now + delay
+        print(f"[supervisor] {child.name} exited with code {exit_code} after {format_duration(uptime)}; restarting in {delay}s")
+
+    def probe(self):
+        present = asyncio.run(hub_presence(self.hub_uri))
+        if present is None:
+            # Nothing to learn about the bots; they'll reconnect (or exit and be restarted) on their own
+            print(f"[supervisor] Hub at {self.hub_uri} isn't reachable; skipping liveness probe")
+            return
+
+        for child in self.children:
+            if not child.running() or child.uptime() < PROBE_GRACE:
+                continue
+            missing = [_id for _id in child.ids if _id not in present]
+            if not missing:
+                child.missing_probes = 0
+                continue
+            child.missing_probes += 1
+            if child.missing_probes >= PROBE_FAILURES:
+                print(f"[supervisor] {child.name} is running but {', '.join(missing)} hasn't been on the hub for {PROBE_FAILURES} probes; restarting it")
+                child.stop()  # Restarted by the next check()
+
+    def report(self):
+        print("[supervisor] Status:")
+        for child in self.children:
+            state = "running" if child.running() else f"waiting to restart (last exit code {child.last_exit_code})"
+            print(f"    {child.name:24} {state:45} uptime {format_duration(child.uptime())}  restarts {child.restarts}")
+
+    def stop(self):
+        for child in self.children:
+            child.stop()
+
 def main():
     parser = argparse.ArgumentParser(description="Start AI Bots")
     parser.add_argument("--bots", type=str, default="*", help="Comma-delimited list of bot names to load (default: all bots)")
+    parser.add_argument("--single-process", action="store_true", help="Run all the bots in one process instead of one process per bot")
+    parser.add_argument("--multiplex", action="store_true", help="With --single-process, share one hub connection between the bots")
+    parser.add_argument("--probe-interval", type=int, default=PROBE_INTERVAL, help="Seconds between liveness probes through the hub (0 to turn them off)")
+    parser.add_argument("--status-interval", type=int, default=STATUS_INTERVAL, help="Seconds between uptime/restart reports")
     args = parser.parse_args()
 
     bot_names = args.bots.split(",") if args.bots != "*" else "*"
-    bot_configs = load_bot_configs("bots", bot_names)
-    processes = []
+    bot_configs = [config for config in load_bot_configs("bots", bot_names) if "id" in config]  # Only bot configs
+    hub_uri = bot_configs[0]["hub_uri"] if bot_configs else "ws://localhost:9999"
+    supervisor = Supervisor(hub_uri, probe_interval=args.probe_interval, status_interval=args.status_interval)
 
-    try:
+    if args.single_process:
+        supervisor.add("bot_host", [config["id"] for config in bot_configs], lambda: start_bot_host(args.bots, args.multiplex))
+    else:
         for config in bot_configs:
-            if "id" in config:  # It's a bot config
-                process = start_bot(config)
-                processes.append(process)
-        
-        # Keep the script running
-        while True:
-            time.sleep(1)
+            supervisor.add(config["name"], [config["id"]], lambda config=config: start_bot(config))
+
+    floor_rooms = set()
+    for config in bot_configs:
+        if config.get("floor_control"):
+            floor_rooms.update(config.get("rooms", ["main"]))
+    if floor_rooms:
+        with open(os.path.join("bots", "moderator.json"), 'r') as file:
+            floor_config = json.load(file)["floor_control"]
+        supervisor.add("floor_control", ["floor_control"], lambda: start_floor_control(floor_config, floor_rooms))
+
+    try:
+        supervisor.run()
     except KeyboardInterrupt:
         print("Stopping all bots...")
-        for process in processes:
-            process.send_signal(signal.SIGINT)
-            process.wait()
+        supervisor.stop()
+        supervisor.report()
         print("All bots stopped.")
 
 if __name__ == "__main__":
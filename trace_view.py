@@ -0,0 +1,102 @@
+import argparse
+
+from tracing import load_traces
+
+BAR_WIDTH = 50
+
+def root_record(records):
+    # The hub's record for the message itself (as opposed to spans bots filed under it)
+    for record in records:
+        if record["name"] == "hub.fanout":
+            return record
+    return None
+
+def find_trace(traces, msg_id=None, seq=None, room=None):
+    if msg_id is not None:
+        return msg_id if msg_id in traces else None
+
+    # Newest matching message from a person (bot replies show up inside their parent's trace)
+    candidates = []
+    for trace_id, records in traces.items():
+        root = root_record(records)
+        if root is None:
+            continue
+        attrs = root["attrs"]
+        if seq is not None and (attrs.get("seq") != seq or (room is not None and attrs.get("room") != room)):
+            continue
+        if seq is None and attrs.get("origin") == "ai":
+            continue
+        candidates.append((root["start"], trace_id))
+    return max(candidates)[1] if candidates else None
+
+def replies_to(traces, msg_id):
+    return [records for records in traces.values()
+            if (root := root_record(records)) is not None and root["attrs"].get("parent") == msg_id]
+
+def span_label(record):
+    attrs = record["attrs"]
+    if record["name"] == "bot.moderator":
+        return f"{record['name']} ({'speak' if attrs.get('spoke') else 'pass'})"
+    if record["name"] == "bot.generate" and attrs.get("passed"):
+        return f"{record['name']} (pass)"
+    if record["name"] == "bot.generate" and attrs.get("ttft") is not None:
+        return f"{record['name']} (ttft {attrs['ttft'] * 1000:.0f}ms)"
+    if record["name"] == "bot.queue" and attrs.get("skipped"):
+        return f"{record['name']} (skipped)"
+    return record["name"]
+
+def print_waterfall(traces, msg_id):
+    records = list(traces[msg_id])
+    root = root_record(records)
+    # A reply's own fan-out belongs in its parent's waterfall
+    for reply in replies_to(traces, msg_id):
+        reply_root = root_record(reply)
+        records.append(dict(reply_root, name=f"reply from {reply_root['attrs'].get('sender')}"))
+    records.sort(key=lambda r: (r["start"], r["end"]))
+
+    start = min(r["start"] for r in records)
+    end = max(r["end"] for r in records)
+    total = max(end - start, 1e-6)
+
+    if root is not None:
+        attrs = root["attrs"]
+        print(f"Message {msg_id} in #{attrs.get('room')} (seq {attrs.get('seq')}) from {attrs.get('sender')}: {attrs.get('text')!r}")
+    else:
+        print(f"Message {msg_id} (the hub's record of it isn't in the file)")
+    print(f"{'':28}{'':18} 0s{'':{BAR_WIDTH - 8}}{total:.2f}s")
+
+    for record in records:
+        offset = int((record["start"] - start) / total * BAR_WIDTH)
+        length = max(1, int((record["end"] - record["start"]) / total * BAR_WIDTH))
+        bar = " " * offset + "#" * min(length, BAR_WIDTH - offset)
+        print(f"{span_label(record)[:27]:28}{record['process'][:17]:18}|{bar:{BAR_WIDTH}}| "
+              f"{'+' + format((record['start'] - start) * 1000, '.0f') + 'ms':>9} {(record['end'] - record['start']) * 1000:9.1f}ms")
+
+def print_recent(traces, count):
+    roots = sorted((root for records in traces.values() if (root := root_record(records)) is not None), key=lambda r: r["start"])
+    for root in roots[-count:]:
+        attrs = root["attrs"]
+        print(f"{root['trace']}  #{attrs.get('room')} seq {attrs.get('seq'):<6} {attrs.get('sender'):>12}: {(attrs.get('text') or '')[:60]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a waterfall of where a chat message's time went, from a hub trace file")
+    parser.add_argument("trace_file", type=str, help="The file the hub was started with (--trace-file)")
+    parser.add_argument("--id", type=str, default=None, help="Message id (msg_id) to show")
+    parser.add_argument("--seq", type=int, default=None, help="Show the message with this sequence number instead")
+    parser.add_argument("--room", type=str, default=None, help="Room for --seq")
+    parser.add_argument("--list", type=int, default=None, metavar="N", help="List the last N traced messages and exit")
+    args = parser.parse_args()
+
+    traces = load_traces(args.trace_file)
+    if args.list is not None:
+        print_recent(traces, args.list)
+        return
+
+    msg_id = find_trace(traces, msg_id=args.id, seq=args.seq, room=args.room)
+    if msg_id is None:
+        print("No matching message in the trace file")
+        exit(1)
+    print_waterfall(traces, msg_id)
+
+if __name__ == "__main__":
+    main()
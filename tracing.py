@@ -0,0 +1,78 @@
+import json
+import uuid
+import asyncio
+import logging
+
+# Trace records, one JSON object per line:
+#   {"trace": "<msg_id>", "name": "hub.fanout", "process": "hub", "start": 1716570000.1, "end": 1716570000.2, "attrs": {...}}
+# A trace is everything that happened because of one chat message, keyed by the msg_id the hub gave it.
+# Times are wall clock seconds so spans from different processes on the same machine line up.
+
+DEFAULT_FLUSH_INTERVAL = 0.5  # Seconds between writes to the trace file
+
+def new_message_id():
+    return uuid.uuid4().hex[:16]
+
+def span(trace_id, name, process, start, end, **attrs):
+    return {"trace": trace_id, "name": name, "process": process, "start": start, "end": end, "attrs": attrs}
+
+class TraceWriter:
+    """
+    Appends trace records to a JSONL file. record() only buffers; a background task writes the buffer out
+    every flush_interval from a worker thread, so the hub loop never waits on the disk.
+    """
+    def __init__(self, path, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.file = None
+        self.task = None
+        self.records_written = 0
+
+    def start(self):
+        self.file = open(self.path, "a")
+        self.task = asyncio.create_task(self.run())
+        logging.info(f"Writing message traces to {self.path}")
+
+    def record(self, record):
+        self.buffer.append(record)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        try:
+            await asyncio.to_thread(self.write, batch)
+        except Exception as e:
+            logging.error(f"Error writing {len(batch)} trace records to {self.path}: {e}")
+
+    def write(self, batch):
+        # Runs in a worker thread
+        self.file.write("".join(json.dumps(record) + "\n" for record in batch))
+        self.file.flush()
+        self.records_written += len(batch)
+
+    async def close(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await self.flush()
+        self.file.close()
+        logging.info(f"Trace writer closed {self.path} ({self.records_written} records)")
+
+def load_traces(path):
+    # {trace_id: [records...]} from a trace file
+    traces = {}
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut off by a crash
+            traces.setdefault(record["trace"], []).append(record)
+    return traces